@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# Apache 2.0.
+# Generates multi-condition training data on the fly. The utterances of a
+# wav.scp are corrupted with the impulse responses and noises of an
+# impulses_noises_dir (created by local/multi_condition/prepare_impulses_noises.sh),
+# which are assigned to the utterances as in
+# local/multi_condition/reverberate_wavs.py. The corruption itself is done in
+# memory by a pool of worker processes with the python DSP of
+# local/multi_condition/corrupt.py, not by wav-reverberate, so the waveforms
+# are not the same as those of the commands of reverberate_wavs.py.
+# They are written as a Kaldi wave archive ("<key> <RIFF wave>" entries) to
+# stdout or to the clients of a local socket. Every epoch draws a new
+# assignment of impulse responses, so the corrupted copies never have to be
+# written to disk, e.g.
+#   local/multi_condition/augmentation_server.py --num-jobs 8 data/train/wav.scp \
+#     data_multicondition/impulses_noises | compute-mfcc-feats ark:- ark:mfcc.ark
+# or, serving one epoch to each client that connects,
+#   local/multi_condition/augmentation_server.py --socket /tmp/augment.sock ... &
+#   compute-mfcc-feats --config=conf/mfcc.conf "ark:nc -U /tmp/augment.sock |" ark:mfcc.ark
+
+import argparse, collections, io, multiprocessing, os, socket, sys
+import numpy as np
+import corrupt
+from reverberate_wavs import list_cyclic_iterator, return_nonempty_lines, read_impulse_noise_index
+
+# seed of the random noise offsets, or None to add the noises from their
+# first samples
+random_noise_offset_seed = None
+
+def load_wav(rxfilename):
+  # reads the wave file of a wav.scp entry, which is a file name or a
+  # command ending with a pipe
+  rxfilename = rxfilename.strip()
+  if rxfilename.endswith('|'):
+    return corrupt.wave_load_from_pipe(rxfilename[:-1])
+  try:
+    with open(rxfilename, 'rb') as wav_file:
+      return corrupt.wave_load_from_bytes(wav_file.read())
+  except IOError:
+    return None
+
+def first_channel(wave):
+  # (sampling_rate, samples) tuple with only the first channel of the samples
+  samples = wave[1][:, 0]
+  return (wave[0], samples.reshape([samples.shape[0], 1]))
+
+def corrupt_utterance(job):
+  # corrupts the wave of an utterance with an impulse response and a noise
+  # (or None), and returns its archive entry, or None if it failed
+  (epoch, index, key, rxfilename, impulse_file, noise_file, snr) = job
+  try:
+    x = load_wav(rxfilename)
+    if x is None:
+      sys.stderr.write('{0}: could not read the wave of {1}: {2}\n'.format(sys.argv[0], key, rxfilename))
+      return None
+    if x[1].shape[1] > 1:
+      raise Exception('Input wave file cannot be multi-channel')
+    h = first_channel(corrupt.wave_cache.get(impulse_file))
+    n = None
+    noise_offset = 0
+    if noise_file is not None:
+      n = first_channel(corrupt.wave_cache.get(noise_file))
+      if random_noise_offset_seed is not None:
+        noise_offset = np.random.RandomState([random_noise_offset_seed, epoch, index]).randint(n[1].shape[0])
+    y = corrupt.corrupt(x, h, n, snr, impulse_file, noise_offset)
+    wave_bytes = io.BytesIO()
+    corrupt.wav_write(wave_bytes, x[0], y)
+    return key + ' ' + wave_bytes.getvalue()
+  except Exception as e:
+    sys.stderr.write('{0}: could not corrupt {1}: {2}\n'.format(sys.argv[0], key, e))
+    return None
+
+class CorruptionAssigner:
+  # assigns impulse responses, noises and snrs to the utterances as
+  # reverberate_wavs.py does. The impulse responses are shuffled anew for
+  # every epoch, and the noises and snrs continue cycling from epoch to epoch.
+  def __init__(self, impulses_noises_dir, snrs, random_seed):
+    self.random_seed = random_seed
+    self.add_noise = not (len(snrs) == 1 and snrs[0] == 'inf')
+    self.snrs = list_cyclic_iterator(snrs)
+    self.impulse_files = return_nonempty_lines(open(impulses_noises_dir+'/info/impulse_files').readlines())
+    self.impulse_noise_index = read_impulse_noise_index(impulses_noises_dir)
+
+  def get_jobs(self, epoch, wav_files):
+    impulses = list_cyclic_iterator(list(self.impulse_files), random_seed = self.random_seed + epoch)
+    for index, (key, rxfilename) in enumerate(wav_files):
+      impulse_file = impulses.next()
+      noise_file = None
+      snr = None
+      if self.add_noise:
+        for impulses_set, noises in self.impulse_noise_index:
+          if impulse_file in impulses_set:
+            noise_file = noises.next()
+            snr = float(self.snrs.next())
+            break
+      yield (epoch, index, key, rxfilename, impulse_file, noise_file, snr)
+
+def write_archive(out, jobs, pool, buffer_size):
+  # writes the archive entries of the jobs to the file out, in order. Only
+  # buffer_size jobs are queued at a time, so a slow reader does not make
+  # the corrupted waves pile up in memory. If writing fails, e.g. because
+  # the reader went away, the queued jobs are waited for (their results are
+  # dropped) before the error is raised, so that the pool is idle and can be
+  # reused or closed.
+  num_done = 0
+  pending = collections.deque()
+  def write(entry):
+    if entry is not None:
+      out.write(entry)
+      return 1
+    return 0
+  try:
+    for job in jobs:
+      if pool is None:
+        num_done += write(corrupt_utterance(job))
+        continue
+      pending.append(pool.apply_async(corrupt_utterance, (job,)))
+      if len(pending) >= buffer_size:
+        num_done += write(pending.popleft().get())
+    while len(pending) > 0:
+      num_done += write(pending.popleft().get())
+    out.flush()
+  except (IOError, socket.error):
+    for result in pending:
+      result.wait()
+    raise
+  return num_done
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = 'Stream corrupted copies of the waves of a wav.scp as a Kaldi wave archive')
+  parser.add_argument('--snrs', type=str, default = '20:10:0', help='snrs to be used for corruption, or inf for no noise')
+  parser.add_argument('--random-seed', type = int, default = 0, help = 'seed to be used in the randomization of impulses')
+  parser.add_argument('--random-noise-offset', type = str, default = 'False', help = 'if true, the added noises start at random samples of the noise files', choices = ['True', 'true', 'False', 'false'])
+  parser.add_argument('--num-epochs', type = int, default = 1, help = 'number of epochs (passes over the wav.scp) to generate, or 0 to serve until killed')
+  parser.add_argument('--socket', type = str, default = None, help = 'if given, the path of a local socket that serves one epoch to each client that connects, instead of writing the epochs to stdout')
+  parser.add_argument('--num-jobs', type = int, default = 1, help = 'number of processes that corrupt the waves')
+  parser.add_argument('--buffer-size', type = int, default = 0, help = 'number of utterances that are corrupted ahead of the output (default: 4 times --num-jobs)')
+  parser.add_argument('--cache-size', type = int, default = 100, help = 'number of decoded RIR and noise files kept in memory by each process')
+  parser.add_argument('--fft-cache-size', type = int, default = 200, help = 'number of frequency responses of RIRs kept in memory by each process')
+  parser.add_argument('wav_file_list', type=str, help='wav.scp file to corrupt')
+  parser.add_argument('impulses_noises_dir', type=str, help='directory with impulses and noises and info directory (created by local/prep_rirs.sh)')
+  params = parser.parse_args()
+
+  if params.num_jobs <= 0 or params.num_epochs < 0 or params.buffer_size < 0:
+    sys.stderr.write("%s: Error: --num-jobs must be positive and --num-epochs and --buffer-size non-negative\n" % sys.argv[0])
+    sys.exit(1)
+  buffer_size = params.buffer_size if params.buffer_size > 0 else 4 * params.num_jobs
+
+  wav_files = []
+  for line in return_nonempty_lines(open(params.wav_file_list, 'r').readlines()):
+    parts = line.split(None, 1)
+    if len(parts) != 2:
+      sys.stderr.write("%s: Error: bad line in %s: %s\n" % (sys.argv[0], params.wav_file_list, line))
+      sys.exit(1)
+    wav_files.append((parts[0], parts[1]))
+  assigner = CorruptionAssigner(params.impulses_noises_dir, params.snrs.split(':'), params.random_seed)
+
+  # the caches and settings are set before the worker processes are forked,
+  # so that they share them
+  corrupt.wave_cache = corrupt.LruCache(corrupt.wave_load, params.cache_size)
+  corrupt.rir_convolver = corrupt.FftConvolver(params.fft_cache_size)
+  if params.random_noise_offset.lower() == 'true':
+    random_noise_offset_seed = params.random_seed
+
+  pool = multiprocessing.Pool(params.num_jobs) if params.num_jobs > 1 else None
+
+  epoch = 0
+  if params.socket is None:
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    while params.num_epochs == 0 or epoch < params.num_epochs:
+      try:
+        num_done = write_archive(out, assigner.get_jobs(epoch, wav_files), pool, buffer_size)
+      except IOError:
+        # the reader closed the pipe
+        sys.stderr.write("%s: epoch %d: the reader closed the output\n" % (sys.argv[0], epoch))
+        break
+      sys.stderr.write("%s: epoch %d: wrote %d of %d utterances\n" % (sys.argv[0], epoch, num_done, len(wav_files)))
+      epoch += 1
+  else:
+    if os.path.exists(params.socket):
+      os.remove(params.socket)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(params.socket)
+    server.listen(1)
+    sys.stderr.write("%s: serving on %s\n" % (sys.argv[0], params.socket))
+    try:
+      while params.num_epochs == 0 or epoch < params.num_epochs:
+        connection = server.accept()[0]
+        out = connection.makefile('wb')
+        try:
+          num_done = write_archive(out, assigner.get_jobs(epoch, wav_files), pool, buffer_size)
+          sys.stderr.write("%s: epoch %d: wrote %d of %d utterances\n" % (sys.argv[0], epoch, num_done, len(wav_files)))
+        except (IOError, socket.error):
+          sys.stderr.write("%s: epoch %d: the client disconnected\n" % (sys.argv[0], epoch))
+        try:
+          out.close()
+        except (IOError, socket.error):
+          pass
+        connection.close()
+        epoch += 1
+    finally:
+      server.close()
+      os.remove(params.socket)
+
+  if pool is not None:
+    pool.close()
+    pool.join()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Apache 2.0.
+# Tests of augmentation_server.py, e.g.
+#   python local/multi_condition/augmentation_server_test.py
+
+import os, shutil, socket, subprocess, sys, tempfile, time, unittest
+import numpy as np
+import scipy.io.wavfile
+
+server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'augmentation_server.py')
+
+@unittest.skipIf(sys.version_info[0] >= 3, 'augmentation_server.py is a python 2 script')
+class AugmentationServerTest(unittest.TestCase):
+  def setUp(self):
+    # a wav.scp of 30 utterances, some of them long enough that their
+    # archive entries do not fit in a pipe buffer, and an impulses_noises_dir
+    # with two impulse responses, one of them with noises
+    self.dir = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    def write_wav(name, length):
+      path = os.path.join(self.dir, name)
+      scipy.io.wavfile.write(path, 8000, (rng.randn(length) * 3000).astype(np.int16))
+      return path
+    rirs = [ write_wav('rir0.wav', 800), write_wav('rir1.wav', 1200) ]
+    noises = [ write_wav('noise0.wav', 5000), write_wav('noise1.wav', 3000) ]
+    os.mkdir(os.path.join(self.dir, 'info'))
+    with open(os.path.join(self.dir, 'info', 'impulse_files'), 'w') as f:
+      f.write('\n'.join(rirs) + '\n')
+    with open(os.path.join(self.dir, 'info', 'noise_impulse_0'), 'w') as f:
+      f.write('noise_files = ' + ' '.join(noises) + '\n')
+      f.write('impulse_files = ' + rirs[0] + '\n')
+    utterances = [ write_wav('utt%d.wav' % i, length) for i, length in enumerate([ 3000, 20000, 150000 ]) ]
+    self.wav_scp = os.path.join(self.dir, 'wav.scp')
+    with open(self.wav_scp, 'w') as f:
+      for i in range(30):
+        f.write('utt%d cat %s |\n' % (i, utterances[i % 3]))
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def run_server(self, options):
+    return subprocess.Popen([ sys.executable, server ] + options + [ self.wav_scp, self.dir ], \
+        stdout = subprocess.PIPE, stderr = open(os.devnull, 'w'))
+
+  def wait(self, process, timeout):
+    # returns the exit status, or None if the process is still running
+    # after timeout seconds, which it is killed after
+    end = time.time() + timeout
+    while process.poll() is None and time.time() < end:
+      time.sleep(0.1)
+    if process.poll() is None:
+      process.kill()
+      process.wait()
+      return None
+    return process.returncode
+
+  def test_archive(self):
+    process = self.run_server([ '--num-jobs', '2' ])
+    data = process.stdout.read()
+    self.assertEqual(self.wait(process, 60), 0)
+    # every entry is "<key> <RIFF wave>"
+    keys = []
+    pos = 0
+    while pos < len(data):
+      space = data.index(' ', pos)
+      keys.append(data[pos:space])
+      self.assertEqual(data[space + 1:space + 5], 'RIFF')
+      size = np.frombuffer(data[space + 5:space + 9], dtype = '<u4')[0] + 8
+      pos = space + 1 + size
+    self.assertEqual(keys, [ 'utt%d' % i for i in range(30) ])
+
+  def test_reader_closes_early(self):
+    for num_epochs in ('1', '0'):
+      process = self.run_server([ '--num-jobs', '2', '--num-epochs', num_epochs ])
+      self.assertEqual(len(process.stdout.read(1000)), 1000)
+      process.stdout.close()
+      self.assertEqual(self.wait(process, 60), 0)
+
+  def test_socket_client_disconnects(self):
+    socket_name = os.path.join(self.dir, 'augment.sock')
+    process = self.run_server([ '--num-jobs', '2', '--num-epochs', '3', '--socket', socket_name ])
+    def connect():
+      end = time.time() + 30
+      while True:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+          client.connect(socket_name)
+          # a server that hangs makes the test fail instead of hang
+          client.settimeout(60)
+          return client
+        except socket.error:
+          client.close()
+          if time.time() > end:
+            raise
+          time.sleep(0.1)
+    sizes = []
+    for size in (None, 1000, None):
+      client = connect()
+      client_file = client.makefile('rb')
+      sizes.append(len(client_file.read() if size is None else client_file.read(size)))
+      client_file.close()
+      client.close()
+    self.assertEqual(self.wait(process, 60), 0)
+    # the epoch after the disconnect is served in full
+    self.assertEqual(sizes[1], 1000)
+    self.assertEqual(sizes[0], sizes[2])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -5,6 +5,8 @@
 # room-impulse response (RIR) and additive noise distortions (specified by corresponding files)
 
 import wave, struct, sys, scipy.signal as signal, numpy as np, argparse, scipy.io.wavfile, warnings, subprocess
+import io, collections, multiprocessing
+from scipy.fftpack import next_fast_len
 
 def wave_load_from_command(wav_command, temp_file='temp.wav'):
   try:
@@ -13,6 +15,24 @@ def wave_load_from_command(wav_command, temp_file='temp.wav'):
   except subprocess.CalledProcessError:
     return None
 
+def wave_load_from_pipe(wav_command):
+  # reads the wave file written to stdout by the command directly from the
+  # pipe, without a temp file
+  process = subprocess.Popen(wav_command, shell = True, stdout = subprocess.PIPE)
+  data = process.communicate()[0]
+  if process.returncode != 0:
+    return None
+  return wave_load_from_bytes(data)
+
+def wave_load_from_bytes(data):
+  # reads a wave file from the string data
+  try:
+    return wave_load(io.BytesIO(data))
+  except wave.Error:
+    # e.g. floating point samples, which the wave module does not read
+    [framerate, out] = scipy.io.wavfile.read(io.BytesIO(data))
+    return scale_wave(framerate, out)
+
 def wave_load_from_command_secure(wav_command):
   sub_commands = wav_command.split('|')
   subprocess_list = []
@@ -27,26 +47,118 @@ def wave_load(file):
     warnings.warn(' Assuming that the input is int stream.')
     wav = wave.open(file)
     (nchannels, sampwidth, framerate, nframes, comptype, compname) = wav.getparams ()
-    if sampwidth == 2:
-      dtype = np.int16
-    elif sampwidth == 4:
-      dtype = np.int32
-    elif sampwidth == 8:
-      dtype = np.int64
-    frames = wav.readframes(nframes * nchannels)
-    out = struct.unpack_from("%dh" % nframes * nchannels, frames)
-    out = np.array(out, dtype = dtype)
-    out = np.reshape(out, [nchannels, -1], order = 'F')
-    out = out.transpose()
+    frames = wav.readframes(nframes)
+    return (framerate, pcm_to_float(frames, nchannels, sampwidth))
   else:
     [framerate, out] =  scipy.io.wavfile.read(file)
-    if len(out.shape) == 1:
-      out = out.reshape([out.shape[0], 1])
+  return scale_wave(framerate, out)
+
+def pcm_to_float(frames, nchannels, sampwidth, dtype = np.float32):
+  # converts the interleaved little-endian integer PCM samples in the string
+  # frames to a (samples x channels) array scaled to [-1, 1]. The samples are
+  # read in place from frames, and converted in a single pass
+  frame_size = nchannels * sampwidth
+  num_bytes = len(frames) - len(frames) % frame_size
+  if sampwidth in (2, 4):
+    int_type = np.dtype('<i%d' % sampwidth)
+    samples = np.frombuffer(frames, dtype = int_type, count = num_bytes // sampwidth)
+  elif sampwidth == 3:
+    # 24 bit samples are put in the upper 3 bytes of 32 bit integers, which
+    # keeps their sign, and shifted down
+    int_type = np.dtype('<i4')
+    padded = np.zeros([num_bytes // 3, 4], dtype = np.uint8)
+    padded[:, 1:] = np.frombuffer(frames, dtype = np.uint8, count = num_bytes).reshape([-1, 3])
+    samples = padded.view(int_type).reshape(-1)
+    samples >>= 8
+  else:
+    raise Exception('Not implemented for sample width '+str(sampwidth))
+  # the channels are columns of the interleaved samples, i.e. strided views
+  samples = samples.reshape([-1, nchannels])
+  max_val = float(2 ** (8 * sampwidth - 1) - 1)
+  return np.multiply(samples, dtype(1.0 / max_val), dtype = dtype)
+
+def scale_wave(framerate, out):
+  if len(out.shape) == 1:
+    out = out.reshape([out.shape[0], 1])
   if issubclass(out.dtype.type, np.integer):
     max_val = float(np.iinfo(out.dtype).max)
     out = out / max_val
   return (framerate, out)
 
+class LruCache:
+  # keeps the values of the most recently used keys, and computes the
+  # values of the other keys with load(key)
+  def __init__(self, load, capacity):
+    self.load = load
+    self.capacity = capacity
+    self.items = collections.OrderedDict()
+
+  def get(self, key, load = None):
+    if load is None:
+      load = self.load
+    if self.capacity <= 0:
+      return load(key)
+    if key in self.items:
+      value = self.items.pop(key)
+    else:
+      value = load(key)
+    self.items[key] = value
+    if len(self.items) > self.capacity:
+      self.items.popitem(last = False)
+    return value
+
+class FftConvolver:
+  # computes linear convolutions with impulse responses in the frequency
+  # domain. The FFT size only depends on the impulse response (about
+  # block_factor times its length): shorter signals are zero-padded to it,
+  # and longer ones are convolved in blocks with overlap-add. So the
+  # frequency response of an impulse response that is given a key is
+  # computed once and kept in an LRU cache for all the signals that are
+  # convolved with it, whatever their lengths.
+  def __init__(self, capacity = 200, block_factor = 8):
+    self.responses = LruCache(None, capacity)
+    self.block_factor = block_factor
+
+  def get_response(self, h, n_fft, key):
+    if key is None:
+      return np.fft.rfft(h, n_fft)
+    return self.responses.get((key, n_fft), lambda k: np.fft.rfft(h, n_fft))
+
+  # x : signal, or a batch of signals of the same length in the rows of a
+  #     2-d array
+  # h : impulse response (1-d)
+  # key : hashable key of the impulse response for the cache, e.g. its
+  #       file name and channel, or None to not cache it
+  # returns the full convolution, like scipy.signal.fftconvolve
+  def convolve(self, x, h, key = None):
+    x = np.asarray(x, dtype = np.float64)
+    length = x.shape[-1] + len(h) - 1
+    n_fft = next_fast_len(self.block_factor * len(h))
+    block_size = n_fft - len(h) + 1
+    response = self.get_response(h, n_fft, key)
+    if x.shape[-1] <= block_size:
+      return np.fft.irfft(np.fft.rfft(x, n_fft) * response, n_fft)[..., :length]
+
+    # overlap-add of the convolutions of the blocks, which are transformed
+    # together
+    num_blocks = (x.shape[-1] + block_size - 1) // block_size
+    padding = [(0, 0)] * (x.ndim - 1) + [(0, num_blocks * block_size - x.shape[-1])]
+    blocks = np.pad(x, padding, 'constant').reshape(x.shape[:-1] + (num_blocks, block_size))
+    blocks = np.fft.irfft(np.fft.rfft(blocks, n_fft) * response, n_fft)
+    y = np.zeros(x.shape[:-1] + (num_blocks * block_size + n_fft - block_size,))
+    for i in range(num_blocks):
+      y[..., i * block_size : i * block_size + n_fft] += blocks[..., i, :]
+    return y[..., :length]
+
+# the decoded RIRs and noises, keyed by their file names, and the frequency
+# responses of the RIRs. Each worker process of --num-jobs has its own
+# caches.
+wave_cache = None
+rir_convolver = FftConvolver()
+# the seed of the random noise offsets, or None to add the noises from their
+# first samples
+random_noise_offset_seed = None
+
 def wav_write(file_handle, fs, data):
   if str(data.dtype) in set(['float64', 'float32']):
     #rms_val = np.sqrt(np.mean(data * data))
@@ -59,11 +171,14 @@ def wav_write(file_handle, fs, data):
     raise Exception('Not implemented for '+str(data.dtype))
   scipy.io.wavfile.write(file_handle, fs, data)
  
-def corrupt(x, h, n, snr):
+def corrupt(x, h, n, snr, rir_key = None, noise_offset = 0):
     # x : signal, single channel signal
     # h : room impulse response, can be multi-channel
     # n : noise signal, can be multi-channel (same as h)
     # snr : snr of the noise added signal
+    # rir_key : key of the room impulse response for the cache of its
+    #           frequency responses (e.g. its file name), or None
+    # noise_offset : sample of the noise signal the added noise starts at
 
     # compute direct reverberation of the RIR
     fs = x[0]
@@ -72,18 +187,19 @@ def corrupt(x, h, n, snr):
       assert(h[0] == fs)
       h = h[1] # copy the samples from (sampling_rate, samples) tuple
       channel_one = h[:,0]
-      max_h = max(channel_one)
-      delay_impulse = [i for i, j in enumerate(channel_one) if j == max_h][0]
-      before_impulse = np.floor(fs * 0.001)
-      after_impulse = np.floor(fs * 0.05)
+      delay_impulse = int(np.argmax(channel_one)) # the first peak
+      before_impulse = int(np.floor(fs * 0.001))
+      after_impulse = int(np.floor(fs * 0.05))
       direct_rir = channel_one[max(0, delay_impulse - before_impulse):min(len(channel_one), delay_impulse + after_impulse)]
       direct_rir = np.array(direct_rir)
-      direct_signal = signal.fftconvolve(x, direct_rir)
+      direct_signal = rir_convolver.convolve(x, direct_rir, \
+          None if rir_key is None else (rir_key, 'direct'))
 
       # compute the reverberant signal
       y = np.zeros([x.shape[0] + h.shape[0] - 1, h.shape[1]])
       for channel in xrange(h.shape[1]):
-        y[:, channel] = signal.fftconvolve(x, h[:,channel])
+        y[:, channel] = rir_convolver.convolve(x, h[:,channel], \
+            None if rir_key is None else (rir_key, channel))
     else:
       y = x
       direct_signal = x[:,1].reshape([x.shape[0], 1])
@@ -93,92 +209,126 @@ def corrupt(x, h, n, snr):
       fs_n = n[0]
       n = n[1]
       sys.stderr.write('Noise signal : '+str(n.shape) + '\n')
-      n_y = np.zeros(y.shape) 
       assert(fs_n == fs) # sampling rate of noise and signal is same
       assert(n.shape[1] == y.shape[1]) # both the reverberant signal and noise signal have the same number of channels
-      # repeat the source noise data "n" to match the length of the reverberant signal
-      num_reps = int(np.floor(n_y.shape[0] / n.shape[0]))
-      dest_array_index = 0
-      for i in xrange(0, num_reps):
-        np.copyto(n_y[n.shape[0] * i : n.shape[0] * (i+1), :], n)
-        dest_array_index = n.shape[0] * (i+1)
-      # fill the remaining portion of destination with the initial samples of n
-      np.copyto(n_y[dest_array_index:, :], n[0 : n_y.shape[0] - dest_array_index, :])
+      # repeat the source noise data "n", starting at sample noise_offset, to
+      # match the length of the reverberant signal
+      if noise_offset % n.shape[0] != 0:
+        n = np.roll(n, -(noise_offset % n.shape[0]), axis = 0)
+      n_y = np.resize(n, y.shape).astype(np.float64, copy = False)
       # normalize noise data according to the prefixed SNR value
       n_ref = n_y[:, 0]
       n_power = float(np.mean(n_ref**2))
       x_power = float(np.mean(direct_signal**2))
       M_snr = np.multiply(1/n_power, x_power)
       M_snr = np.sqrt((10**(-snr/10))*M_snr)
-      n_scaled = np.dot(n_y, np.diagflat(M_snr))
+      # the gain is broadcast over the channels
+      n_scaled = n_y * M_snr
       y = y + n_scaled
       # scipy.io.savemat('debug.mat',{'n_scaled':n_scaled, 'y':y, 'x':x, 'h':h})
     return y[delay_impulse:(delay_impulse + x.shape[0]), :]
 
+def get_line_parser():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rir-file', type=str, help='file with the room impulse response')
+  parser.add_argument('--noise-file', type=str, help='file with additive noise')
+  parser.add_argument('--snr-db', type=float, default=20, help='desired SNR(dB) of the output')
+  parser.add_argument('--multi-channel', type=str, default='False', help='is output multi-channel')
+  parser.add_argument('input_file', type=str, help='input-file')
+  parser.add_argument('output_file', type=str, help='output-file')
+  return parser
+
+def corrupt_line(line, temp_file = None, line_index = 0):
+  # corrupts the wave file of a line of the input file list; line_index is
+  # the number of the line, which seeds its random noise offset
+  try:
+    parser = get_line_parser()
+    parts = line.split('|') 
+    wav_command = "|".join(parts[:-1])
+    params = parser.parse_args(parts[-1].split())
+    if params.multi_channel.lower() == 'true':
+      params.multi_channel = True
+      raise Exception("Cannot generate multi-channel outputs")
+    else:
+      params.multi_channel = False
+    sys.stderr.write(line)
+    # read the wav input from the stdin
+    if temp_file is not None:
+      x = wave_load_from_command(wav_command, temp_file)
+    else:
+      x = wave_load_from_pipe(wav_command)
+    if x is None:
+      sys.stderr.write('There was error trying to run the command\n'+wav_command)
+      return
+      
+    sys.stderr.write('Input signal : '+str(x[1].shape) + '\n')
+    fs = x[0]
+    if x[1].shape[1] > 1:
+      raise Exception('Input wave file cannot be multi-channel')
+    # read the impulse response if available from the file
+    if params.rir_file is not None:
+      h = wave_cache.get(params.rir_file)
+      if not params.multi_channel:
+        sys.stderr.write('Impulse response : '+str(h[1].shape) + '\n')
+        channel1 = h[1][:, 0]
+        h = (h[0], channel1.reshape([channel1.shape[0],1])) # just select the first channel
+    else:
+      h = None
+
+    # read the noise if available from the file
+    if params.noise_file is not None:
+      n = wave_cache.get(params.noise_file)
+      if not params.multi_channel:
+        channel1 = n[1][:, 0]
+        n = (n[0], channel1.reshape([channel1.shape[0], 1]))
+    else:
+      n = None 
+
+    noise_offset = 0
+    if n is not None and random_noise_offset_seed is not None:
+      # seeded by the line, so that the offsets do not depend on --num-jobs
+      noise_offset = np.random.RandomState([random_noise_offset_seed, line_index]).randint(n[1].shape[0])
+    y = corrupt(x, h, n, params.snr_db, params.rir_file, noise_offset)
+    wav_write(params.output_file, fs, y)
+    sys.stderr.write('Output signal : '+str(y.shape) + '\n')
+    if hasattr(params.output_file, 'write'):
+      params.output_file.flush()
+  except struct.error:
+    warnings.warn("Could not reverberate signal {0}")
+
+def corrupt_indexed_line(indexed_line):
+  # corrupt_line() for the worker processes of --num-jobs
+  line_index, line = indexed_line
+  return corrupt_line(line, None, line_index)
+
 if __name__ == "__main__":
   usage = """ Python script to corrupt the input wav stream with
   the specified room impulse response and noise source."""
   sys.stderr.write(str(" ".join(sys.argv)))
   main_parser = argparse.ArgumentParser(usage)
-  main_parser.add_argument('--temp-file-name', type=str, default='temp.wav', help='file name of temp file to be used')
+  main_parser.add_argument('--temp-file-name', type=str, default=None, help='file name of temp file to be used. By default the input wave is read directly from the pipe of the command')
+  main_parser.add_argument('--num-jobs', type=int, default=1, help='number of processes that corrupt the wave files')
+  main_parser.add_argument('--cache-size', type=int, default=100, help='number of decoded RIR and noise files kept in memory by each process')
+  main_parser.add_argument('--fft-cache-size', type=int, default=200, help='number of frequency responses of RIRs kept in memory by each process')
+  main_parser.add_argument('--random-noise-offset', type=str, default='False', help='if true, the added noise starts at a random sample of the noise file instead of the first one')
+  main_parser.add_argument('--random-seed', type=int, default=0, help='seed of the random noise offsets')
   main_parser.add_argument('input_file', type=str, help='file with list of wave files and corresponding corruption parameters')
   main_params = main_parser.parse_args() 
   temp_file = main_params.temp_file_name
   wav_param_list = map( lambda x: x.strip(), open(main_params.input_file))
-  
-  for line in wav_param_list:
-    try:
-      parser = argparse.ArgumentParser()
-      parser.add_argument('--rir-file', type=str, help='file with the room impulse response')
-      parser.add_argument('--noise-file', type=str, help='file with additive noise')
-      parser.add_argument('--snr-db', type=float, default=20, help='desired SNR(dB) of the output')
-      parser.add_argument('--multi-channel', type=str, default='False', help='is output multi-channel')
-      parser.add_argument('input_file', type=str, help='input-file')
-      parser.add_argument('output_file', type=str, help='output-file')
-
-      parts = line.split('|') 
-      wav_command = "|".join(parts[:-1])
-      params = parser.parse_args(parts[-1].split())
-      if params.multi_channel.lower() == 'true':
-        params.multi_channel = True
-        raise Exception("Cannot generate multi-channel outputs")
-      else:
-        params.multi_channel = False
-      sys.stderr.write(line)
-      # read the wav input from the stdin
-      x = wave_load_from_command(wav_command, temp_file)
-      if x is None:
-        sys.stderr.write('There was error trying to run the command\n'+wav_command)
-        continue
-        
-      sys.stderr.write('Input signal : '+str(x[1].shape) + '\n')
-      fs = x[0]
-      if x[1].shape[1] > 1:
-        raise Exception('Input wave file cannot be multi-channel')
-      # read the impulse response if available from the file
-      if params.rir_file is not None:
-        h = wave_load(params.rir_file)
-        if not params.multi_channel:
-          sys.stderr.write('Impulse response : '+str(h[1].shape) + '\n')
-          channel1 = h[1][:, 0]
-          h = (h[0], channel1.reshape([channel1.shape[0],1])) # just select the first channel
-      else:
-        h = None
-
-      # read the noise if available from the file
-      if params.noise_file is not None:
-        n = wave_load(params.noise_file)
-        if not params.multi_channel:
-          channel1 = n[1][:, 0]
-          n = (n[0], channel1.reshape([channel1.shape[0], 1]))
-      else:
-        n = None 
-
-      y = corrupt(x, h, n, params.snr_db)
-      wav_write(params.output_file, fs, y)
-      sys.stderr.write('Output signal : '+str(y.shape) + '\n')
-      if hasattr(params.output_file, 'write'):
-        params.output_file.flush()
-    except struct.error:
-      warnings.warn("Could not reverberate signal {0}")
-      continue
+  wave_cache = LruCache(wave_load, main_params.cache_size)
+  rir_convolver = FftConvolver(main_params.fft_cache_size)
+  if main_params.random_noise_offset.lower() == 'true':
+    random_noise_offset_seed = main_params.random_seed
+
+  if main_params.num_jobs > 1:
+    if temp_file is not None:
+      raise Exception('--temp-file-name cannot be used with --num-jobs')
+    pool = multiprocessing.Pool(main_params.num_jobs)
+    for result in pool.imap(corrupt_indexed_line, enumerate(wav_param_list)):
+      pass
+    pool.close()
+    pool.join()
+  else:
+    for line_index, line in enumerate(wav_param_list):
+      corrupt_line(line, temp_file, line_index)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# Apache 2.0.
+# Tests of the FFT convolution of corrupt.py, e.g.
+#   python local/multi_condition/corrupt_test.py
+
+import unittest
+import numpy as np
+import corrupt
+
+class FftConvolverTest(unittest.TestCase):
+  def test_convolve(self):
+    rng = np.random.RandomState(0)
+    h = rng.randn(300)
+    convolver = corrupt.FftConvolver(block_factor = 4)
+    for length in (1, 250, 900, 5000):
+      x = rng.randn(length)
+      y = convolver.convolve(x, h, 'rir')
+      self.assertEqual(y.shape, (length + len(h) - 1,))
+      self.assertTrue(np.allclose(y, np.convolve(x, h)))
+    # a batch of signals in the rows of a 2-d array
+    x = rng.randn(3, 2000)
+    y = convolver.convolve(x, h, 'rir')
+    for i in range(3):
+      self.assertTrue(np.allclose(y[i], np.convolve(x[i], h)))
+
+  def test_one_cached_response_per_rir(self):
+    rng = np.random.RandomState(1)
+    rirs = [ rng.randn(800), rng.randn(1300) ]
+    convolver = corrupt.FftConvolver()
+    # utterances of many lengths, shorter and longer than the FFT block
+    for length in (100, 1234, 4001, 6400, 7777, 15000, 23456):
+      x = rng.randn(length)
+      for i, h in enumerate(rirs):
+        convolver.convolve(x, h, 'rir%d' % i)
+    self.assertEqual(len(convolver.responses.items), len(rirs))
+
+if __name__ == '__main__':
+  unittest.main()
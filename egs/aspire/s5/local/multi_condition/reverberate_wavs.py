@@ -24,6 +24,29 @@ def return_nonempty_lines(lines):
 
   return new_lines
 
+def read_impulse_noise_index(impulses_noises_dir):
+  # reads the noise_impulse_* files of the info directory, which list the
+  # noises recorded along with a set of impulse responses. Returns a list of
+  # [set of impulse files, cyclic iterator over their noise files]
+  noises_impulses_files = glob.glob(impulses_noises_dir+'/info/noise_impulse_*')
+  impulse_noise_index = []
+  for file in noises_impulses_files:
+    noises_list = []
+    impulses_set = set([])
+    for line in return_nonempty_lines(open(file).readlines()):
+      line = line.strip()
+      if len(line) == 0 or line[0] == '#':
+        continue
+      parts = line.split('=')
+      if parts[0].strip() == 'noise_files':
+        noises_list = list_cyclic_iterator(parts[1].split())
+      elif parts[0].strip() == 'impulse_files':
+        impulses_set = set(parts[1].split())
+      else:
+        raise Exception('Unknown format of ' + file)
+      impulse_noise_index.append([impulses_set, noises_list])
+  return impulse_noise_index
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument('--snrs', type=str, default = '20:10:0', help='snrs to be used for corruption')
@@ -49,23 +72,7 @@ if __name__ == "__main__":
   wav_out_files = return_nonempty_lines(open(params.output_wav_file_list, 'r').readlines())
   assert(len(wav_files) == len(wav_out_files))
   impulses = list_cyclic_iterator(return_nonempty_lines(open(params.impulses_noises_dir+'/info/impulse_files').readlines()), random_seed = params.random_seed)
-  noises_impulses_files = glob.glob(params.impulses_noises_dir+'/info/noise_impulse_*')
-  impulse_noise_index = []
-  for file in noises_impulses_files:
-    noises_list = []
-    impulses_set = set([])
-    for line in return_nonempty_lines(open(file).readlines()):
-      line = line.strip()
-      if len(line) == 0 or line[0] == '#':
-        continue
-      parts = line.split('=')
-      if parts[0].strip() == 'noise_files':
-        noises_list = list_cyclic_iterator(parts[1].split())
-      elif parts[0].strip() == 'impulse_files':
-        impulses_set = set(parts[1].split())
-      else:
-        raise Exception('Unknown format of ' + file)
-      impulse_noise_index.append([impulses_set, noises_list])
+  impulse_noise_index = read_impulse_noise_index(params.impulses_noises_dir)
 
   command_list = []
   for i in range(len(wav_files)):
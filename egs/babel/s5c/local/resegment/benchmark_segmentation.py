@@ -0,0 +1,327 @@
+#! /usr/bin/env python
+
+# Apache 2.0
+
+# Benchmark for segmentation.py on synthetic data, so that its cost can be
+# measured without real decodes. For each recording length, .pred files
+# and a reference RTTM are generated from random speech, noise and silence
+# regions, segmentation.py is run with each of the engines and the frames
+# per second and peak memory of each stage are reported from its timing
+# log. The segments of all the engines are compared against those of the
+# first one, so this can also be used as a regression test for new engines.
+
+import os, sys, random, subprocess, json, time
+from argparse import ArgumentParser
+
+from segmentation import write_frame_labels, use_numpy
+
+# Get the phone map of the synthetic phone set.
+# Classes are 0 for silence, 1 for noise and 2 for speech.
+def get_phone_map(num_speech_phones):
+  phone_map = { "SIL": "0", "<sss>": "0", "<noise>": "1", "<vns>": "1" }
+  for i in range(0, num_speech_phones):
+    phone_map["p%d" % i] = "2"
+  return phone_map
+
+# Draw a length in frames from an exponential distribution with the
+# given mean, bounded to [1, max_length]
+def random_length(rand, mean, max_length):
+  return max(1, min(max_length, int(rand.expovariate(1.0 / mean) + 0.5)))
+
+# Generate the reference regions of a recording of num_frames frames as
+# a list of (start, length, class). Speech and non-speech regions alternate
+# and have exponentially distributed lengths, with means such that about
+# speech_proportion of the frames are speech. A proportion
+# noise_proportion of the non-speech regions are noise.
+def generate_regions(num_frames, options, rand):
+  mean_speech = options.mean_speech_length / options.frame_shift
+  mean_nonspeech = mean_speech * (1.0 - options.speech_proportion) / options.speech_proportion
+  regions = []
+  t = 0
+  speech = rand.random() < options.speech_proportion
+  while t < num_frames:
+    if speech:
+      length = random_length(rand, mean_speech, num_frames - t)
+      c = 2
+    else:
+      length = random_length(rand, mean_nonspeech, num_frames - t)
+      c = 1 if rand.random() < options.noise_proportion else 0
+    regions.append((t, length, c))
+    t += length
+    speech = not speech
+  return regions
+
+# Generate the regions of the other channel of a conversation, which
+# mostly speaks when the first channel does not. Speech regions of the
+# first channel become silence or noise, and a proportion
+# speech_proportion of its non-speech frames become speech, in regions
+# of the same length distribution as the first channel.
+def generate_paired_regions(regions, num_frames, options, rand):
+  paired_regions = []
+  for start, length, c in regions:
+    if start >= num_frames:
+      break
+    length = min(length, num_frames - start)
+    if c == 2:
+      paired_regions.append((start, length, 1 if rand.random() < options.noise_proportion else 0))
+    else:
+      paired_regions.extend([ (start + s, l, 2 if c2 == 2 else 0) \
+          for s, l, c2 in generate_regions(length, options, rand) ])
+  return paired_regions
+
+# Generate the predicted phones of a recording from its regions. The
+# phones come in runs with exponentially distributed lengths. With
+# probability error_rate, a run gets a phone of a random class instead
+# of the class of its region, to simulate the errors of the phone decoder.
+def generate_phones(regions, phones_of_class, options, rand):
+  mean_phone = options.mean_phone_length / options.frame_shift
+  A = []
+  for start, length, c in regions:
+    t = 0
+    while t < length:
+      run_length = random_length(rand, mean_phone, length - t)
+      if rand.random() < options.error_rate:
+        phone = rand.choice(phones_of_class[rand.randint(0, 2)])
+      else:
+        phone = rand.choice(phones_of_class[c])
+      A.extend([phone] * run_length)
+      t += run_length
+  return A
+
+# Write the RTTM lines of the speech and noise regions of a recording
+def write_rttm(rttm_file, file_id, regions, frame_shift):
+  for start, length, c in regions:
+    if c == 2:
+      rttm_file.write("LEXEME %s 1 %.2f %.2f word lex unknown <NA>\n" \
+          % (file_id, start * frame_shift, length * frame_shift))
+    elif c == 1:
+      rttm_file.write("NON-SPEECH %s 1 %.2f %.2f <noise> noise unknown <NA>\n" \
+          % (file_id, start * frame_shift, length * frame_shift))
+
+# Generate the .pred files, phone map and reference RTTM of
+# num_recordings recordings (or conversations, if paired) of the given
+# length in seconds in data_dir
+def generate_data(data_dir, length, options, rand):
+  pred_dir = os.path.join(data_dir, "pred")
+  if not os.path.isdir(pred_dir):
+    os.makedirs(pred_dir)
+
+  phone_map = get_phone_map(options.num_phones)
+  phone_map_file = open(os.path.join(data_dir, "phone_map.txt"), 'w')
+  for phone in sorted(phone_map.keys()):
+    phone_map_file.write("%s %s\n" % (phone, phone_map[phone]))
+  phone_map_file.close()
+  phones_of_class = [ sorted([ p for p in phone_map if phone_map[p] == c ]) for c in ("0", "1", "2") ]
+
+  rttm_file = open(os.path.join(data_dir, "ref.rttm"), 'w')
+  num_frames = int(length / options.frame_shift)
+  total_frames = 0
+  for n in range(0, options.num_recordings):
+    regions = generate_regions(num_frames, options, rand)
+    recordings = [ ("BENCH_%03d_%s" % (n, options.channel1_file), regions) ]
+    if options.paired:
+      # The channels of a conversation can differ slightly in length
+      paired_num_frames = num_frames - rand.randint(0, int(options.max_length_diff / options.frame_shift))
+      recordings.append(("BENCH_%03d_%s" % (n, options.channel2_file),
+        generate_paired_regions(regions, paired_num_frames, options, rand)))
+    for file_id, regions in recordings:
+      A = generate_phones(regions, phones_of_class, options, rand)
+      file_name = os.path.join(pred_dir, file_id + ".pred")
+      if options.binary:
+        write_frame_labels(file_name, file_id, A)
+      else:
+        pred_file = open(file_name, 'w')
+        pred_file.write(file_id + " " + " ".join(A) + "\n")
+        pred_file.close()
+      write_rttm(rttm_file, file_id, regions, options.frame_shift)
+      total_frames += len(A)
+  # End for loop over recordings
+  rttm_file.close()
+  return total_frames
+
+# Run segmentation.py with an engine on the data in data_dir.
+# Returns the wall-clock time of the whole run and the records of the
+# timing log.
+def run_segmentation(data_dir, engine, options):
+  segmentation = os.path.join(os.path.dirname(os.path.abspath(__file__)), "segmentation.py")
+  timing_log = os.path.join(data_dir, "timing.%s.json" % engine)
+  command = [ sys.executable, segmentation, "--engine", engine,
+      "--num-jobs", str(options.num_jobs), "--timing-log", timing_log,
+      "--frame-shift", str(options.frame_shift),
+      "--channel1-file", options.channel1_file,
+      "--channel2-file", options.channel2_file ]
+  if options.reference:
+    command += [ "--reference-rttm", os.path.join(data_dir, "ref.rttm") ]
+  command += options.segmentation_opts.split()
+  command += [ os.path.join(data_dir, "pred"), os.path.join(data_dir, "phone_map.txt"),
+      os.path.join(data_dir, "segments.%s" % engine) ]
+
+  log_file = open(os.path.join(data_dir, "segmentation.%s.log" % engine), 'w')
+  start = time.time()
+  ret = subprocess.call(command, stderr=log_file)
+  wall_time = time.time() - start
+  log_file.close()
+  if ret != 0:
+    sys.stderr.write("%s: Error: segmentation.py failed with engine %s, see %s\n" \
+        % (sys.argv[0], engine, log_file.name))
+    sys.exit(1)
+  return wall_time, [ json.loads(line) for line in open(timing_log) ]
+
+# Sum the records of the timing log by stage. Returns a list of
+# (stage, frames, wall time, CPU time, peak RSS) in the order of the stages.
+def summarize_stages(records):
+  stages = []
+  totals = {}
+  for record in records:
+    if record["stage"] not in totals:
+      stages.append(record["stage"])
+      totals[record["stage"]] = [0, 0.0, 0.0, 0.0]
+    t = totals[record["stage"]]
+    t[0] += record["num_frames"]
+    t[1] += record["wall_time"]
+    t[2] += record["cpu_time"]
+    t[3] = max(t[3], record["peak_rss"])
+  return [ tuple([stage] + totals[stage]) for stage in stages ]
+
+def main():
+  parser = ArgumentParser(description='Benchmark segmentation.py on synthetic data')
+  parser.add_argument('--lengths', type=str, \
+      dest='lengths', default="60,600,3600,36000", \
+      help="Comma-separated lengths in seconds of the recordings " \
+      + "to benchmark (default: %(default)s)")
+  parser.add_argument('--num-recordings', type=int, \
+      dest='num_recordings', default=1, \
+      help="Number of recordings, or conversations if --paired, " \
+      + "of each length (default: %(default)s)")
+  parser.add_argument('--paired', type=str, \
+      dest='paired', default="true", choices=("true", "false"), \
+      help="Generate the two channels of a conversation for each " \
+      + "recording so that they are segmented jointly (default: %(default)s)")
+  parser.add_argument('--speech-proportion', type=float, \
+      dest='speech_proportion', default=0.4, \
+      help="Proportion of speech frames in a recording (default: %(default)s)")
+  parser.add_argument('--noise-proportion', type=float, \
+      dest='noise_proportion', default=0.2, \
+      help="Proportion of the non-speech regions that are noise (default: %(default)s)")
+  parser.add_argument('--mean-speech-length', type=float, \
+      dest='mean_speech_length', default=2.0, \
+      help="Mean length in seconds of the speech regions (default: %(default)s)")
+  parser.add_argument('--mean-phone-length', type=float, \
+      dest='mean_phone_length', default=0.08, \
+      help="Mean length in seconds of the runs of the same phone (default: %(default)s)")
+  parser.add_argument('--error-rate', type=float, \
+      dest='error_rate', default=0.1, \
+      help="Proportion of the phone runs predicted with a random class " \
+      + "instead of that of the reference (default: %(default)s)")
+  parser.add_argument('--num-phones', type=int, \
+      dest='num_phones', default=40, \
+      help="Number of speech phones (default: %(default)s)")
+  parser.add_argument('--binary', action='store_true', \
+      help="Write the .pred files in the binary format (default: %(default)s)")
+  parser.add_argument('--reference', type=str, \
+      dest='reference', default="true", choices=("true", "false"), \
+      help="Run segmentation.py with the reference RTTM, which adds the " \
+      + "analysis to the cost (default: %(default)s)")
+  parser.add_argument('--engines', type=str, \
+      dest='engines', default="python,numpy", \
+      help="Comma-separated engines of segmentation.py to run. The " \
+      + "segments of each engine are compared with those of the first " \
+      + "one (default: %(default)s)")
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help="Number of jobs of segmentation.py (default: %(default)s)")
+  parser.add_argument('--segmentation-opts', type=str, \
+      dest='segmentation_opts', default="", \
+      help="Other options for segmentation.py (default: %(default)s)")
+  parser.add_argument('--frame-shift', type=float, \
+      dest='frame_shift', default=0.01, \
+      help="Time difference between adjacent frame (default: %(default)s)s")
+  parser.add_argument('--max-length-diff', type=float, \
+      dest='max_length_diff', default=1.0, \
+      help="Maximum difference in lengths in seconds of the two " \
+      + "channels of a conversation (default: %(default)s)")
+  parser.add_argument('--channel1-file', type=str, \
+      dest='channel1_file', default="inLine", \
+      help="String that matches with the channel 1 file (default: %(default)s)")
+  parser.add_argument('--channel2-file', type=str, \
+      dest='channel2_file', default="outLine", \
+      help="String that matches with the channel 2 file (default: %(default)s)")
+  parser.add_argument('--seed', type=int, \
+      dest='seed', default=0, \
+      help="Seed of the random number generator (default: %(default)s)")
+  parser.add_argument('--results', type=str, \
+      dest='results', default=None, \
+      help="Also write the results to this file, one JSON object " \
+      + "per engine, length and stage (default: %(default)s)")
+  parser.add_argument('work_dir', \
+      help='Directory to write the synthetic data and the outputs to')
+  parser.usage=':'.join(parser.format_usage().split(':')[1:]) \
+      + 'e.g. :  %(prog)s --lengths 60,3600 --engines python,numpy exp/resegment_benchmark'
+  options = parser.parse_args()
+
+  options.paired = options.paired == "true"
+  options.reference = options.reference == "true"
+  engines = options.engines.split(",")
+  lengths = [ float(x) for x in options.lengths.split(",") ]
+
+  if not ( options.speech_proportion > 0.0 and options.speech_proportion < 1.0 ):
+    sys.stderr.write("%s: Error: Invalid speech-proportion value %f\n" \
+        % (sys.argv[0], options.speech_proportion))
+    sys.exit(1)
+
+  if options.binary and not use_numpy:
+    sys.stderr.write("%s: Error: --binary requires the numpy module\n" % sys.argv[0])
+    sys.exit(1)
+
+  results_file = None
+  if options.results != None:
+    results_file = open(options.results, 'w')
+
+  rand = random.Random(options.seed)
+  identical = True
+  sys.stdout.write("%10s %8s %-26s %12s %10s %10s %12s %10s\n" % ("length", \
+      "engine", "stage", "frames", "wall(s)", "cpu(s)", "frames/sec", "peak(MB)"))
+  for length in lengths:
+    data_dir = os.path.join(options.work_dir, "length_%d" % length)
+    start = time.time()
+    num_frames = generate_data(data_dir, length, options, rand)
+    sys.stderr.write("%s: Generated %d frames of %s-second recordings in %f sec\n" \
+        % (sys.argv[0], num_frames, length, time.time() - start))
+
+    for engine in engines:
+      wall_time, records = run_segmentation(data_dir, engine, options)
+      peak_rss = 0.0
+      for stage, frames, stage_wall_time, cpu_time, stage_peak_rss in summarize_stages(records):
+        sys.stdout.write("%10d %8s %-26s %12d %10.3f %10.3f %12.0f %10.1f\n" % (length, \
+            engine, stage, frames, stage_wall_time, cpu_time, \
+            frames / max(stage_wall_time, 1e-9), stage_peak_rss))
+        peak_rss = max(peak_rss, stage_peak_rss)
+        if results_file != None:
+          results_file.write(json.dumps({ "length": length, "engine": engine,
+            "stage": stage, "num_frames": frames, "wall_time": stage_wall_time,
+            "cpu_time": cpu_time, "peak_rss": stage_peak_rss }, sort_keys = True) + "\n")
+      # End for loop over stages
+      sys.stdout.write("%10d %8s %-26s %12d %10.3f %10s %12.0f %10.1f\n" % (length, \
+          engine, "total", num_frames, wall_time, "-", num_frames / wall_time, peak_rss))
+      if results_file != None:
+        results_file.write(json.dumps({ "length": length, "engine": engine,
+          "stage": "total", "num_frames": num_frames, "wall_time": wall_time,
+          "peak_rss": peak_rss }, sort_keys = True) + "\n")
+
+      if engine != engines[0]:
+        segments = sorted(open(os.path.join(data_dir, "segments.%s" % engine)).readlines())
+        reference_segments = sorted(open(os.path.join(data_dir, "segments.%s" % engines[0])).readlines())
+        if segments != reference_segments:
+          sys.stderr.write("%s: Error: Segments of engine %s differ from those of engine %s for length %s\n" \
+              % (sys.argv[0], engine, engines[0], length))
+          identical = False
+    # End for loop over engines
+  # End for loop over lengths
+
+  if results_file != None:
+    results_file.close()
+  if not identical:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+# Apache 2.0
+
+# Converts the frame label files (.pred and .ref) used by segmentation.py
+# between the text format and the compact binary format, which stores
+# each frame as a uint16 id and is read by segmentation.py through
+# numpy.memmap. segmentation.py detects the format of each file
+# automatically, so the converted files can be used in place of the
+# text ones.
+
+import os, glob, sys
+from argparse import ArgumentParser
+
+from segmentation import read_frame_labels, write_frame_labels, use_numpy
+
+def main():
+  parser = ArgumentParser(description='Convert .pred and .ref files between text and binary formats')
+  parser.add_argument('--to-text', dest='to_text', action='store_true', \
+      help='Convert from binary to text format instead (default: %(default)s)')
+  parser.add_argument('--extension', type=str, dest='extension', \
+      default='pred', \
+      help='Extension of the files to convert (default: %(default)s)')
+  parser.add_argument('input_dir', \
+      help='Directory containing the files to convert')
+  parser.add_argument('output_dir', \
+      help='Directory to write the converted files to. ' \
+      + 'This can be the same as the input directory.')
+  parser.usage=':'.join(parser.format_usage().split(':')[1:]) \
+      + 'e.g. :  %(prog)s exp/tri4b_whole_resegment_dev10h/pred exp/tri4b_whole_resegment_dev10h/pred_bin'
+  options = parser.parse_args()
+
+  if not use_numpy:
+    sys.stderr.write("%s: Error: numpy is required\n" % sys.argv[0])
+    sys.exit(1)
+
+  if not os.path.isdir(options.output_dir):
+    os.makedirs(options.output_dir)
+
+  num_files = 0
+  num_frames = 0
+  for file_name in sorted(glob.glob(os.path.join(options.input_dir, "*." + options.extension))):
+    try:
+      file_id, labels = read_frame_labels(file_name)
+    except IndexError:
+      sys.stderr.write("%s: Incorrect format of file %s\n" % (sys.argv[0], file_name))
+      sys.exit(1)
+    out_file_name = os.path.join(options.output_dir, os.path.basename(file_name))
+    if options.to_text:
+      labels = list(labels)
+      out_file = open(out_file_name, 'w')
+      out_file.write(file_id + " " + " ".join(labels) + "\n")
+      out_file.close()
+    else:
+      # Load the labels fully before overwriting a file in place
+      if not isinstance(labels, list):
+        labels = list(labels)
+      write_frame_labels(out_file_name, file_id, labels)
+    num_files += 1
+    num_frames += len(labels)
+  # End for loop over files
+
+  sys.stderr.write("%s: Converted %d files with %d frames\n" \
+      % (sys.argv[0], num_files, num_frames))
+
+if __name__ == '__main__':
+  main()
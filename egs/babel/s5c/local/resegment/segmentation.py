@@ -3,7 +3,7 @@
 # Copyright 2014  Vimal Manohar
 # Apache 2.0
 
-import os, glob, argparse, sys, re, time
+import os, glob, argparse, sys, re, time, bisect, multiprocessing, struct, subprocess, operator, json, csv, resource
 from argparse import ArgumentParser
 
 use_numpy = True
@@ -12,6 +12,11 @@ try:
 except ImportError:
   use_numpy = False
 
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
 # Global stats for analysis taking RTTM file as reference
 global_analysis_get_initial_segments = None
 global_analysis_set_nonspeech_proportion = None
@@ -164,15 +169,15 @@ class Analysis:
         if use_numpy:
           try:
             percentile25  = np.percentile(self.type_counts[j][i], 25)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile25 = 0
           try:
             percentile50  = np.percentile(self.type_counts[j][i], 50)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile50 = 0
           try:
             percentile75  = np.percentile(self.type_counts[j][i], 75)
-          except ValueError:
+          except (ValueError, IndexError):
             percentile75 = 0
 
         file_handle.write("File %s: %s : TypeStats: Type %d %d: Min: %4d Max: %4d Mean: %4d percentile25: %4d percentile50: %4d percentile75: %4d\n" % (self.file_id, self.prefix, j, i,  min_length, max_length, mean_length, percentile25, percentile50, percentile75))
@@ -191,15 +196,15 @@ class Analysis:
       if use_numpy:
         try:
           self.percentile25[i]  = np.percentile(self.state_count[i], 25)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile25[i] = 0
         try:
           self.percentile50[i]  = np.percentile(self.state_count[i], 50)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile50[i] = 0
         try:
           self.percentile75[i]  = np.percentile(self.state_count[i], 75)
-        except ValueError:
+        except (ValueError, IndexError):
           self.percentile75[i] = 0
 
       file_handle.write("File %s: %s : Length: Type %d: Min: %4d Max: %4d Mean: %4d percentile25: %4d percentile50: %4d percentile75: %4d\n" % (self.file_id, self.prefix, i,  self.min_length[i], self.max_length[i], self.mean_length[i], self.percentile25[i], self.percentile50[i], self.percentile75[i]))
@@ -220,77 +225,260 @@ class Analysis:
         file_handle.write("File %s: %s : Markers: Type %d: %s\n" % (self.file_id, self.prefix, j,  str(sorted([str(self.markers[j][i])+' ('+ str(self.state_count[j][i])+') ( ' + str(self.phones[j][i]) + ')' for i in range(0, len(self.state_count[j]))],key=lambda x:int(x.split()[0])))))
     # End for loop over 9 cells
 
+# Binary format for the frame labels in the .pred and .ref files.
+# The text format is a single line
+#   <file-id> <label-frame-1> <label-frame-2> ...
+# The binary format is a header followed by the labels of the frames
+# as little-endian uint16 ids into a list of symbols:
+#   magic (8 bytes) | num-frames (uint32) | length of file-id (uint32) |
+#   length of symbols (uint32) | file-id | symbols separated by newlines |
+#   zero padding to a multiple of 8 bytes | ids of the frames (uint16)
+# The format is detected automatically from the magic when reading.
+FRAME_LABELS_MAGIC = b"KSEGLAB1"
+FRAME_LABELS_HEADER = struct.Struct("<8sIII")
+
+def to_bytes(s):
+  if isinstance(s, bytes):
+    return s
+  return s.encode('utf-8')
+
+# A sequence of symbols stored as an array of integer ids into a list of
+# symbols. It can be read like the list of strings in the text format
+# without converting all the frames to strings.
+class SymbolSequence:
+  def __init__(self, ids, symbols):
+    self.ids = ids
+    self.symbols = symbols
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [ self.symbols[x] for x in self.ids[i].tolist() ]
+    return self.symbols[self.ids[i]]
+
+  def __iter__(self):
+    for x in self.ids.tolist():
+      yield self.symbols[x]
+
+# Read frame labels from a file in either the text or the binary format.
+# Returns the file-id and the labels. The labels are a list of strings for
+# the text format and a SymbolSequence backed by a numpy.memmap of the
+# file for the binary format.
+def read_frame_labels(file_name):
+  f = open(file_name, 'rb')
+  header = f.read(FRAME_LABELS_HEADER.size)
+  if header[0:len(FRAME_LABELS_MAGIC)] != FRAME_LABELS_MAGIC:
+    # Text format
+    f.close()
+    f = open(file_name)
+    splits = f.readline().strip().split()
+    f.close()
+    if len(splits) == 0:
+      raise IndexError("Empty file %s" % file_name)
+    return (splits[0], splits[1:])
+
+  if not use_numpy:
+    sys.stderr.write("%s: Error: numpy is required to read binary file %s\n" \
+        % (sys.argv[0], file_name))
+    sys.exit(1)
+  magic, num_frames, file_id_length, symbols_length = FRAME_LABELS_HEADER.unpack(header)
+  file_id = to_str(f.read(file_id_length))
+  symbols = to_str(f.read(symbols_length)).split("\n")
+  f.close()
+  offset = FRAME_LABELS_HEADER.size + file_id_length + symbols_length
+  offset += (8 - offset % 8) % 8
+
+  if num_frames == 0:
+    ids = np.zeros(0, dtype=np.uint16)
+  else:
+    ids = np.memmap(file_name, dtype='<u2', mode='r', offset=offset, shape=(num_frames,))
+  return (file_id, SymbolSequence(ids, symbols))
+
+# Write frame labels in the binary format.
+# labels is a list of strings or a SymbolSequence.
+def write_frame_labels(file_name, file_id, labels):
+  if isinstance(labels, SymbolSequence):
+    ids = labels.ids
+    symbols = labels.symbols
+  else:
+    symbols, ids = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    symbols = symbols.tolist()
+  if len(symbols) > 65536:
+    raise ValueError("Too many symbols (%d) for the binary format" % len(symbols))
+
+  file_id = to_bytes(file_id)
+  symbols_str = b"\n".join([ to_bytes(x) for x in symbols ])
+  header = FRAME_LABELS_HEADER.pack(FRAME_LABELS_MAGIC, len(ids),
+      len(file_id), len(symbols_str)) + file_id + symbols_str
+  header += b"\0" * ((8 - len(header) % 8) % 8)
+
+  f = open(file_name, 'wb')
+  f.write(header)
+  np.asarray(ids, dtype='<u2').tofile(f)
+  f.close()
+
+# Parse a line of a standard IARPA Babel RTTM file (as structure in
+# Jan 16, 2014) to a tuple (start_frame, num_frames, label), where
+# the label is 0 for silence, 1 for noise, 2 for speech and None for
+# lines that do not add any frames.
+def parse_rttm_line(splits, frame_shift):
+  type1 = splits[0]
+  category = splits[6]
+  start_time = int(float(splits[3])/frame_shift + 0.5)
+  duration = int(float(splits[4])/frame_shift + 0.5)
+  label = None
+  if type1 == "NON-LEX":
+    if category == "other":
+      # <no-speech> is taken as Silence
+      label = 0
+    else:
+      label = 1
+  elif type1 == "LEXEME":
+    label = 2
+  elif type1 == "NON-SPEECH":
+    label = 1
+  return (start_time, duration, label)
+
+# Convert the parsed RTTM lines of a file to the frame labels of the
+# reference. The lines are taken in order and the frames of each line are
+# added after those of the previous line. The frames before the start of a
+# line are filled with silence.
+# Returns a SymbolSequence with the symbols "0", "1" and "2", or a list of
+# these strings if numpy is not available.
+def get_reference_labels(rttm_lines):
+  runs = []
+  i = 0
+  for start_time, duration, label in rttm_lines:
+    if i < start_time:
+      i = start_time
+    if label != None and duration > 0:
+      runs.append((i, duration, label))
+      i += duration
+  # End for loop over lines
+
+  if not use_numpy:
+    labels = ["0"] * i
+    for start, duration, label in runs:
+      labels[start:start+duration] = [str(label)] * duration
+    return labels
+
+  labels = np.zeros(i, dtype=np.uint8)
+  for start, duration, label in runs:
+    labels[start:start+duration] = label
+  return SymbolSequence(labels, ["0", "1", "2"])
+
 # Function to read a standard IARPA Babel RTTM file
 # as structure in Jan 16, 2014
-def read_rttm_file(rttm_file, temp_dir, frame_shift):
+# Returns a dictionary from the file-id to the frame labels of the reference.
+# The lines are grouped by file-id in memory in a single pass over the file.
+# If external_sort is True, the file is instead sorted by file-id using the
+# sort command, so that only the lines of one file-id are held in memory
+# at a time. This is meant for very large RTTM files.
+def read_rttm_file(rttm_file, frame_shift, external_sort = False):
+  reference = {}
+  if not external_sort:
+    rttm_lines = {}
+    for line in open(rttm_file):
+      splits = line.strip().split()
+      if len(splits) == 0 or splits[0] == "SPEAKER":
+        continue
+      rttm_lines.setdefault(splits[1], []).append(parse_rttm_line(splits, frame_shift))
+    for file_id in list(rttm_lines.keys()):
+      reference[file_id] = get_reference_labels(rttm_lines.pop(file_id))
+    return reference
+  # End if
+
+  # The sort is stable, so the lines of each file-id stay in the
+  # same order as in the RTTM file
+  env = dict(os.environ)
+  env["LC_ALL"] = "C"
+  p = subprocess.Popen(["sort", "-s", "-k2,2", rttm_file], stdout=subprocess.PIPE, env=env)
   file_id = None
   this_file = []
-  ref_file_handle = None
-  reference = {}
-  for line in open(rttm_file).readlines():
+  for line in p.stdout:
     splits = line.strip().split()
-    type1 = splits[0]
-    if type1 == "SPEAKER":
+    if len(splits) == 0 or splits[0] == "SPEAKER":
       continue
     if splits[1] != file_id:
-      # A different file_id. Need to open a different file to write
-      if this_file != []:
-        # If this_file is empty, no reference RTTM corresponding to the file_id
-        # is read. This will happen at the start of the file_id. Otherwise it means a
-        # contiguous segment of previous file_id is processed. So write it to the file.
-        # corresponding to the previous file_id
-        try:
-          ref_file_handle.write(' '.join(this_file))
-          # Close the previous file if any
-          ref_file_handle.close()
-          this_file = []
-        except AttributeError:
-          # Ignore AttributeError. It is expected.
-          1==1
-      # End if
-
+      if file_id != None:
+        reference[file_id] = get_reference_labels(this_file)
       file_id = splits[1]
-      if (file_id not in reference):
-        # First time seeing this file_id. Open a new file for writing.
-        reference[file_id] = 1
-        try:
-          ref_file_handle = open(temp_dir+"/"+file_id+".ref", 'w')
-        except IOError:
-          sys.stderr.write("Unable to open " + temp_dir+"/"+file_id+".ref for writing\n")
-          sys.exit(1)
-        ref_file_handle.write(file_id + "\t")
-      else:
-        # This file has been seen before but not in the previous iteration.
-        # The file has already been closed. So open it for append.
-        try:
-          this_file = open(temp_dir+"/"+file_id+".ref").readline().strip().split()[1:]
-          ref_file_handle = open(temp_dir+"/"+file_id+".ref", 'a')
-        except IOError:
-          sys.stderr.write("Unable to open " + temp_dir+"/"+file_id+".ref for appending\n")
-          sys.exit(1)
-      # End if
-    # End if
-
-    i = len(this_file)
-    category = splits[6]
-    word = splits[5]
-    start_time = int(float(splits[3])/frame_shift + 0.5)
-    duration = int(float(splits[4])/frame_shift + 0.5)
-    if i < start_time:
-      this_file.extend(["0"]*(start_time - i))
-    if type1 == "NON-LEX":
-      if category == "other":
-        # <no-speech> is taken as Silence
-        this_file.extend(["0"]*duration)
-      else:
-        this_file.extend(["1"]*duration)
-    if type1 == "LEXEME":
-      this_file.extend(["2"]*duration)
-    if type1 == "NON-SPEECH":
-      this_file.extend(["1"]*duration)
-
-  ref_file_handle.write(' '.join(this_file))
-  ref_file_handle.close()
+      this_file = []
+    this_file.append(parse_rttm_line(splits, frame_shift))
+  # End for loop over lines
+  if file_id != None:
+    reference[file_id] = get_reference_labels(this_file)
+  if p.wait() != 0:
+    sys.stderr.write("%s: Error: Unable to sort RTTM file %s\n" % (sys.argv[0], rttm_file))
+    sys.exit(1)
+  return reference
+
+# Convert bytes read from a file opened in binary mode to str
+def to_str(b):
+  if isinstance(b, str):
+    return b
+  return b.decode()
+
+# Reference labels of the recordings in an RTTM file, read from the file
+# when the labels of a recording are needed. Only the byte ranges of the
+# blocks of lines of each file-id are kept in memory. This is used instead
+# of read_rttm_file in the low-memory mode.
+class RttmReferences:
+  def __init__(self, rttm_file, frame_shift, blocks = None):
+    self.rttm_file = rttm_file
+    self.frame_shift = frame_shift
+    if blocks != None:
+      self.blocks = blocks
+      return
+
+    self.blocks = {}
+    file_id = None
+    offset = 0
+    for line in open(rttm_file, 'rb'):
+      splits = line.split()
+      if len(splits) > 0 and splits[0] != b"SPEAKER":
+        if to_str(splits[1]) != file_id:
+          file_id = to_str(splits[1])
+          self.blocks.setdefault(file_id, []).append([offset, offset])
+        self.blocks[file_id][-1][1] = offset + len(line)
+      offset += len(line)
+    # End for loop over lines
+
+  # References of only the file-ids in files
+  def subset(self, files):
+    return RttmReferences(self.rttm_file, self.frame_shift,
+        dict([ (f, self.blocks[f]) for f in files if f in self.blocks ]))
+
+  def __contains__(self, file_id):
+    return file_id in self.blocks
+
+  def __getitem__(self, file_id):
+    rttm_lines = []
+    f = open(self.rttm_file, 'rb')
+    for start, end in self.blocks[file_id]:
+      f.seek(start)
+      for line in to_str(f.read(end - start)).splitlines():
+        splits = line.strip().split()
+        if len(splits) == 0 or splits[0] == "SPEAKER":
+          continue
+        rttm_lines.append(parse_rttm_line(splits, self.frame_shift))
+    f.close()
+    return get_reference_labels(rttm_lines)
+
+  def get(self, file_id):
+    if file_id not in self.blocks:
+      return None
+    return self[file_id]
+
+# Peak resident set size in MB of this process and of the largest of its
+# child processes that have finished
+def get_peak_rss():
+  # ru_maxrss is in bytes on Mac OS X and in kilobytes elsewhere
+  scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
 
 # Stats class to store some basic stats about the number of
 # times the post-processor goes through particular loops or blocks
@@ -312,6 +500,15 @@ class Stats:
     sys.stderr.write("Noise only: %d\n" % self.noise_only)
     sys.stderr.write("Silence only: %d\n" % self.silence_only)
 
+  # Add the stats of another object s to this object
+  def add(self, s):
+    self.inter_utt_nonspeech += s.inter_utt_nonspeech
+    self.merge_nonspeech_segment += s.merge_nonspeech_segment
+    self.merge_segments += s.merge_segments
+    self.split_segments += s.split_segments
+    self.silence_only += s.silence_only
+    self.noise_only += s.noise_only
+
   def reset(self):
     self.inter_utt_nonspeech = 0
     self.merge_nonspeech_segment = 0
@@ -320,20 +517,74 @@ class Stats:
     self.silence_only = 0
     self.noise_only = 0
 
-# Timer class to time functions
+# CPU time of the process. time.clock is not available in newer
+# versions of python.
+try:
+  process_time = time.process_time
+except AttributeError:
+  process_time = time.clock
+
+# Timer class to time functions. interval is the CPU time and
+# wall_interval is the wall-clock time.
 class Timer:
   def __enter__(self):
-    self.start = time.clock()
+    self.start = process_time()
+    self.wall_start = time.time()
     return self
   def __exit__(self, *args):
-    self.end = time.clock()
+    self.end = process_time()
     self.interval = self.end - self.start
+    self.wall_interval = time.time() - self.wall_start
+
+# Per-stage timings of the resegmentation of each recording. Each record
+# has the recording, the stage, its wall-clock and CPU time in seconds,
+# the number of frames and segments after the stage and the peak RSS of
+# the process in MB at the end of the stage. This is used to find the
+# recordings that are slow to resegment.
+class StageTimings:
+  FIELDS = ("recording", "stage", "wall_time", "cpu_time", "num_frames", "num_segments", "peak_rss")
+
+  def __init__(self):
+    self.records = []
+
+  def add_record(self, recording, stage, t, num_frames, num_segments):
+    self.records.append(dict(zip(self.FIELDS, (recording, stage,
+      t.wall_interval, t.interval, num_frames, num_segments, get_peak_rss()[0]))))
+
+  # Add the records of another object s to this object
+  def add(self, s):
+    self.records.extend(s.records)
+
+  # Write the records in the JSON lines or CSV format
+  def write(self, out_file, format = "json"):
+    if format == "csv":
+      writer = csv.DictWriter(out_file, self.FIELDS)
+      writer.writerow(dict(zip(self.FIELDS, self.FIELDS)))
+      writer.writerows(self.records)
+    else:
+      for record in self.records:
+        out_file.write(json.dumps(record, sort_keys = True) + "\n")
+
+  # Write the recordings with the largest total wall-clock time
+  def write_summary(self, num_recordings = 10):
+    totals = {}
+    for record in self.records:
+      wall_time, cpu_time, num_frames, slowest = totals.get(record["recording"], (0.0, 0.0, 0, None))
+      if slowest == None or record["wall_time"] > slowest["wall_time"]:
+        slowest = record
+      totals[record["recording"]] = (wall_time + record["wall_time"],
+          cpu_time + record["cpu_time"], max(num_frames, record["num_frames"]), slowest)
+    sys.stderr.write("Slowest recordings:\n")
+    for recording in sorted(totals, key = lambda x: totals[x][0], reverse = True)[0:num_recordings]:
+      wall_time, cpu_time, num_frames, slowest = totals[recording]
+      sys.stderr.write("%s: %f sec wall, %f sec CPU, %d frames, slowest stage %s (%f sec)\n" \
+          % (recording, wall_time, cpu_time, num_frames, slowest["stage"], slowest["wall_time"]))
 
 # The main class for post-processing a file.
 # This does the segmentation either looking at the file isolated
 # or by looking at both classes simultaneously
 class JointResegmenter:
-  def __init__(self, P, A, f, options, phone_map, stats = None, reference = None):
+  def __init__(self, P, A, f, options, phone_map, stats = None, reference = None, timings = None):
 
     # Pointers to prediction arrays and Initialization
     self.P = P                    # Predicted phones
@@ -381,11 +632,21 @@ class JointResegmenter:
     self.THIS_NOISE_PLUS = self.THIS_NOISE + self.THIS_NOISE_CONVERT
     self.THIS_SPEECH_PLUS = self.THIS_SPEECH + self.THIS_CONVERT
 
+    if use_numpy:
+      # Lookup tables from frame type to the class used in the analysis
+      # after get_initial_segments and after set_nonspeech_proportion
+      self.INITIAL_ANALYSIS_CLASS = np.array([0,0,0,1,1,1,2,2,2], dtype=np.int8)
+      self.NONSPEECH_ANALYSIS_CLASS = np.array([0,0,0,0,0,0,2,2,2,1,1,1,1,1,1], dtype=np.int8)
+
     if stats != None:
       self.stats = stats
 
+    self.timings = timings
+
     self.reference = None
     if reference != None:
+      if isinstance(reference, SymbolSequence):
+        reference = list(reference)
       if len(reference) < self.N:
         self.reference = reference + ["0"] * (self.N - len(reference))
         assert (len(self.reference) == self.N)
@@ -404,30 +665,15 @@ class JointResegmenter:
 
   # Main resegment function that calls other functions
   def resegment(self):
-    with Timer() as t:
-      self.get_initial_segments()
-    if self.options.verbose > 1:
-      sys.stderr.write("For %s: get_initial_segments took %f sec\n" % (self.file_id, t.interval))
-    with Timer() as t:
-      self.set_nonspeech_proportion()
-    if self.options.verbose > 1:
-      sys.stderr.write("For %s: set_nonspeech_proportion took %f sec\n" % (self.file_id, t.interval))
-    with Timer() as t:
-      self.merge_segments()
-    if self.options.verbose > 1:
-      sys.stderr.write("For %s: merge took %f sec\n" % (self.file_id, t.interval))
-    with Timer() as t:
-      self.split_long_segments()
-    if self.options.verbose > 1:
-      sys.stderr.write("For %s: split took %f sec\n" % (self.file_id, t.interval))
+    self.run_stage("get_initial_segments", self.get_initial_segments)
+    self.run_stage("set_nonspeech_proportion", self.set_nonspeech_proportion)
+    self.run_stage("merge", self.merge_segments)
+    self.run_stage("split", self.split_long_segments)
     if self.remove_noise_segments:
-      with Timer() as t:
-        self.remove_noise_only_segments()
-      if self.options.verbose > 1:
-        sys.stderr.write("For %s: remove took %f sec\n" % (self.file_id, t.interval))
+      self.run_stage("remove", self.remove_noise_only_segments)
     elif self.min_inter_utt_nonspeech_length > 0.0:
       # This is the typical one with augmented training setup
-      self.remove_silence_only_segments()
+      self.run_stage("remove", self.remove_silence_only_segments)
 
     if self.options.verbose > 1:
       sys.stderr.write("For file %s\n" % self.file_id)
@@ -435,6 +681,56 @@ class JointResegmenter:
       sys.stderr.write("\n")
       self.stats.reset()
 
+  # Run a stage of the resegmentation and record its timing
+  def run_stage(self, name, stage):
+    with Timer() as t:
+      stage()
+    if self.options.verbose > 1:
+      sys.stderr.write("For %s: %s took %f sec\n" % (self.file_id, name, t.interval))
+    if self.timings != None:
+      self.timings.add_record(self.file_id, name, t, self.N, self.get_num_segments())
+
+  def get_num_segments(self):
+    return sum(self.S)
+
+  # Frame types and reference labels as int8 arrays for the fast analysis
+  def get_type_array(self):
+    return np.array(self.A, dtype=np.int8)
+
+  def get_reference_array(self):
+    return np.array(self.reference[0:self.N], dtype=np.int8)
+
+  # Boolean array that is True for the frames inside the segments
+  # [segment_starts[i], segment_ends[i])
+  def get_segment_mask(self, segment_starts, segment_ends):
+    in_segment = np.zeros(self.N + 1, dtype=np.int32)
+    np.add.at(in_segment, segment_starts, 1)
+    np.subtract.at(in_segment, segment_ends, 1)
+    return np.cumsum(in_segment[0:self.N]) > 0
+
+  # Return an analysis of the frame-level confusion C = 3 * reference + class.
+  # The lengths, start frames and hypothesized phones of the runs of
+  # frames in each cell are also stored. As in the frame loops of the
+  # analysis sections, the run at the end of the recording is not stored.
+  def frame_analysis(self, C, prefix):
+    a = Analysis(self.file_id, self.frame_shift, prefix)
+    a.confusion_matrix = np.bincount(C, minlength = 9).tolist()
+
+    run_ends = np.flatnonzero(C[1:] != C[:-1]) + 1
+    run_starts = np.concatenate(([0], run_ends[:-1]))
+    for start, end, c in zip(run_starts.tolist(), run_ends.tolist(),
+        C[run_starts].tolist()):
+      a.state_count[c].append(end - start)
+      a.markers[c].append(start)
+      a.phones[c].append(' '.join(set(self.P[start:end])))
+    return a
+
+  # Analysis of the frame-level confusion between the reference and the
+  # class of each frame in the hypothesis (0 = silence, 1 = converted
+  # to speech, 2 = speech), computed with numpy instead of a frame loop
+  def fast_frame_analysis(self, hypothesis, prefix):
+    return self.frame_analysis(3 * self.get_reference_array() + hypothesis, prefix)
+
   def get_initial_segments(self):
     for i in range(0, self.N):
       if (i > 0) and self.A[i-1] != self.A[i]:
@@ -468,41 +764,45 @@ class JointResegmenter:
 
     ###########################################################################
     # Analysis section
-    self.C = ["0"] * self.N
-    C = self.C
-    a = Analysis(self.file_id, self.frame_shift,"Analysis after get_initial_segments")
-
     if self.reference != None:
-      count = 0
-      for i in range(0,self.N):
-        if   self.reference[i] == "0" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "0"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_NOISE:
-          C[i] = "1"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "2"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "3"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_NOISE:
-          C[i] = "4"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "5"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SILENCE:
-          C[i] = "6"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_NOISE:
-          C[i] = "7"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
+      if self.options.fast_analysis:
+        a = self.fast_frame_analysis(self.INITIAL_ANALYSIS_CLASS[self.get_type_array()],
+            "Analysis after get_initial_segments")
+      else:
+        self.C = ["0"] * self.N
+        C = self.C
+        a = Analysis(self.file_id, self.frame_shift,"Analysis after get_initial_segments")
+
+        count = 0
+        for i in range(0,self.N):
+          if   self.reference[i] == "0" and self.A[i] in self.THIS_SILENCE:
+            C[i] = "0"
+          elif self.reference[i] == "0" and self.A[i] in self.THIS_NOISE:
+            C[i] = "1"
+          elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "2"
+          elif self.reference[i] == "1" and self.A[i] in self.THIS_SILENCE:
+            C[i] = "3"
+          elif self.reference[i] == "1" and self.A[i] in self.THIS_NOISE:
+            C[i] = "4"
+          elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "5"
+          elif self.reference[i] == "2" and self.A[i] in self.THIS_SILENCE:
+            C[i] = "6"
+          elif self.reference[i] == "2" and self.A[i] in self.THIS_NOISE:
+            C[i] = "7"
+          elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "8"
+          if i > 0 and C[i-1] != C[i]:
+            a.state_count[int(C[i-1])].append(count)
+            a.markers[int(C[i-1])].append(i - count)
+            a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
+            count = 1
+          else:
+            count += 1
 
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+        for j in range(0,9):
+          a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
 
       global_analysis_get_initial_segments.add(a)
 
@@ -604,41 +904,45 @@ class JointResegmenter:
 
     ###########################################################################
     # Analysis section
-    self.C = ["0"] * self.N
-    C = self.C
-    a = Analysis(self.file_id, self.frame_shift,"Analysis after set_nonspeech_proportion")
-
     if self.reference != None:
-      count = 0
-      for i in range(0,self.N):
-        if   self.reference[i] == "0" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "0"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "1"
-        elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "2"
-        elif self.reference[i] == "1" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "3"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "4"
-        elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "5"
-        elif self.reference[i] == "2" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
-          C[i] = "6"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_CONVERT:
-          C[i] = "7"
-        elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
+      if self.options.fast_analysis:
+        a = self.fast_frame_analysis(self.NONSPEECH_ANALYSIS_CLASS[self.get_type_array()],
+            "Analysis after set_nonspeech_proportion")
+      else:
+        self.C = ["0"] * self.N
+        C = self.C
+        a = Analysis(self.file_id, self.frame_shift,"Analysis after set_nonspeech_proportion")
+
+        count = 0
+        for i in range(0,self.N):
+          if   self.reference[i] == "0" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
+            C[i] = "0"
+          elif self.reference[i] == "0" and self.A[i] in self.THIS_CONVERT:
+            C[i] = "1"
+          elif self.reference[i] == "0" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "2"
+          elif self.reference[i] == "1" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
+            C[i] = "3"
+          elif self.reference[i] == "1" and self.A[i] in self.THIS_CONVERT:
+            C[i] = "4"
+          elif self.reference[i] == "1" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "5"
+          elif self.reference[i] == "2" and self.A[i] in (self.THIS_SILENCE + self.THIS_NOISE):
+            C[i] = "6"
+          elif self.reference[i] == "2" and self.A[i] in self.THIS_CONVERT:
+            C[i] = "7"
+          elif self.reference[i] == "2" and self.A[i] in self.THIS_SPEECH:
+            C[i] = "8"
+          if i > 0 and C[i-1] != C[i]:
+            a.state_count[int(C[i-1])].append(count)
+            a.markers[int(C[i-1])].append(i - count)
+            a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
+            count = 1
+          else:
+            count += 1
 
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+        for j in range(0,9):
+          a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
 
       global_analysis_set_nonspeech_proportion.add(a)
 
@@ -968,27 +1272,34 @@ class JointResegmenter:
   def transition_type(self, j):
     assert (j > 0)
     assert (self.A[j-1] != self.A[j] or self.A[j] in self.THIS_CONVERT)
-    if self.A[j-1] in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL) and self.A[j] in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL):
+    t = self.get_transition_type(self.A[j-1], self.A[j])
+    assert (t != None)
+    return t
+
+  # Return the transition type from a frame of type a1 to a frame of
+  # type a2. Returns None if the transition is not valid.
+  def get_transition_type(self, a1, a2):
+    if a1 in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL) and a2 in (self.THIS_SPEECH_THAT_NOISE + self.THIS_SPEECH_THAT_SIL):
       return 0
-    if self.A[j-1] in self.THIS_SPEECH and self.A[j] in self.THIS_SPEECH:
+    if a1 in self.THIS_SPEECH and a2 in self.THIS_SPEECH:
       return 1
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE):
+    if a1 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE) and a2 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT_THAT_SIL + self.THIS_NOISE_CONVERT_THAT_NOISE):
       return 2
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT):
+    if a1 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT) and a2 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT):
       return 3
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE) and self.A[j] in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE):
+    if a1 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE) and a2 in (self.THIS_SPEECH + self.THIS_NOISE_CONVERT + self.THIS_SIL_CONVERT_THAT_SIL + self.THIS_SIL_CONVERT_THAT_NOISE):
       return 4
-    if self.A[j-1] in (self.THIS_SPEECH + self.THIS_CONVERT) and self.A[j] in (self.THIS_SPEECH + self.THIS_CONVERT):
+    if a1 in (self.THIS_SPEECH + self.THIS_CONVERT) and a2 in (self.THIS_SPEECH + self.THIS_CONVERT):
       return 5
-    if self.A[j-1] in self.THIS_SPEECH_PLUS and self.A[j] in (self.THIS_SPEECH_PLUS + self.THIS_NOISE):
+    if a1 in self.THIS_SPEECH_PLUS and a2 in (self.THIS_SPEECH_PLUS + self.THIS_NOISE):
       return 6
-    if self.A[j-1] in self.THIS_SPEECH_PLUS and self.A[j] in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE):
+    if a1 in self.THIS_SPEECH_PLUS and a2 in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE):
       return 7
-    if self.A[j-1] in (self.THIS_SPEECH_PLUS + self.THIS_NOISE) and self.A[j] in self.THIS_SPEECH_PLUS:
+    if a1 in (self.THIS_SPEECH_PLUS + self.THIS_NOISE) and a2 in self.THIS_SPEECH_PLUS:
       return 8
-    if self.A[j-1] in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE) and self.A[j] in self.THIS_SPEECH_PLUS:
+    if a1 in (self.THIS_SPEECH_PLUS + self.THIS_SILENCE) and a2 in self.THIS_SPEECH_PLUS:
       return 9
-    assert (False)
+    return None
 
   # Output the final segments
   def print_segments(self, out_file_handle = sys.stdout):
@@ -1024,42 +1335,47 @@ class JointResegmenter:
     ############################################################################
     # Analysis section
 
-    self.C = ["0"] * self.N
-    C = self.C
-    a = Analysis(self.file_id, self.frame_shift,"Analysis final")
-
     if self.reference != None:
-      count = 0
-      in_seg = False
-      for i in range(0,self.N):
-        if in_seg and self.E[i]:
-          in_seg = False
-        if i == 0 and self.S[i]:
-          in_seg = True
-        if not in_seg and self.S[i]:
-          in_seg = True
-        if   self.reference[i] == "0" and not in_seg:
-          C[i] = "0"
-        elif self.reference[i] == "0" and in_seg:
-          C[i] = "2"
-        elif self.reference[i] == "1" and not in_seg:
-          C[i] = "3"
-        elif self.reference[i] == "1" and in_seg:
-          C[i] = "5"
-        elif self.reference[i] == "2" and not in_seg:
-          C[i] = "6"
-        elif self.reference[i] == "2" and in_seg:
-          C[i] = "8"
-        if i > 0 and C[i-1] != C[i]:
-          a.state_count[int(C[i-1])].append(count)
-          a.markers[int(C[i-1])].append(i - count)
-          a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
-          count = 1
-        else:
-          count += 1
+      if self.options.fast_analysis:
+        in_segment = self.get_segment_mask([ n for n, p in segments ],
+            [ p for n, p in segments ])
+        a = self.fast_frame_analysis(2 * in_segment, "Analysis final")
+      else:
+        self.C = ["0"] * self.N
+        C = self.C
+        a = Analysis(self.file_id, self.frame_shift,"Analysis final")
+
+        count = 0
+        in_seg = False
+        for i in range(0,self.N):
+          if in_seg and self.E[i]:
+            in_seg = False
+          if i == 0 and self.S[i]:
+            in_seg = True
+          if not in_seg and self.S[i]:
+            in_seg = True
+          if   self.reference[i] == "0" and not in_seg:
+            C[i] = "0"
+          elif self.reference[i] == "0" and in_seg:
+            C[i] = "2"
+          elif self.reference[i] == "1" and not in_seg:
+            C[i] = "3"
+          elif self.reference[i] == "1" and in_seg:
+            C[i] = "5"
+          elif self.reference[i] == "2" and not in_seg:
+            C[i] = "6"
+          elif self.reference[i] == "2" and in_seg:
+            C[i] = "8"
+          if i > 0 and C[i-1] != C[i]:
+            a.state_count[int(C[i-1])].append(count)
+            a.markers[int(C[i-1])].append(i - count)
+            a.phones[int(C[i-1])].append(' '.join(set(self.P[i-count:i])))
+            count = 1
+          else:
+            count += 1
 
-      for j in range(0,9):
-        a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
+        for j in range(0,9):
+          a.confusion_matrix[j] = sum([C[i] == str(j) for i in range(0,self.N)])
 
       if self.options.verbose > 0:
         a.write_confusion_matrix()
@@ -1091,12 +1407,11 @@ class JointResegmenter:
       # Output:
       out_file_handle.write("%s %s %s %s\n" % (utterance_id, self.file_id, start_seconds, end_seconds))
 
-  # Some intermediate stage analysis of the segmentation
-  def segmentation_analysis(self, title = "Analysis"):
-    # In this analysis, we are trying to find in each segment,
-    # the number of frames that are speech, noise and silence
-    # in the reference RTTM
-
+  # Count the number of frames of each type (silence, noise and speech)
+  # in the reference RTTM within each segment.
+  # Returns a dictionary from segment start to a tuple of
+  # (segment end, silence count, noise count, speech count)
+  def get_segment_reference_counts(self):
     # First get the segment start and segment ends
     # Note that they are in sync by construction
     segment_starts = [i for i in range(0,self.N) if self.S[i]]
@@ -1115,6 +1430,15 @@ class JointResegmenter:
       # Make a tuple out of the counts of the types of frames
       D[st] = (en, types.get("0",0), types.get("1", 0), types.get("2", 0))
     # End for loop over all segments
+    return D
+  # End function get_segment_reference_counts
+
+  # Some intermediate stage analysis of the segmentation
+  def segmentation_analysis(self, title = "Analysis"):
+    # In this analysis, we are trying to find in each segment,
+    # the number of frames that are speech, noise and silence
+    # in the reference RTTM
+    D = self.get_segment_reference_counts()
 
     a = Analysis(self.file_id, None, title)
     for st, info in D.items():
@@ -1184,6 +1508,626 @@ class JointResegmenter:
     return a
   # End function segmentation_analysis
 
+# Sorted positions of segment boundary markers, from which markers can
+# only be removed. Used to find the nearest remaining marker on either side
+# of a frame without walking the frames one by one.
+# Removed positions are skipped using union-find with path compression.
+class MarkerIndex:
+  def __init__(self, positions):
+    self.positions = positions
+    self.size = len(positions)
+    self.left = list(range(0, self.size))
+    self.right = list(range(0, self.size))
+
+  def find(self, parent, k):
+    root = k
+    while root >= 0 and root < self.size and parent[root] != root:
+      root = parent[root]
+    while k != root:
+      next_k = parent[k]
+      parent[k] = root
+      k = next_k
+    return root
+
+  def remove(self, x):
+    k = bisect.bisect_left(self.positions, x)
+    if k < self.size and self.positions[k] == x and self.left[k] == k:
+      self.left[k] = k - 1
+      self.right[k] = k + 1
+
+  # Return the largest remaining position <= x or -1 if there is none
+  def previous(self, x):
+    k = self.find(self.left, bisect.bisect_right(self.positions, x) - 1)
+    if k < 0:
+      return -1
+    return self.positions[k]
+
+  # Return the smallest remaining position >= x or default if there is none
+  def next(self, x, default):
+    k = self.find(self.right, bisect.bisect_left(self.positions, x))
+    if k >= self.size:
+      return default
+    return self.positions[k]
+
+# Vectorized version of JointResegmenter.
+# The frame types in A and B are stored as int8 NumPy arrays instead of
+# lists of strings, and the segment start and end markers S and E as bool
+# arrays. Segment boundaries are found using diff and run-length operations
+# on these arrays instead of walking through the frames one by one.
+# The segments produced are identical to those of JointResegmenter.
+class NumpyJointResegmenter(JointResegmenter):
+  def __init__(self, P, A, f, options, phone_map, stats = None, reference = None, timings = None):
+    JointResegmenter.__init__(self, P, [], f, options, phone_map, stats, timings = timings)
+
+    self.A = np.array(A, dtype=np.int8)     # Predicted classes
+    self.B = self.A.copy()                  # Original predicted classes
+    self.N = len(self.A)
+    self.S = np.zeros(self.N, dtype=bool)
+    self.E = np.zeros(self.N+1, dtype=bool)
+
+    # Lookup table of transition types indexed by the frame types
+    # on either side of the boundary. Invalid transitions are -1.
+    self.TRANSITION_TYPE = np.zeros((15,15), dtype=np.int8)
+    for a1 in range(0,15):
+      for a2 in range(0,15):
+        t = self.get_transition_type(str(a1), str(a2))
+        self.TRANSITION_TYPE[a1][a2] = -1 if t == None else t
+
+    if reference is not None:
+      if isinstance(reference, SymbolSequence):
+        reference = np.array([ int(x) for x in reference.symbols ], dtype=np.int8)[reference.ids]
+      self.reference = np.zeros(max(self.N, len(reference)), dtype=np.int8)
+      self.reference[0:len(reference)] = np.array(reference, dtype=np.int8)
+
+  def get_type_array(self):
+    return self.A
+
+  def get_reference_array(self):
+    return self.reference[0:self.N]
+
+  def get_num_segments(self):
+    return int(self.S.sum())
+
+  def restrict(self, N):
+    self.B = self.B[0:N]
+    self.A = self.A[0:N]
+    self.S = self.S[0:N]
+    self.E = self.E[0:N+1]
+    if self.S.sum() == self.E.sum() + 1:
+      self.E[N] = True
+    self.N = N
+
+  def is_speech(self, A):
+    return (A >= 6) & (A <= 8)
+
+  def get_initial_segments(self):
+    A = self.A
+    speech = self.is_speech(A)
+    # Frames where the type is different from that of the previous frame
+    change = A[1:] != A[:-1]
+
+    # A speech frame that is different from the previous frame is the
+    # start of a segment. Any frame that is different from a previous
+    # speech frame is the end of a segment.
+    self.S[0] = speech[0]
+    self.S[1:] = change & speech[1:]
+    self.E[1:self.N] = change & speech[:-1]
+    self.E[self.N] = speech[-1]
+    assert (self.S.sum() == self.E.sum())
+
+    ###########################################################################
+    # Analysis section
+    if self.reference is not None:
+      a = self.fast_frame_analysis(self.INITIAL_ANALYSIS_CLASS[A],
+          "Analysis after get_initial_segments")
+
+      global_analysis_get_initial_segments.add(a)
+
+      if self.options.verbose > 0:
+        a.write_confusion_matrix()
+        a.write_length_stats()
+        if self.options.verbose > 1:
+          a.write_markers()
+    ###########################################################################
+
+  def set_nonspeech_proportion(self):
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+    assert (len(segment_starts) == len(segment_ends))
+    num_speech_frames = int((segment_ends - segment_starts).sum())
+    if num_speech_frames == 0:
+      sys.stderr.write("%s: Warning: no speech found for recording %s\n" % (sys.argv[0], self.file_id))
+
+    # Set the number of non-speech frames to be added depending on the
+    # silence proportion.
+    target_segment_frames = int(num_speech_frames / (1.0 - self.options.silence_proportion))
+    num_segment_frames = num_speech_frames
+    if num_segment_frames < target_segment_frames:
+      num_segment_frames += self.pad_segments(segment_starts, segment_ends,
+          target_segment_frames - num_speech_frames)
+    if num_segment_frames < target_segment_frames:
+      proportion = float(num_segment_frames - num_speech_frames) / num_segment_frames
+      sys.stderr.write("%s: Warning: for recording %s, only got a proportion %f of non-speech frames, versus target %f\n" % (sys.argv[0], self.file_id, proportion, self.options.silence_proportion))
+
+    ###########################################################################
+    # Analysis section
+    if self.reference is not None:
+      a = self.fast_frame_analysis(self.NONSPEECH_ANALYSIS_CLASS[self.A],
+          "Analysis after set_nonspeech_proportion")
+
+      global_analysis_set_nonspeech_proportion.add(a)
+
+      if self.options.verbose > 0:
+        a.write_confusion_matrix()
+        a.write_length_stats()
+        if self.options.verbose > 1:
+          a.write_markers()
+    ###########################################################################
+
+  # Pad the speech segments with up to num_frames non-speech frames from
+  # the gaps between them and return the number of frames added.
+  #
+  # This gives the same result as the loop in
+  # JointResegmenter.set_nonspeech_proportion, without going through the
+  # frames pass by pass. In that loop, every segment start and segment end
+  # next to a gap is a 'front', which takes one frame of the gap in each
+  # pass until the gap is filled. So after k passes, a gap of length L
+  # between two segments has min(L, 2k) frames in segments and a gap
+  # at the start or end of the recording has min(L, k).
+  # The order in which the fronts are processed within a pass only matters
+  # in the last pass, where the frames run out part of the way through,
+  # and when the two fronts of a gap of odd length meet, because the front
+  # that takes the middle frame decides where the segment boundary goes.
+  # A front is moved to the back of the order whenever it takes a frame
+  # of a different type than the previous one, so the order is updated only
+  # at these frames.
+  def pad_segments(self, segment_starts, segment_ends, num_frames):
+    A = self.A
+    B = self.B
+    S = self.S
+    E = self.E
+    num_segments = len(segment_starts)
+    if num_segments == 0:
+      return 0
+
+    # The fronts are stored in lists indexed by front id.
+    # The origin of a front is the segment end it moves right from or the
+    # segment start it moves left from. The key gives the order in which
+    # the fronts are processed within a pass. Initially it is the position
+    # of the segment start (2k) or segment end (2k+1) in the sorted list of
+    # markers.
+    front_origin = []
+    front_is_end = []
+    front_key = []
+    front_gap = []
+    gap_length = []
+    gap_fronts = []
+    for k in range(-1, num_segments):
+      if k == -1:
+        gap_start = 0
+      else:
+        gap_start = int(segment_ends[k])
+      if k == num_segments - 1:
+        gap_end = self.N
+      else:
+        gap_end = int(segment_starts[k+1])
+      if gap_end <= gap_start:
+        continue
+      fronts = []
+      if k >= 0:
+        fronts.append(len(front_origin))
+        front_origin.append(gap_start)
+        front_is_end.append(True)
+        front_key.append(2 * k + 1)
+        front_gap.append(len(gap_length))
+      if k < num_segments - 1:
+        fronts.append(len(front_origin))
+        front_origin.append(gap_end)
+        front_is_end.append(False)
+        front_key.append(2 * k + 2)
+        front_gap.append(len(gap_length))
+      gap_length.append(gap_end - gap_start)
+      gap_fronts.append(fronts)
+    # End for loop over gaps
+    num_gaps = len(gap_length)
+    if num_gaps == 0:
+      return 0
+
+    # The pass at which each gap is filled
+    lengths = np.array(gap_length)
+    num_fronts = np.array([len(x) for x in gap_fronts])
+    last_pass = (lengths + num_fronts - 1) // num_fronts
+
+    # Find the pass K in which the frames run out. num_passes is None if
+    # all the gaps are filled before that.
+    def num_padded(k):
+      return int(np.minimum(lengths, num_fronts * k).sum())
+    num_passes = None
+    if num_padded(int(last_pass.max())) >= num_frames:
+      lo = 1
+      hi = int(last_pass.max())
+      while lo < hi:
+        mid = (lo + hi) // 2
+        if num_padded(mid) >= num_frames:
+          hi = mid
+        else:
+          lo = mid + 1
+      num_passes = lo
+    # End if
+
+    # Frames where there is a change of the frame type.
+    # A front taking such a frame gets moved to the back of the order.
+    changes = np.flatnonzero(B[1:] != B[:-1]) + 1
+
+    # Find the passes in which the order of the fronts changes. Only those
+    # before the front stops or before pass K matter.
+    reorder_fronts = {}
+    for f in range(0, len(front_origin)):
+      limit = int(last_pass[front_gap[f]])
+      if num_passes != None:
+        limit = min(limit, num_passes)
+      o = front_origin[f]
+      if front_is_end[f]:
+        # Takes frame o + p - 1 in pass p
+        c = changes[np.searchsorted(changes, o):np.searchsorted(changes, o + limit - 1)]
+        passes = c - o + 1
+      else:
+        # Takes frame o - p in pass p, which is a change if there
+        # is a change at frame o - p + 1
+        c = changes[np.searchsorted(changes, o - limit + 2):np.searchsorted(changes, o, 'right')]
+        passes = o - c + 1
+      for p in passes.tolist():
+        reorder_fronts.setdefault(p, []).append(f)
+    # End for loop over fronts
+
+    # Gaps of odd length are filled in a pass where only one of the fronts
+    # can take a frame
+    meeting_gaps = {}
+    for g in range(0, num_gaps):
+      if num_fronts[g] == 2 and gap_length[g] % 2 == 1 \
+          and (num_passes == None or last_pass[g] < num_passes):
+        meeting_gaps.setdefault(int(last_pass[g]), []).append(g)
+    gap_first_front = {}
+
+    next_key = 2 * num_segments
+    for p in sorted(set(reorder_fronts.keys()) | set(meeting_gaps.keys())):
+      for g in meeting_gaps.get(p, []):
+        gap_first_front[g] = min(gap_fronts[g], key = lambda f: front_key[f])
+      for f in sorted(reorder_fronts.get(p, []), key = lambda f: front_key[f]):
+        front_key[f] = next_key
+        next_key += 1
+    # End for loop over passes
+
+    # Number of frames taken by each front
+    front_count = [0] * len(front_origin)
+    gap_remaining = [0] * num_gaps
+    for g in range(0, num_gaps):
+      L = gap_length[g]
+      if num_passes == None or last_pass[g] < num_passes:
+        if len(gap_fronts[g]) == 1:
+          front_count[gap_fronts[g][0]] = L
+        else:
+          for f in gap_fronts[g]:
+            front_count[f] = L // 2
+          if L % 2 == 1:
+            front_count[gap_first_front[g]] += 1
+      else:
+        for f in gap_fronts[g]:
+          front_count[f] = num_passes - 1
+        gap_remaining[g] = L - len(gap_fronts[g]) * (num_passes - 1)
+    # End for loop over gaps
+
+    if num_passes != None:
+      # The frames run out in pass K
+      remaining = num_frames - num_padded(num_passes - 1)
+      alive_fronts = [ f for f in range(0, len(front_origin)) if gap_remaining[front_gap[f]] > 0 ]
+      for f in sorted(alive_fronts, key = lambda f: front_key[f]):
+        if remaining == 0:
+          break
+        if gap_remaining[front_gap[f]] > 0:
+          front_count[f] += 1
+          gap_remaining[front_gap[f]] -= 1
+          remaining -= 1
+      # End for loop over fronts
+    # End if
+
+    # Convert the frames taken by the fronts to the frame types 9...14.
+    # There is a segment boundary at every change of the frame type in the
+    # converted frames.
+    for f in range(0, len(front_origin)):
+      count = front_count[f]
+      if count == 0:
+        continue
+      o = front_origin[f]
+      if front_is_end[f]:
+        A[o:o+count] = B[o:o+count] + 9
+        c = changes[np.searchsorted(changes, o):np.searchsorted(changes, o + count)]
+        E[o+count] = True
+      else:
+        A[o-count:o] = B[o-count:o] + 9
+        c = changes[np.searchsorted(changes, o - count + 1):np.searchsorted(changes, o, 'right')]
+        S[o-count] = True
+      S[c] = True
+      E[c] = True
+    # End for loop over fronts
+
+    return sum(front_count)
+  # End function pad_segments
+
+  def merge_segments(self):
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+    assert (len(segment_starts) == len(segment_ends))
+
+    if self.options.verbose > 3:
+      sys.stderr.write("Length of segment starts before non-speech adding: %d\n" % len(segment_starts))
+
+    if self.min_inter_utt_nonspeech_length > 0.0:
+      # Make the non-speech regions between segments into segments as well
+      points = np.union1d(np.union1d(segment_starts, segment_ends), [0, self.N])
+      segment_starts = points[:-1]
+      segment_ends = points[1:]
+      if self.options.verbose > 3:
+        sys.stderr.write("Length of segment starts after non-speech adding: %d\n" % len(segment_starts))
+      self.S[segment_starts] = True
+      self.E[segment_ends] = True
+
+    # A boundary is a frame which is both a segment start and a segment end.
+    # The segment score is the min of the lengths of the segments to the
+    # left and to the right of the boundary.
+    boundaries = np.intersect1d(segment_starts, segment_ends)
+    i = np.searchsorted(segment_starts, boundaries)
+    j = np.searchsorted(segment_ends, boundaries)
+    assert ((j + 1) < len(segment_ends)).all()
+    segment_scores = np.minimum(segment_starts[i] - segment_starts[i-1],
+        segment_ends[j+1] - segment_ends[j])
+
+    A = self.A
+    assert ((A[boundaries-1] != A[boundaries]) | (A[boundaries] >= 9)).all()
+    transition_types = self.TRANSITION_TYPE[A[boundaries-1], A[boundaries]]
+    assert (transition_types >= 0).all()
+
+    # Sort the boundaries based on the type of transition and within each
+    # transition type based on segment score
+    order = np.lexsort((boundaries, segment_scores, transition_types))
+
+    S = self.S
+    E = self.E
+    start_index = MarkerIndex(np.flatnonzero(S).tolist())
+    end_index = MarkerIndex(np.flatnonzero(E).tolist())
+
+    # Begin merging of segments by removing the start and end mark
+    # at the boundary to be merged
+    for b, t in zip(boundaries[order].tolist(), transition_types[order].tolist()):
+      if self.min_inter_utt_nonspeech_length > 0.0 and not E[b]:
+        continue
+
+      # Find the segment to the left and to the right of the boundary
+      p_left = start_index.previous(b - 1)
+      segment_length = b - p_left
+      p = end_index.next(b + 1, self.N + 1)
+      assert (self.min_inter_utt_nonspeech_length == 0 or p == self.N or S[p] or A[p] < 6)
+
+      if self.min_inter_utt_nonspeech_length > 0 and A[b] < 6:
+        assert(t == 6 or t == 7)
+        if (p - b) > self.min_inter_utt_nonspeech_length:
+          # Inter-utterance non-speech. Remove it from the segments.
+          S[b] = False
+          start_index.remove(b)
+          E[p] = False
+          end_index.remove(p)
+          self.stats.inter_utt_nonspeech += 1
+          continue
+        # End if
+
+        p_temp = p
+        p = end_index.next(p + 1, self.N + 1)
+        segment_length += p - b
+        if segment_length < self.max_frames:
+          # Merge the non-speech segment with the segments
+          # on either sides
+          self.stats.merge_nonspeech_segment += 1
+          if p_temp < self.N:
+            S[p_temp] = False
+            start_index.remove(p_temp)
+            E[p_temp] = False
+            end_index.remove(p_temp)
+          S[b] = False
+          start_index.remove(b)
+          E[b] = False
+          end_index.remove(b)
+          continue
+        else:
+          S[b] = False
+          start_index.remove(b)
+          E[p_temp] = False
+          end_index.remove(p_temp)
+          continue
+        # End if
+      elif self.min_inter_utt_nonspeech_length > 0 and (t == 8 or t == 9):
+        assert(p_left == 0)
+        if b - p_left > self.min_inter_utt_nonspeech_length:
+          S[p_left] = False
+          start_index.remove(p_left)
+          E[b] = False
+          end_index.remove(b)
+          continue
+        # End if
+      # End if
+      segment_length += p - b
+
+      if segment_length < self.max_frames:
+        self.stats.merge_segments += 1
+        S[b] = False
+        start_index.remove(b)
+        E[b] = False
+        end_index.remove(b)
+      # End if
+    # End for loop over boundaries
+
+    assert (S.sum() == E.sum())
+
+    ###########################################################################
+    # Analysis section
+
+    if self.reference is not None and self.options.verbose > 3:
+      a = self.segmentation_analysis("Analysis after merge_segments")
+      a.write_confusion_matrix()
+
+      if self.options.verbose > 4:
+        a.write_type_stats()
+        a.write_markers()
+      # End if
+    # End if
+    ###########################################################################
+  # End function merge_segments
+
+  # Return the segment ends corresponding to the segment starts.
+  # The end of a segment is the first segment end marker after its start.
+  def get_segment_ends(self, segment_starts):
+    end_markers = np.flatnonzero(self.E)
+    return end_markers[np.searchsorted(end_markers, segment_starts, 'right')]
+
+  def split_long_segments(self):
+    assert (self.S.sum() == self.E.sum())
+    segment_starts = np.flatnonzero(self.S)
+    for n, p in zip(segment_starts.tolist(), self.get_segment_ends(segment_starts).tolist()):
+      segment_length = p - n
+      while segment_length > self.hard_max_frames:
+        # Count the number of times long segments are split
+        self.stats.split_segments += 1
+
+        num_pieces = int((float(segment_length) / self.hard_max_frames) + 0.99999)
+        sys.stderr.write("%s: Warning: for recording %s, " \
+            % (sys.argv[0], self.file_id) \
+            + "splitting segment of length %f seconds into %d pieces " \
+            % (segment_length * self.frame_shift, num_pieces) \
+            + "(--hard-max-segment-length %f)\n" \
+            % self.options.hard_max_segment_length)
+        frames_per_piece = int(segment_length / num_pieces)
+        pieces = n + frames_per_piece * np.arange(1, num_pieces)
+        self.S[pieces] = True
+        self.E[pieces] = True
+        # All the pieces but the last one are shorter than the hard maximum.
+        # The last one is split again if required.
+        n = n + (num_pieces - 1) * frames_per_piece
+        segment_length = p - n
+    assert (self.S.sum() == self.E.sum())
+  # End function split_long_segments
+
+  # Remove the segments that do not contain any frames for which
+  # is_kept is True
+  def remove_segments(self, is_kept):
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = self.get_segment_ends(segment_starts)
+    num_kept = np.concatenate(([0], np.cumsum(is_kept)))
+    removed = num_kept[segment_ends] == num_kept[segment_starts]
+    self.S[segment_starts[removed]] = False
+    self.E[segment_ends[removed]] = False
+    return int(removed.sum())
+
+  def remove_silence_only_segments(self):
+    self.stats.silence_only += self.remove_segments(self.A >= 3)
+
+    if self.reference is not None and self.options.verbose > 3:
+      a = self.segmentation_analysis("Analysis after remove_silence_only_segments")
+      a.write_confusion_matrix()
+
+      if self.options.verbose > 4:
+        a.write_type_stats()
+        a.write_markers()
+      # End if
+    # End if
+  # End function remove_silence_only_segments
+
+  def remove_noise_only_segments(self):
+    self.stats.noise_only += self.remove_segments(self.is_speech(self.A))
+
+    ###########################################################################
+    # Analysis section
+
+    if self.reference is not None and self.options.verbose > 3:
+      a = self.segmentation_analysis("Analysis after remove_noise_only_segments")
+      a.write_confusion_matrix()
+
+      if self.options.verbose > 4:
+        a.write_type_stats()
+        a.write_markers()
+      # End if
+    # End if
+    ###########################################################################
+  # End function remove_noise_only_segments
+
+  # Output the final segments
+  def print_segments(self, out_file_handle = sys.stdout):
+    assert (self.N == len(self.S))
+    assert (self.N + 1 == len(self.E))
+
+    # A segment goes from its start to the next end marker before
+    # the end of the recording
+    segment_starts = np.flatnonzero(self.S)
+    end_markers = np.flatnonzero(self.E[0:self.N])
+    k = np.searchsorted(end_markers, segment_starts, 'right')
+    segment_ends = np.append(end_markers, self.N)[k]
+    assert (segment_starts[1:] >= segment_ends[:-1]).all()
+
+    # Segment end markers that do not end any segment
+    for n in np.setdiff1d(np.flatnonzero(self.E[0:self.N] & ~self.S),
+        segment_ends).tolist():
+      sys.stderr.write("%s: Error: Ending segment before starting it: n=%d\n" % (sys.argv[0], n))
+
+    if len(segment_starts) == 0:
+      sys.stderr.write("%s: Warning: no segments for recording %s\n" % (sys.argv[0], self.file_id))
+      sys.exit(1)
+
+    ############################################################################
+    # Analysis section
+
+    if self.reference is not None:
+      a = self.fast_frame_analysis(2 * self.get_segment_mask(segment_starts, segment_ends),
+          "Analysis final")
+
+      if self.options.verbose > 0:
+        a.write_confusion_matrix()
+        a.write_length_stats()
+        if self.options.verbose > 1:
+          a.write_markers()
+
+      global_analysis_final.add(a)
+    ############################################################################
+
+    max_end_time = int(segment_ends[-1])
+    max_end_time_hundredths_second = int(100.0 * self.frame_shift * max_end_time)
+    num_digits = 1
+    i = 1
+    while i < max_end_time_hundredths_second:
+      i *= 10
+      num_digits += 1
+    format_str = r"%0" + "%d" % num_digits + "d" # e.g. "%05d"
+
+    for start, end in zip(segment_starts.tolist(), segment_ends.tolist()):
+      assert (end > start)
+      start_seconds = "%.2f" % (self.frame_shift * start)
+      end_seconds = "%.2f" % (self.frame_shift * end)
+      start_str = format_str % (start * self.frame_shift * 100.0)
+      end_str = format_str % (end * self.frame_shift * 100.0)
+      utterance_id = "%s%s%s%s%s" % (self.file_id, self.options.first_separator, start_str, self.options.second_separator, end_str)
+      out_file_handle.write("%s %s %s %s\n" % (utterance_id, self.file_id, start_seconds, end_seconds))
+
+  def get_segment_reference_counts(self):
+    segment_starts = np.flatnonzero(self.S)
+    segment_ends = np.flatnonzero(self.E)
+
+    counts = []
+    for t in range(0,3):
+      cumulative_count = np.concatenate(([0], np.cumsum(self.reference[0:self.N] == t)))
+      counts.append((cumulative_count[segment_ends] - cumulative_count[segment_starts]).tolist())
+
+    D = {}
+    for i, st in enumerate(segment_starts.tolist()):
+      D[st] = (int(segment_ends[i]), counts[0][i], counts[1][i], counts[2][i])
+    return D
+
 def map_prediction(A1, A2, phone_map, speech_cap = None, f = None):
   if A2 == None:
     B = []
@@ -1271,6 +2215,199 @@ def map_prediction(A1, A2, phone_map, speech_cap = None, f = None):
       B2.append("2")
   return (B1, B2)
 
+# Frame types of this channel and of the other channel in joint
+# segmentation, indexed by 3 * c1 + c2 where c1 and c2 are the classes
+# (0 = silence, 1 = noise, 2 = speech) of the phones predicted on
+# the two channels
+JOINT_THIS_TYPE = (0, 1, 2, 3, 4, 5, 6, 7, 8)
+JOINT_THAT_TYPE = (0, 3, 6, 1, 4, 7, 2, 5, 8)
+
+# Frame types in isolated segmentation indexed by the class
+ISOLATED_TYPE = (0, 4, 8)
+
+# Map a sequence of phones to an array of their classes in the phone map.
+# For a SymbolSequence only the symbols need to be looked up.
+def get_frame_classes(A, phone_map, f = None):
+  class_ids = { "0": 0, "1": 1, "2": 2 }
+  phone_classes = dict([ (p, class_ids.get(c, -1)) for p, c in phone_map.items() ])
+  if isinstance(A, SymbolSequence):
+    C = np.array([ phone_classes.get(x, -1) for x in A.symbols ], dtype=np.int8)[A.ids]
+  else:
+    C = np.fromiter(map(phone_classes.get, A, [-1] * len(A)), dtype=np.int8, count=len(A))
+  if (C < 0).any():
+    sys.stderr.write("%s: Error: Phones in file %s are not in the phone map or have invalid classes\n" % (sys.argv[0], f))
+    sys.exit(1)
+  return C
+
+# Return the frames where the phone is different from that of the
+# previous frame, i.e. the starts of the runs of the same phone
+def get_phone_run_starts(A):
+  if isinstance(A, SymbolSequence):
+    change = A.ids[1:] != A.ids[:-1]
+  else:
+    change = np.fromiter(map(operator.ne, A[1:], A[:-1]), dtype=bool, count=len(A)-1)
+  return np.concatenate(([0], np.flatnonzero(change) + 1))
+
+# Same as map_prediction, but the phones are mapped to their classes once
+# through a lookup table and the frame types come from the constant
+# tables above. Returns int8 numpy arrays of frame types instead of lists
+# of strings.
+def map_prediction_table(A1, A2, phone_map, speech_cap = None, f = None):
+  if A2 == None:
+    # Isolated segmentation
+    if len(A1) == 0:
+      sys.stderr.write("In file %s\n" % f)
+      sys.exit(1)
+    # Map each run of the same phone to a frame type at once
+    run_starts = get_phone_run_starts(A1)
+    run_lengths = np.diff(np.append(run_starts, len(A1)))
+    if isinstance(A1, SymbolSequence):
+      run_phones = SymbolSequence(A1.ids[run_starts], A1.symbols)
+    else:
+      run_phones = [ A1[i] for i in run_starts.tolist() ]
+    C = get_frame_classes(run_phones, phone_map, f)
+    run_types = np.array(ISOLATED_TYPE, dtype=np.int8)[C]
+    if speech_cap != None:
+      # Runs longer than speech_cap are noise unless they are silence
+      run_types[(run_lengths > speech_cap) & (C != 0)] = 4
+    return np.repeat(run_types, run_lengths)
+  # End if (isolated segmentation)
+
+  # Assuming len(A1) > len(A2)
+  # Otherwise A1 and A2 must be interchanged before
+  # passing to this function
+  # The frames beyond the end of A2 are treated as silence on that channel
+  C2 = np.zeros(len(A1), dtype=np.int8)
+  C2[0:len(A2)] = get_frame_classes(A2, phone_map, f)
+  joint_class = 3 * get_frame_classes(A1, phone_map, f) + C2
+  return (np.array(JOINT_THIS_TYPE, dtype=np.int8)[joint_class],
+      np.array(JOINT_THAT_TYPE, dtype=np.int8)[joint_class])
+
+# Set the global analysis objects, to which the analyses of
+# the individual recordings are added
+def init_global_analyses(frame_shift):
+  global global_analysis_get_initial_segments
+  global_analysis_get_initial_segments = Analysis("TOTAL_Get_Initial_Segments", frame_shift, "Global Analysis after get_initial_segments")
+
+  global global_analysis_set_nonspeech_proportion
+  global_analysis_set_nonspeech_proportion = Analysis("TOTAL_set_nonspeech_proportion", frame_shift, "Global Analysis after set_nonspeech_proportion")
+
+  global global_analysis_final
+  global_analysis_final= Analysis("TOTAL_Final", frame_shift, "Global Analysis Final")
+
+# Resegment an isolated recording (files = (f,)) or a pair of
+# recordings of the two channels of a conversation (files = (f1, f2)).
+# Returns the lines of the output segments file sorted by utterance-id.
+# If out_file is given, the segments of each recording are instead
+# written to it as soon as the recording is done.
+def resegment_recordings(files, options, phone_map, speech_cap, references, stats, timings = None, out_file = None):
+  prediction_dir = options.prediction_dir
+  if options.engine == "numpy":
+    Resegmenter = NumpyJointResegmenter
+  else:
+    Resegmenter = JointResegmenter
+
+  # Map the predicted phones to frame types with the lookup tables if
+  # numpy is available. The python engine works on lists of strings.
+  def map_frames(A1, A2, f = None):
+    if not use_numpy:
+      return map_prediction(A1, A2, phone_map, speech_cap, f)
+    B = map_prediction_table(A1, A2, phone_map, speech_cap, f)
+    if options.engine == "numpy":
+      return B
+    frame_types = np.array([ str(i) for i in range(0, 15) ])
+    if A2 == None:
+      return frame_types[B].tolist()
+    return (frame_types[B[0]].tolist(), frame_types[B[1]].tolist())
+
+  streaming = out_file != None
+  if not streaming:
+    out_file = StringIO()
+  if len(files) == 1:
+    f = files[0]
+    try:
+      A = read_frame_labels(os.path.join(prediction_dir, f+".pred"))[1]
+    except IndexError:
+      sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f))
+      sys.exit(1)
+
+    B = map_frames(A, None, f)
+
+    reference = references.get(f)
+    r = Resegmenter(A, B, f, options, phone_map, stats, reference, timings)
+    r.resegment()
+    r.print_segments(out_file)
+  else:
+    f1, f2 = files
+    try:
+      A1 = read_frame_labels(os.path.join(prediction_dir, f1+".pred"))[1]
+    except IndexError:
+      sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f1))
+      sys.exit(1)
+    try:
+      A2 = read_frame_labels(os.path.join(prediction_dir, f2+".pred"))[1]
+    except IndexError:
+      sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f2))
+      sys.exit(1)
+
+    if len(A1) < len(A2):
+      A3 = A1
+      A1 = A2
+      A2 = A3
+
+      f3 = f1
+      f1 = f2
+      f2 = f3
+    # End if
+
+    if (len(A1) - len(A2)) > options.max_length_diff / options.frame_shift:
+      sys.stderr.write( \
+          "%s: Warning: Lengths of %s and %s differ by more than %f. " \
+          % (sys.argv[0], f1,f2, options.max_length_diff) \
+          + "So using isolated resegmentation\n")
+      B1 = map_frames(A1, None)
+      B2 = map_frames(A2, None)
+    else:
+      B1,B2 = map_frames(A1, A2)
+    # End if
+
+    reference1 = references.get(f1)
+    r1 = Resegmenter(A1, B1, f1, options, phone_map, stats, reference1, timings)
+    r1.resegment()
+    r1.print_segments(out_file)
+    # Free the labels of the first channel before doing the second
+    del r1, B1, reference1
+
+    reference2 = references.get(f2)
+    r2 = Resegmenter(A1, B2, f2, options, phone_map, stats, reference2, timings)
+    r2.resegment()
+    r2.restrict(len(A2))
+    r2.print_segments(out_file)
+  # End if
+
+  if streaming:
+    return None
+  return sorted(out_file.getvalue().splitlines(True))
+
+# Run a job in a worker process when --num-jobs is more than 1.
+# The analyses are accumulated in new global analysis objects in the
+# worker and returned along with the stats and timings to be added to
+# the global ones in the main process.
+# Returns None if the job failed.
+def resegment_job(args):
+  files, options, phone_map, speech_cap, references = args
+  init_global_analyses(options.frame_shift)
+  stats = Stats()
+  timings = None
+  if options.timing_log != None:
+    timings = StageTimings()
+  try:
+    lines = resegment_recordings(files, options, phone_map, speech_cap, references, stats, timings)
+  except SystemExit:
+    return None
+  return (lines, global_analysis_get_initial_segments,
+      global_analysis_set_nonspeech_proportion, global_analysis_final, stats, timings)
+
 def main():
   parser = ArgumentParser(description='Get segmentation arguments')
   parser.add_argument('--verbose', type=int, \
@@ -1317,11 +2454,54 @@ def main():
       + "segmentation to be done (default: %(default)s)")
   parser.add_argument('--reference-rttm', dest='reference_rttm', \
       help="RTTM file to compare and get statistics (default: %(default)s)")
+  parser.add_argument('--external-sort-rttm', \
+      dest='external_sort_rttm', action='store_true', \
+      help="Group the lines of the reference RTTM by file-id using the " \
+      + "external sort command instead of in memory. Use this for very " \
+      + "large RTTM files (default: %(default)s)")
+  parser.add_argument('--low-memory', \
+      dest='low_memory', action='store_true', \
+      help="Bound the memory used for large sets of recordings. The " \
+      + "reference RTTM is read one recording at a time instead of " \
+      + "all at once, the segments of each recording are written out " \
+      + "as soon as it is done and the peak memory usage is reported " \
+      + "(default: %(default)s)")
+  parser.add_argument('--fast-analysis', \
+      dest='fast_analysis', action='store_true', \
+      help="Compute the frame-level analyses against the reference RTTM " \
+      + "with numpy instead of a loop over the frames. The numpy engine " \
+      + "always does this. The statistics are the same either way " \
+      + "(default: %(default)s)")
   parser.add_argument('--speech-cap-length', type=float, default=None, \
       help="Maximum length in seconds of a particular speech phone prediction." \
       + "\nAny length above this will be considered as noise")
+  parser.add_argument('--engine', type=str, \
+      dest='engine', default="python", choices=("python", "numpy"), \
+      help="Implementation of the resegmenter to use. The numpy engine " \
+      + "stores the frame labels in NumPy arrays and is faster on long " \
+      + "recordings. Both give the same segments. (default: %(default)s)")
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help="Number of processes used to resegment the recordings in " \
+      + "parallel (default: %(default)s)")
+  parser.add_argument('--timing-log', type=str, \
+      dest='timing_log', default=None, \
+      help="Write the wall-clock and CPU time, and the number of frames " \
+      + "and segments of each stage of the resegmentation of each " \
+      + "recording to this file, and a summary of the slowest " \
+      + "recordings to stderr (default: %(default)s)")
+  parser.add_argument('--timing-log-format', type=str, \
+      dest='timing_log_format', default="json", choices=("json", "csv"), \
+      help="Format of the timing log: one JSON object per line or " \
+      + "CSV with a header (default: %(default)s)")
+  parser.add_argument('--timing-log-num-slowest', type=int, \
+      dest='timing_log_num_slowest', default=10, \
+      help="Number of the slowest recordings in the summary of the " \
+      + "timing log (default: %(default)s)")
   parser.add_argument('prediction_dir', \
-      help='Directory where the predicted phones (.pred files) are found')
+      help='Directory where the predicted phones (.pred files) are found. ' \
+      + 'The .pred files can be in text or binary format ' \
+      + '(see pred_to_binary.py).')
   parser.add_argument('phone_map', \
       help='Phone Map file that maps from phones to classes')
   parser.add_argument('output_segments', nargs='?', default="-", \
@@ -1342,6 +2522,21 @@ def main():
         % options.remove_noise_only_segments)
     sys.exit(1)
 
+  if options.num_jobs < 1:
+    sys.stderr.write("%s: Error: Invalid value for num-jobs %d\n" \
+        % (sys.argv[0], options.num_jobs))
+    sys.exit(1)
+
+  if options.engine == "numpy" and not use_numpy:
+    sys.stderr.write("%s: Error: --engine numpy requires the numpy module\n" \
+        % sys.argv[0])
+    sys.exit(1)
+
+  if options.fast_analysis and not use_numpy:
+    sys.stderr.write("%s: Error: --fast-analysis requires the numpy module\n" \
+        % sys.argv[0])
+    sys.exit(1)
+
   if options.output_segments == '-':
     out_file = sys.stdout
   else:
@@ -1365,33 +2560,33 @@ def main():
   channel1_file = options.channel1_file
   channel2_file = options.channel2_file
 
-  temp_dir = prediction_dir + "/../rttm_classes"
-  os.system("mkdir -p %s" % temp_dir)
-  if options.reference_rttm != None:
-    read_rttm_file(options.reference_rttm, temp_dir, options.frame_shift)
-  else:
-    temp_dir = None
+  references = {}
+  if options.reference_rttm != None and options.low_memory:
+    references = RttmReferences(options.reference_rttm, options.frame_shift)
+  elif options.reference_rttm != None:
+    references = read_rttm_file(options.reference_rttm, options.frame_shift, options.external_sort_rttm)
 
   stats = Stats()
 
+  timings = None
+  if options.timing_log != None:
+    timings = StageTimings()
+
   pred_files = dict([ (f.split('/')[-1][0:-5], False) \
     for f in glob.glob(os.path.join(prediction_dir, "*.pred")) ])
 
-  global global_analysis_get_initial_segments
-  global_analysis_get_initial_segments = Analysis("TOTAL_Get_Initial_Segments", options.frame_shift, "Global Analysis after get_initial_segments")
-
-  global global_analysis_set_nonspeech_proportion
-  global_analysis_set_nonspeech_proportion = Analysis("TOTAL_set_nonspeech_proportion", options.frame_shift, "Global Analysis after set_nonspeech_proportion")
-
-  global global_analysis_final
-  global_analysis_final= Analysis("TOTAL_Final", options.frame_shift, "Global Analysis Final")
+  init_global_analyses(options.frame_shift)
 
   speech_cap = None
   if options.speech_cap_length != None:
     speech_cap = int( options.speech_cap_length / options.frame_shift )
   # End if
 
-  for f in pred_files:
+  # Make a list of the jobs to be done. Each job is either an isolated
+  # recording or a pair of recordings corresponding to the two channels
+  # of a conversation, which are segmented jointly.
+  jobs = []
+  for f in sorted(pred_files.keys()):
     if pred_files[f]:
       continue
     if re.match(".*_"+channel1_file, f) is None:
@@ -1410,86 +2605,52 @@ def main():
 
     if options.isolated_resegmentation or f2 not in pred_files or f1 not in pred_files:
       pred_files[f] = True
-      try:
-        A = open(os.path.join(prediction_dir, f+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f))
-        sys.exit(1)
-
-      B = map_prediction(A, None, phone_map, speech_cap, f)
-
-      if temp_dir != None:
-        try:
-          reference = open(os.path.join(temp_dir, f+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference = None
-      else:
-        reference = None
-      r = JointResegmenter(A, B, f, options, phone_map, stats, reference)
-      r.resegment()
-      r.print_segments(out_file)
+      jobs.append((f,))
     else:
       if pred_files[f1] and pred_files[f2]:
         continue
       pred_files[f1] = True
       pred_files[f2] = True
-      try:
-        A1 = open(os.path.join(prediction_dir, f1+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f1))
-        sys.exit(1)
-      try:
-        A2 = open(os.path.join(prediction_dir, f2+".pred")).readline().strip().split()[1:]
-      except IndexError:
-        sys.stderr.write("Incorrect format of file %s/%s.pred\n" % (prediction_dir, f2))
-        sys.exit(1)
-
-      if len(A1) < len(A2):
-        A3 = A1
-        A1 = A2
-        A2 = A3
-
-        f3 = f1
-        f1 = f2
-        f2 = f3
-      # End if
-
-      if (len(A1) - len(A2)) > options.max_length_diff / options.frame_shift:
-        sys.stderr.write( \
-            "%s: Warning: Lengths of %s and %s differ by more than %f. " \
-            % (sys.argv[0], f1,f2, options.max_length_diff) \
-            + "So using isolated resegmentation\n")
-        B1 = map_prediction(A1, None, phone_map, speech_cap)
-        B2 = map_prediction(A2, None, phone_map, speech_cap)
-      else:
-        B1,B2 = map_prediction(A1, A2, phone_map, speech_cap)
-      # End if
-
-      if temp_dir != None:
-        try:
-          reference1 = open(os.path.join(temp_dir, f1+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference1 = None
-      else:
-        reference1 = None
-      r1 = JointResegmenter(A1, B1, f1, options, phone_map, stats, reference1)
-      r1.resegment()
-      r1.print_segments(out_file)
-
-      if temp_dir != None:
-        try:
-          reference2 = open(os.path.join(temp_dir, f2+".ref")).readline().strip().split()[1:]
-        except IOError:
-          reference2= None
-      else:
-        reference2 = None
-      r2 = JointResegmenter(A1, B2, f2, options, phone_map, stats, reference2)
-      r2.resegment()
-      r2.restrict(len(A2))
-      r2.print_segments(out_file)
+      jobs.append((f1, f2))
     # End if
   # End for loop over files
 
+  if options.num_jobs > 1:
+    # Run the jobs in a pool of worker processes. The results are
+    # returned in the order of the jobs, so that the output does
+    # not depend on the number of jobs.
+    pool = multiprocessing.Pool(options.num_jobs)
+    # Only the references of the recordings in a job are sent to the worker
+    if options.low_memory and options.reference_rttm != None:
+      job_references = lambda files: references.subset(files)
+    else:
+      job_references = lambda files: dict([ (f, references[f]) for f in files if f in references ])
+    results = pool.imap(resegment_job, ( (files, options, phone_map, speech_cap,
+      job_references(files)) for files in jobs ))
+    for result in results:
+      if result == None:
+        pool.terminate()
+        sys.exit(1)
+      lines, analysis_get_initial_segments, analysis_set_nonspeech_proportion, analysis_final, job_stats, job_timings = result
+      out_file.write(''.join(lines))
+      global_analysis_get_initial_segments.add(analysis_get_initial_segments)
+      global_analysis_set_nonspeech_proportion.add(analysis_set_nonspeech_proportion)
+      global_analysis_final.add(analysis_final)
+      stats.add(job_stats)
+      if timings != None:
+        timings.add(job_timings)
+    pool.close()
+    pool.join()
+  else:
+    for files in jobs:
+      if options.low_memory:
+        resegment_recordings(files, options, phone_map, speech_cap, references, stats, timings, out_file)
+        out_file.flush()
+      else:
+        lines = resegment_recordings(files, options, phone_map, speech_cap, references, stats, timings)
+        out_file.write(''.join(lines))
+  # End if
+
   if options.reference_rttm != None:
     global_analysis_get_initial_segments.write_confusion_matrix(True)
     global_analysis_get_initial_segments.write_total_stats(True)
@@ -1501,6 +2662,23 @@ def main():
     global_analysis_final.write_total_stats(True)
     global_analysis_final.write_length_stats()
 
+  if timings != None:
+    try:
+      timing_log = open(options.timing_log, 'w')
+    except IOError as e:
+      sys.stderr.write("%s: %s: Unable to open file %s\n" % (sys.argv[0], e, options.timing_log))
+      sys.exit(1)
+    timings.write(timing_log, options.timing_log_format)
+    timing_log.close()
+    timings.write_summary(options.timing_log_num_slowest)
+
+  if options.low_memory:
+    peak_rss, peak_rss_children = get_peak_rss()
+    sys.stderr.write("%s: Peak RSS: %.1f MB" % (sys.argv[0], peak_rss))
+    if options.num_jobs > 1:
+      sys.stderr.write(", largest worker process: %.1f MB" % peak_rss_children)
+    sys.stderr.write("\n")
+
 if __name__ == '__main__':
   with Timer() as t:
     main()
@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+# Apache 2.0
+
+# Tests of the frame label formats of segmentation.py, e.g.
+#   python local/resegment/segmentation_test.py
+
+import os, shutil, tempfile, unittest
+
+from segmentation import read_frame_labels, write_frame_labels, SymbolSequence
+
+class FrameLabelsTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.labels = [ "1", "1", "2", "0", "2", "2", "10", "1" ] * 3
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_binary_round_trip(self):
+    file_name = os.path.join(self.dir, "BABEL_A_1.pred")
+    write_frame_labels(file_name, "BABEL_A_1", self.labels)
+    file_id, labels = read_frame_labels(file_name)
+    self.assertEqual(file_id, "BABEL_A_1")
+    self.assertTrue(isinstance(labels, SymbolSequence))
+    self.assertEqual(len(labels), len(self.labels))
+    self.assertEqual(list(labels), self.labels)
+    self.assertEqual(labels[3], "0")
+    self.assertEqual(labels[2:5], self.labels[2:5])
+
+    # a SymbolSequence is written with its own symbols
+    copy_name = os.path.join(self.dir, "copy.pred")
+    write_frame_labels(copy_name, file_id, labels)
+    self.assertEqual(read_frame_labels(copy_name)[0], "BABEL_A_1")
+    self.assertEqual(list(read_frame_labels(copy_name)[1]), self.labels)
+
+  def test_binary_no_frames(self):
+    file_name = os.path.join(self.dir, "empty.pred")
+    write_frame_labels(file_name, "empty", [])
+    file_id, labels = read_frame_labels(file_name)
+    self.assertEqual(file_id, "empty")
+    self.assertEqual(list(labels), [])
+
+  def test_text(self):
+    file_name = os.path.join(self.dir, "BABEL_A_1.ref")
+    with open(file_name, "w") as f:
+      f.write("BABEL_A_1 " + " ".join(self.labels) + "\n")
+    file_id, labels = read_frame_labels(file_name)
+    self.assertEqual(file_id, "BABEL_A_1")
+    self.assertEqual(labels, self.labels)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -7,22 +7,30 @@
 # from the Project Gutenberg's texts
 
 import argparse
+import collections
+import itertools
+import multiprocessing
 import re
 import sys
 
-roman_number = [re.compile('^\s*[_LXVI]+(\.)?\s*$'), ]
+# Each class of rules is a single precompiled regex, which matches if one of
+# the patterns of the class matches at the start of the line
+def combine(patterns, flags=0):
+    return re.compile('|'.join('(?:%s)' % p for p in patterns), flags)
 
-sq_brackets = [re.compile('(.*)(\[.+\])(.*)', re.IGNORECASE)]
+roman_number = combine(['^\s*[_LXVI]+(\.)?\s*$'])
 
-pipes = [re.compile('^\s*\|.*\|\s*$')]
+sq_brackets = combine(['(.*)(\[.+\])(.*)'], re.IGNORECASE)
 
-non_word = [re.compile('^\W+$')]
+pipes = combine(['^\s*\|.*\|\s*$'])
 
-chapter = [re.compile('^\s*((Chapter)|(Volume)|(Canto)).*[LXIV0-9]+.*$', re.IGNORECASE),]
+non_word = combine(['^\W+$'])
 
-contents = [re.compile('CONTENTS'),
-            re.compile('^.*((\s{2,50})|([\t]+))[0-9]+\s*$'),
-            re.compile('^\s*((I+[:.]+)|(I?[LXV]+I*([\.:])?))\s+.*')]
+chapter = combine(['^\s*((Chapter)|(Volume)|(Canto)).*[LXIV0-9]+.*$'], re.IGNORECASE)
+
+contents = combine(['CONTENTS',
+                    '^.*((\s{2,50})|([\t]+))[0-9]+\s*$',
+                    '^\s*((I+[:.]+)|(I?[LXV]+I*([\.:])?))\s+.*'])
 
 debug = None
 
@@ -32,10 +40,19 @@ def parse_opts():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--debug', default=False, action='store_true',
                         help='Debug info - e.g. showing the lines that were stripped')
-
-    parser.add_argument('in_text', type=str, help='Input text file')
-    parser.add_argument('out_text', type=str, help='Filtered output text file')
+    parser.add_argument('--book-list', type=str, default=None,
+                        help='A file with an "<input-text> <output-text>" pair per line. '
+                             'If given, all these books are filtered, instead of "in_text"')
+    parser.add_argument('--num-jobs', type=int, default=1,
+                        help='The number of processes that filter the books of "--book-list"')
+
+    parser.add_argument('in_text', type=str, nargs='?', help='Input text file')
+    parser.add_argument('out_text', type=str, nargs='?', help='Filtered output text file')
     opts = parser.parse_args()
+    if (opts.book_list is None) == (opts.in_text is None or opts.out_text is None):
+        parser.error('either "--book-list" or "in_text" and "out_text" must be given')
+    if opts.num_jobs < 1:
+        parser.error('"--num-jobs" must be positive')
     global debug
     debug = opts.debug
     return opts
@@ -46,68 +63,107 @@ def debug_log(lines, idx, context=2):
         end = min(len(lines), idx + context + 1)
         sys.stderr.write('\n'.join('> %s' % l for l in lines[start:end]) + '\n\n')
 
-def match(regexes, line):
-    for r in regexes:
-        if r.match(line) is not None:
-            return True
-    return False
+def match(regex, line):
+    return regex.match(line) is not None
 
-def empty_lines(lines, index, extent):
+def filter_lines(lines, context=2):
     """
-    If the 'extent' is negative, the function checks the preceding lines
+    Filters the (stripped) lines of a book, and yields the lines to keep.
+    The checks for empty lines around a line and the debug log only look
+    at the 'context' lines before and after it, so the lines are read through
+    a sliding window of these lines.
     """
-    if extent > 0:
-        start = min(index + 1, len(lines)-1)
-        end = min(index + extent + 1, len(lines))
-    else:
-        start = max(0, index + extent)
-        end = max(0, index)
-    for l in lines[start:end]:
-        if len(l) > 0:
-            return False
-    return True
-
-if __name__ == '__main__':
-    opts = parse_opts()
-
-    with open(opts.in_text) as in_text:
-        in_lines = [l.strip() for l in in_text.readlines()]
-
-    out_lines = list()
-    for i, l in enumerate(in_lines):
+    lines = iter(lines)
+    before = collections.deque(maxlen=context)
+    after = collections.deque(itertools.islice(lines, context + 1))
+    while after:
+        l = after.popleft()
+        next_line = next(lines, None)
+        if next_line is not None:
+            after.append(next_line)
+        window = list(before) + [l] + list(after)
+        idx = len(before)
+        before.append(l)
         if len(l) == 0:
             continue
 
+        # The first line counts as preceded by an empty line, but the last
+        # line does not count as followed by one
+        prev_empty = idx == 0 or len(window[idx - 1]) == 0
+        next_empty = idx + 1 < len(window) and len(window[idx + 1]) == 0
+
         # Roman numeral alone in a line, surrounded by empty lines
-        if match(roman_number, l) and empty_lines(in_lines, i, -1) and empty_lines(in_lines, i, 1):
+        if match(roman_number, l) and prev_empty and next_empty:
             #print 'matched roman'
-            debug_log(in_lines, i)
+            debug_log(window, idx)
             continue
 
-        if match(chapter, l) and (empty_lines(in_lines, i, -1) or empty_lines(in_lines, i, 1)):
+        if match(chapter, l) and (prev_empty or next_empty):
             #print 'matched chapter'
-            debug_log(in_lines, i)
+            debug_log(window, idx)
             continue
 
         if match(non_word, l):
-            debug_log(in_lines, i)
+            debug_log(window, idx)
             continue
 
         if match(contents, l):
             #print 'matched contents'
-            debug_log(in_lines, i)
+            debug_log(window, idx)
             continue
 
         if match(pipes, l):
-            debug_log(in_lines, i)
+            debug_log(window, idx)
             continue
 
         if match(sq_brackets, l):
-            debug_log(in_lines, i)
-            l = sq_brackets[0].sub(r'\1\3', l)
+            debug_log(window, idx)
+            l = sq_brackets.sub(r'\1\3', l)
 
-        out_lines.append(l)
+        yield l
 
-    with open(opts.out_text, 'w') as out_text:
-        out_text.write('\n'.join(out_lines) + '\n')
-        
\ No newline at end of file
+def filter_book(in_file, out_file):
+    with open(in_file) as in_text, open(out_file, 'w') as out_text:
+        num_lines = 0
+        for l in filter_lines(l.strip() for l in in_text):
+            out_text.write(l + '\n')
+            num_lines += 1
+        if num_lines == 0:
+            out_text.write('\n')
+
+def filter_book_job(files):
+    """
+    Filters a book of the "--book-list" in a worker process.
+    Returns None, or an error message if the book could not be filtered.
+    """
+    try:
+        filter_book(*files)
+    except (IOError, OSError) as e:
+        return 'ERROR: %s: %s' % (files[0], e)
+    return None
+
+if __name__ == '__main__':
+    opts = parse_opts()
+
+    if opts.book_list is None:
+        filter_book(opts.in_text, opts.out_text)
+        sys.exit(0)
+
+    with open(opts.book_list) as book_list:
+        books = [tuple(l.split()) for l in book_list if len(l.split()) > 0]
+    for b in books:
+        if len(b) != 2:
+            sys.stderr.write('ERROR: Invalid line in %s: %s\n' % (opts.book_list, ' '.join(b)))
+            sys.exit(1)
+    if opts.num_jobs > 1:
+        pool = multiprocessing.Pool(opts.num_jobs)
+        errors = pool.map(filter_book_job, books, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        errors = [filter_book_job(b) for b in books]
+    errors = [e for e in errors if e is not None]
+    for e in errors:
+        sys.stderr.write(e + '\n')
+    if len(errors) > 0:
+        sys.exit(1)
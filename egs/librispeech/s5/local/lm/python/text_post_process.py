@@ -22,57 +22,93 @@ def parse_args():
                         help='If True and a sentence longer than "max-sent-len" detected' +\
                              'exit with error code 1. If False, just split the long sentences.')
     parser.add_argument('--sent-end-marker', type=str, default="DOTDOTDOT")
-    parser.add_argument("in_text", type=str, help="Input text")
-    parser.add_argument("out_text", type=str, help="Output text")
-    parser.add_argument("sent_bounds", type=str,
+    parser.add_argument('--opl-list', type=str, default=None,
+                        help='A file with an "<in-text> <out-text> <sent-bounds>" triple per line. ' +\
+                             'If given, all these files are processed, instead of "in_text"')
+    parser.add_argument("in_text", type=str, nargs='?', help="Input text")
+    parser.add_argument("out_text", type=str, nargs='?', help="Output text")
+    parser.add_argument("sent_bounds", type=str, nargs='?',
                         help="A file that will contain a comma separated list of numbers, s.t. if" +
                              "i is in this list, then there is a sententence break after token i")
-    return parser.parse_args()
+    opts = parser.parse_args()
+    positionals = [opts.in_text, opts.out_text, opts.sent_bounds]
+    if opts.opl_list is not None:
+        if any(p is not None for p in positionals):
+            parser.error('"in_text", "out_text" and "sent_bounds" cannot be given with "--opl-list"')
+    elif any(p is None for p in positionals):
+        parser.error('either "--opl-list" or "in_text", "out_text" and "sent_bounds" must be given')
+    return opts
 
+word_token = re.compile("^[A-Z]+\'?[A-Z\']*$")
 
-if __name__ == '__main__':
-    opts = parse_args()
-    with open(opts.in_text) as src, \
-         open(opts.out_text, 'w') as dst, \
-         open(opts.sent_bounds, 'w') as bounds:
-        corrections = 0
-        lines = list()
-        current_line = list()
-        sent_bounds = list()
-        n_tokens = 0
-        for opl_line in src:
-            start_scan = 3
-            opl_line = opl_line.upper()
-            opl_tokens = opl_line.split()
-            if opl_tokens[0] == opts.sent_end_marker.upper():
-                sent_bounds.append(n_tokens - 1)
-                if len(current_line) > opts.max_sent_len:
-                    if opts.abort_long_sent:
-                        sys.stderr.write('ERROR: Too long sentence - aborting!\n')
-                        sys.exit(1)
-                    else:
-                        sys.stderr.write('WARNING: Too long sentence - splitting ...\n')
-                        sent_start = 0
-                        while sent_start < len(current_line):
-                            lines.append(' '.join(current_line[sent_start:\
-                                                  sent_start + opts.max_sent_len]))
-                            sent_start += opts.max_sent_len
+def post_process(src, dst, bounds, opts):
+    """
+    Reads the .opl lines from 'src', and writes each sentence to 'dst' as
+    soon as its end marker is seen, and its bound to 'bounds'.
+    Returns the number of corrected tokens.
+    """
+    corrections = 0
+    num_lines = 0
+    current_line = list()
+    num_bounds = 0
+    n_tokens = 0
+    sent_end_marker = opts.sent_end_marker.upper()
+    for opl_line in src:
+        start_scan = 3
+        opl_line = opl_line.upper()
+        opl_tokens = opl_line.split()
+        if opl_tokens[0] == sent_end_marker:
+            bounds.write('%s%d' % (',' if num_bounds > 0 else '', n_tokens - 1))
+            num_bounds += 1
+            if len(current_line) > opts.max_sent_len:
+                if opts.abort_long_sent:
+                    sys.stderr.write('ERROR: Too long sentence - aborting!\n')
+                    sys.exit(1)
                 else:
-                    lines.append(' '.join(current_line))
-                current_line = list()
-                continue
-            if len(opl_tokens) >= 4 and opl_tokens[3] == 'SUNDAY' and opl_tokens[1] == 'EXPN':
-                corrections += 1
+                    sys.stderr.write('WARNING: Too long sentence - splitting ...\n')
+                    sent_start = 0
+                    while sent_start < len(current_line):
+                        dst.write(' '.join(current_line[sent_start:\
+                                           sent_start + opts.max_sent_len]) + '\n')
+                        num_lines += 1
+                        sent_start += opts.max_sent_len
+            else:
+                dst.write(' '.join(current_line) + '\n')
+                num_lines += 1
+            current_line = list()
+            continue
+        if len(opl_tokens) >= 4 and opl_tokens[3] == 'SUNDAY' and opl_tokens[1] == 'EXPN':
+            corrections += 1
+            n_tokens += 1
+            start_scan = 4
+            current_line.append('SUN')
+        for i in xrange(start_scan, len(opl_tokens)):
+            if word_token.match(opl_tokens[i]) is not None:
                 n_tokens += 1
-                start_scan = 4
-                current_line.append('SUN')
-            for i in xrange(start_scan, len(opl_tokens)):
-                m = re.match("^[A-Z]+\'?[A-Z\']*$", opl_tokens[i])
-                if m is not None:
-                    n_tokens += 1
-                    current_line.append(opl_tokens[i])
-                #else:
-                #    sys.stderr.write('rejected: %s\n' % opl_tokens[i])
-        sys.stderr.write('Corrected tokens: %d\n' % corrections)
-        dst.write('\n'.join(lines) + '\n')
-        bounds.write(','.join([str(t) for t in sent_bounds]))
+                current_line.append(opl_tokens[i])
+            #else:
+            #    sys.stderr.write('rejected: %s\n' % opl_tokens[i])
+    if num_lines == 0:
+        dst.write('\n')
+    return corrections
+
+if __name__ == '__main__':
+    opts = parse_args()
+    if opts.opl_list is None:
+        files = [(opts.in_text, opts.out_text, opts.sent_bounds)]
+    else:
+        with open(opts.opl_list) as opl_list:
+            files = [tuple(l.split()) for l in opl_list if len(l.split()) > 0]
+        for f in files:
+            if len(f) != 3:
+                sys.stderr.write('ERROR: Invalid line in %s: %s\n' % (opts.opl_list, ' '.join(f)))
+                sys.exit(1)
+    for in_text, out_text, sent_bounds in files:
+        with open(in_text) as src, \
+             open(out_text, 'w') as dst, \
+             open(sent_bounds, 'w') as bounds:
+            corrections = post_process(src, dst, bounds, opts)
+        if opts.opl_list is None:
+            sys.stderr.write('Corrected tokens: %d\n' % corrections)
+        else:
+            sys.stderr.write('%s: Corrected tokens: %d\n' % (in_text, corrections))
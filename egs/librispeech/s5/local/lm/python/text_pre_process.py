@@ -15,7 +15,10 @@
 
 import argparse
 import codecs, unicodedata
+import itertools
+import multiprocessing
 import re
+import sys
 import nltk
 
 def parse_args():
@@ -25,9 +28,24 @@ def parse_args():
     parser.add_argument("--out-encoding", type=str, default="ascii",
                         help="Encoding to use when writing the output text")
     parser.add_argument('--sent-end-marker', type=str, default="DOTDOTDOT")
-    parser.add_argument("in_text", type=str, help="Input text")
-    parser.add_argument("out_text", type=str, help="Output text")
-    return parser.parse_args()
+    parser.add_argument('--chunk-size', type=int, default=10000000,
+                        help="The text is segmented into sentences in chunks of paragraphs "
+                             "of about this many characters, so that a large book is not "
+                             "kept in memory. A sentence can not span two chunks. "
+                             "If 0, the whole text is segmented at once")
+    parser.add_argument('--book-list', type=str, default=None,
+                        help='A file with an "<input-text> <output-text>" pair per line. '
+                             'If given, all these books are processed, instead of "in_text"')
+    parser.add_argument('--num-jobs', type=int, default=1,
+                        help='The number of processes that process the books of "--book-list"')
+    parser.add_argument("in_text", type=str, nargs='?', help="Input text")
+    parser.add_argument("out_text", type=str, nargs='?', help="Output text")
+    opts = parser.parse_args()
+    if (opts.book_list is None) == (opts.in_text is None or opts.out_text is None):
+        parser.error('either "--book-list" or "in_text" and "out_text" must be given')
+    if opts.num_jobs < 1:
+        parser.error('"--num-jobs" must be positive')
+    return opts
 
 # http://rosettacode.org/wiki/Roman_numerals/Decode#Python
 _rdecode = dict(zip('XVI', (10, 5, 1)))
@@ -38,34 +56,56 @@ def decode(roman):
         result += -rd if rd < rd1 else rd
     return result + _rdecode[roman[-1]]
 
+_chapter_roman = re.compile('^(\s*C((hapter)|(HAPTER))\s+)(([IVX]+)|([ivx]+))(.*)')
+_line_roman = re.compile('^(\s*)(([IVX]+)|([ivx]+))([\s\.]+[A-Z].*)')
+
+def convert_roman_line(l):
+    m = _chapter_roman.match(l)
+    if m is not None:
+        return "%s%s%s" % (m.group(1), decode(m.group(5).upper()), m.group(8))
+    m = _line_roman.match(l)
+    if m is not None:
+        return "%s%s%s" % (m.group(1), decode(m.group(2).upper()), m.group(5))
+    return l
+
 def convert_roman(text):
     """
     Uses heuristics to decide whether to convert a string that looks like a
     roman numeral to decimal number.
     """
-    lines = re.split('\r?\n', text)
-    new_lines = list()
-    for i, l in enumerate(lines):
-        m = re.match('^(\s*C((hapter)|(HAPTER))\s+)(([IVX]+)|([ivx]+))(.*)', l)
-        if m is not None:
-            new_line = "%s%s%s" % (m.group(1), decode(m.group(5).upper()), m.group(8))
-            new_lines.append(new_line)
-            continue
-        m = re.match('^(\s*)(([IVX]+)|([ivx]+))([\s\.]+[A-Z].*)', l)
-        if m is not None:
-            new_line = "%s%s%s" % (m.group(1), decode(m.group(2).upper()), m.group(5))
-            new_lines.append(new_line)
-            continue
-        new_lines.append(l)
-    return '\n'.join(new_lines)
+    return '\n'.join(convert_roman_line(l) for l in re.split('\r?\n', text))
+
+# The Punkt model is loaded once in each process, when it is first needed
+_punkt = None
+def get_punkt():
+    global _punkt
+    if _punkt is None:
+        _punkt = nltk.data.load('tokenizers/punkt/english.pickle')
+    return _punkt
 
 def segment_sentences(text, sent_marker):
-    punkt = nltk.data.load('tokenizers/punkt/english.pickle')
-    sents = punkt.tokenize(text)
+    sents = get_punkt().tokenize(text)
     line_sents = [re.sub('\r?\n', ' ', s) for s in sents]
     line_sep = ' %s \n' % sent_marker
     return (line_sep.join(line_sents) + sent_marker)
 
+def pre_segment_lines(lines):
+    """
+    Streaming version of pre_segment(), which takes and yields lines.
+    Like pre_segment(), it drops the last two lines.
+    """
+    lines = iter(lines)
+    punkt = set(['?', '!', '.'])
+    window = list(itertools.islice(lines, 2))
+    for l2 in lines:
+        l, l1 = window
+        if len(l.strip()) != 0 and l.strip()[-1] not in punkt and\
+           len(l1.strip()) == 0:
+            yield l + '.'
+        else:
+            yield l
+        window = [l1, l2]
+
 def pre_segment(text):
     """
     The segmentation at the start of the chapters is not ideal - e.g. Chapter
@@ -73,29 +113,93 @@ def pre_segment(text):
     This routine tries to mitigate this by putting a dot at the end of each line
     followed by 1 or more empty lines.
     """
-    lines = text.split('\n')
-    out_text = list()
-    punkt = set(['?', '!', '.'])
-    for i, l in enumerate(lines[:-2]):
-        if len(l.strip()) != 0 and l.strip()[-1] not in punkt and\
-           len(lines[i+1].strip()) == 0: #  and len(lines[i+2].strip()) == 0:
-            out_text.append(l + '.')
-        else:
-            out_text.append(l)
-    return '\n'.join(out_text)
+    return '\n'.join(pre_segment_lines(text.split('\n')))
 
-if __name__ == '__main__':
-    opts = parse_args()
-    with codecs.open(opts.in_text, 'r', opts.in_encoding, errors='ignore') as src:
-        text_in = src.read()
+def read_lines(in_text, in_encoding, out_encoding, block_size=1024*1024):
+    """
+    Reads the text and yields its lines, normalized and converted to the
+    output encoding like the whole text was before, without the line breaks.
+    """
+    decoder = codecs.getincrementaldecoder(in_encoding)(errors='ignore')
+    tail = u''
+    with open(in_text, 'rb') as src:
+        while True:
+            block = src.read(block_size)
+            lines = (tail + decoder.decode(block, final=(len(block) == 0))).split(u'\n')
+            tail = lines.pop()
+            for l in lines + ([tail] if len(block) == 0 else []):
+                l = unicodedata.normalize('NFKD', l).encode(out_encoding, 'ignore')
+                yield l[:-1] if l.endswith('\r') else l
+            if len(block) == 0:
+                break
+
+def split_chunks(lines, chunk_size):
+    """
+    Joins the lines into chunks of at least 'chunk_size' characters, which
+    end before an empty line
+    """
+    chunk = list()
+    size = 0
+    for l in lines:
+        if chunk_size > 0 and size >= chunk_size and len(l.strip()) == 0:
+            yield '\n'.join(chunk)
+            chunk = list()
+            size = 0
+        chunk.append(l)
+        size += len(l) + 1
+    yield '\n'.join(chunk)
+
+def process_book(in_text, out_text, opts):
+    lines = read_lines(in_text, opts.in_encoding, opts.out_encoding)
+    lines = pre_segment_lines(convert_roman_line(l) for l in lines)
+    line_sep = ' %s \n' % opts.sent_end_marker
+    with open(out_text, 'w') as dst:
+        num_sents = 0
+        for chunk in split_chunks(lines, opts.chunk_size):
+            sents = get_punkt().tokenize(chunk)
+            if len(sents) == 0:
+                continue
+            if num_sents > 0:
+                dst.write(line_sep)
+            dst.write(line_sep.join([re.sub('\r?\n', ' ', s) for s in sents]))
+            num_sents += len(sents)
+        dst.write(opts.sent_end_marker)
 
-    text = unicodedata.normalize(
-                'NFKD', text_in).encode(opts.out_encoding, 'ignore')
-    text = convert_roman(text)
-    text = pre_segment(text)
-    text = segment_sentences(text, opts.sent_end_marker)
+def process_book_job(args):
+    """
+    Processes a book of the "--book-list" in a worker process.
+    Returns None, or an error message if the book could not be processed.
+    """
+    in_text, out_text, opts = args
+    try:
+        process_book(in_text, out_text, opts)
+    except (IOError, OSError) as e:
+        return 'ERROR: %s: %s' % (in_text, e)
+    return None
 
-    with open(opts.out_text, 'w') as dst:
-        dst.write(text)
+if __name__ == '__main__':
+    opts = parse_args()
 
+    if opts.book_list is None:
+        process_book(opts.in_text, opts.out_text, opts)
+        sys.exit(0)
 
+    with open(opts.book_list) as book_list:
+        books = [tuple(l.split()) for l in book_list if len(l.split()) > 0]
+    for b in books:
+        if len(b) != 2:
+            sys.stderr.write('ERROR: Invalid line in %s: %s\n' % (opts.book_list, ' '.join(b)))
+            sys.exit(1)
+    jobs = [(in_text, out_text, opts) for in_text, out_text in books]
+    if opts.num_jobs > 1:
+        pool = multiprocessing.Pool(opts.num_jobs)
+        errors = pool.map(process_book_job, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        errors = [process_book_job(j) for j in jobs]
+    errors = [e for e in errors if e is not None]
+    for e in errors:
+        sys.stderr.write(e + '\n')
+    if len(errors) > 0:
+        sys.exit(1)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Apache 2.0
+
+# Reading and writing of language models in ARPA format for the python
+# scripts in utils/, e.g. utils/reverse_arpa.py.
+#
+# open_arpa() opens an ARPA file for reading or writing, with transparent
+# gzip compression for names ending in .gz and "-" for stdin/stdout.
+# read_arpa() reads the header and then streams the n-grams one by one, so
+# that a script only keeps what it needs in memory.
+#
+# The n-grams of a model can also be kept in a binary cache file next to the
+# ARPA file (<arpa>.cache). It holds the vocabulary, the word ids,
+# probabilities and backoff weights of each order as raw arrays and the md5
+# checksum of the ARPA file it was made from. The arrays are loaded with
+# numpy.memmap, so loading a cached model takes almost no time or memory.
+
+import sys
+import os
+import gzip
+import json
+import hashlib
+
+use_numpy = True
+try:
+  import numpy as np
+except ImportError:
+  use_numpy = False
+
+# Open an ARPA file. In read mode, the returned file yields the lines as
+# utf-8 encoded bytes, which read_arpa() decodes. In write mode, the file
+# takes utf-8 encoded bytes.
+def open_arpa(filename, mode = "r"):
+  if filename == "-":
+    std_file = sys.stdin if mode == "r" else sys.stdout
+    return getattr(std_file, "buffer", std_file)
+  if filename.endswith(".gz"):
+    return gzip.open(filename, mode + "b")
+  return open(filename, mode + "b")
+
+# read language model in ARPA format
+# file is an iterable over the lines of the ARPA file, e.g. a file returned
+# by open_arpa().
+# Returns the n-gram counts in the header and a generator of
+# (n, words, prob, back) for all the n-grams, order by order
+def read_arpa(file):
+  lines = iter(file)
+  def readline():
+    text = next(lines, "")
+    if isinstance(text, bytes):
+      text = text.decode("utf-8")
+    return text
+
+  # the end of the n-grams of an order
+  def is_section_end(text, entry):
+    return (not text) or ((len(entry)==1) and (("-grams:" in text) or (text[:5] == "\\end\\")))
+
+  text=readline()
+  while (text and text[:6] != "\\data\\"): text=readline()
+  if not text:
+    sys.stdout.write("invalid ARPA file\n")
+    sys.exit()
+  while (text and text[:5] != "ngram"): text=readline()
+
+  # get ngram counts
+  cngrams=[]
+  n=0
+  while (text and text[:5] == "ngram"):
+    ind = text.split("=")
+    counts = int(ind[1].strip())
+    r = ind[0].split()
+    read_n = int(r[1].strip())
+    if read_n != n+1:
+      sys.stdout.write("invalid ARPA file: %s\n" % text)
+      sys.exit()
+    n = read_n
+    cngrams.append(counts)
+    text=readline()
+
+  # read all n-grams order by order
+  def read_ngrams(text):
+    for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
+      while (text and "-grams:" not in text): text=readline()
+      if n != int(text[1]):
+        sys.stdout.write("invalid ARPA file: %s\n" % text)
+        sys.exit()
+      entry = text.split()
+      for ng in range(cngrams[n-1]):
+        while (text and len(entry)<2):
+          text=readline()
+          entry = text.split()
+          if is_section_end(text, entry): break
+        if is_section_end(text, entry):
+          break # to deal with incorrect ARPA files
+        prob = float(entry[0])
+        if len(entry)>n+1:
+          back = float(entry[-1])
+          words = entry[1:n+1]
+        else:
+          back = 0.0
+          words = entry[1:]
+        yield (n, words, prob, back)
+        text=readline()
+        entry = text.split()
+        if is_section_end(text, entry): break
+
+    while (text and text[:5] != "\\end\\"): text=readline()
+    if not text:
+      sys.stdout.write("invalid ARPA file\n")
+      sys.exit()
+
+  return (cngrams, read_ngrams(text))
+
+cache_magic = b"ARPA-CACHE-1\n"
+
+def get_cache_name(arpa_name):
+  return arpa_name + ".cache"
+
+def get_md5(filename):
+  md5 = hashlib.md5()
+  with open(filename, "rb") as f:
+    for block in iter(lambda: f.read(1 << 20), b""):
+      md5.update(block)
+  return md5.hexdigest()
+
+# Write the binary cache of the model in the ARPA file arpa_name.
+# vocab is the list of words, and orders is a list of (ids, probs, backs)
+# arrays for each order, where ids has one row of word ids (indexes of
+# vocab) per n-gram. info is a dict of other values to keep in the cache,
+# e.g. the <s> probability. The cache is written to a temporary file first,
+# so that a cache file is always complete.
+def write_arpa_cache(arpa_name, vocab, orders, info = {}):
+  stat = os.stat(arpa_name)
+  arrays = [ np.frombuffer("\n".join(vocab).encode("utf-8"), dtype=np.uint8) ]
+  for order in orders:
+    arrays.extend([ np.ascontiguousarray(a) for a in order ])
+
+  # The arrays follow the header at offsets that are multiples of 8
+  header = { "source_md5": get_md5(arpa_name),
+      "source_size": stat.st_size,
+      "source_mtime": stat.st_mtime,
+      "num_orders": len(orders),
+      "info": info,
+      "arrays": [] }
+  offset = 0
+  for a in arrays:
+    header["arrays"].append({ "dtype": a.dtype.str, "shape": list(a.shape), "offset": offset })
+    offset += (a.nbytes + 7) // 8 * 8
+  header_bytes = cache_magic + json.dumps(header).encode("utf-8") + b"\n"
+  header_size = (len(header_bytes) + 7) // 8 * 8
+  header_bytes += b" " * (header_size - len(header_bytes))
+
+  cache_name = get_cache_name(arpa_name)
+  tmp_name = cache_name + ".tmp%d" % os.getpid()
+  with open(tmp_name, "wb") as f:
+    f.write(header_bytes)
+    for a in arrays:
+      f.write(a.tobytes())
+      f.write(b"\0" * ((a.nbytes + 7) // 8 * 8 - a.nbytes))
+  os.rename(tmp_name, cache_name)
+
+# Read the binary cache of the model in the ARPA file arpa_name.
+# Returns (vocab, orders, info) like the arguments of write_arpa_cache,
+# with the arrays memory-mapped from the cache file, or None if there is
+# no cache or it was made from a different file. The checksum of the ARPA
+# file is only computed if its size or modification time changed.
+def read_arpa_cache(arpa_name):
+  cache_name = get_cache_name(arpa_name)
+  if not os.path.exists(cache_name) or not os.path.exists(arpa_name):
+    return None
+  with open(cache_name, "rb") as f:
+    if f.read(len(cache_magic)) != cache_magic:
+      return None
+    header_line = f.readline()
+    header_size = (len(cache_magic) + len(header_line) + 7) // 8 * 8
+  header = json.loads(header_line.decode("utf-8"))
+
+  stat = os.stat(arpa_name)
+  if stat.st_size != header["source_size"]:
+    return None
+  if stat.st_mtime != header["source_mtime"] \
+      and get_md5(arpa_name) != header["source_md5"]:
+    return None
+
+  arrays = []
+  for a in header["arrays"]:
+    shape = tuple(a["shape"])
+    if 0 in shape:
+      arrays.append(np.zeros(shape, dtype=a["dtype"]))
+    else:
+      arrays.append(np.memmap(cache_name, dtype=a["dtype"], mode="r", \
+          offset=header_size + a["offset"], shape=shape))
+  vocab = arrays[0].tobytes().decode("utf-8").split("\n") if len(arrays[0]) > 0 else []
+  orders = [ tuple(arrays[i:i+3]) for i in range(1, len(arrays), 3) ]
+  return (vocab, orders, header["info"])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Apache 2.0
+
+# Checks a language model reversed by utils/reverse_arpa.py against the
+# forward model. Every sentence should get the same probability from the
+# forward model as its reversal gets from the reversed model, so a sample of
+# sentences is scored with both models (in batches by a pool of worker
+# processes) and the differences of the sentence log-probabilities are
+# reported. The exit status is 1 if any difference is larger than the
+# tolerance, so this can be used as a check after reversing a model.
+#
+# The sentences are sampled from a text file, or if none is given, made of
+# random words of the vocabulary, which exercises the backoff paths of both
+# models.
+
+import sys
+import random
+import multiprocessing
+from argparse import ArgumentParser
+
+from arpa_io import open_arpa, read_arpa
+from ngram_store import ArrayNgramStore, read_array_store_cache, use_numpy, inf
+
+# The models used by the worker processes. They are loaded before the
+# workers are forked, so the workers share them with the main process.
+forward_ngrams = None
+reversed_ngrams = None
+
+def load_model(arpa_name, cache):
+  ngrams = None
+  if cache:
+    ngrams = read_array_store_cache(arpa_name)
+  if ngrams != None:
+    return ngrams
+
+  try:
+    file = open_arpa(arpa_name)
+  except IOError:
+    sys.stderr.write("%s: Error: could not open %s\n" % (sys.argv[0], arpa_name))
+    sys.exit(1)
+  cngrams, entries = read_arpa(file)
+  ngrams = ArrayNgramStore(len(cngrams))
+  for n, words, prob, back in entries:
+    ngrams.add(n, words, prob, back)
+  file.close()
+  ngrams.finalize()
+  if cache:
+    try:
+      ngrams.write_cache(arpa_name)
+    except (IOError, OSError) as e:
+      sys.stderr.write("%s: Warning: could not write the cache of %s: %s\n" \
+          % (sys.argv[0], arpa_name, e))
+  return ngrams
+
+# Returns the log10 probability of word after the list of history words,
+# backing off to shorter histories, or None if the word is not in the
+# model. The lower-order n-grams that the store creates for the reversal
+# (with an infinite backoff weight) are not part of the model.
+def get_word_logprob(ngrams, history, word):
+  if ngrams.num_orders > 1:
+    history = history[-(ngrams.num_orders-1):]
+  else:
+    history = []
+  backoff = 0.0
+  for start in range(0, len(history)+1):
+    entry = ngrams.get(history[start:] + [word])
+    if entry != None and entry[1] != inf:
+      return backoff + entry[0]
+    if start < len(history):
+      entry = ngrams.get(history[start:])
+      if entry != None and entry[1] != inf:
+        backoff += entry[1]
+  return None
+
+# Returns the log10 probability of the list of words as a sentence,
+# or None if a word is not in the model
+def get_sentence_logprob(ngrams, words):
+  history = [ "<s>" ]
+  logprob = 0.0
+  for word in words + [ "</s>" ]:
+    word_logprob = get_word_logprob(ngrams, history, word)
+    if word_logprob == None:
+      return None
+    logprob += word_logprob
+    history.append(word)
+  return logprob
+
+# Score a batch of sentences with both models in a worker process.
+# Returns a list of (forward logprob, reversed logprob) for the sentences,
+# with None for the sentences that have words that are not in the models.
+def score_batch(sentences):
+  scores = []
+  for words in sentences:
+    forward_logprob = get_sentence_logprob(forward_ngrams, words)
+    reversed_words = [ w.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>") \
+        for w in reversed(words) ]
+    reversed_logprob = get_sentence_logprob(reversed_ngrams, reversed_words)
+    if forward_logprob == None or reversed_logprob == None:
+      scores.append(None)
+    else:
+      scores.append((forward_logprob, reversed_logprob))
+  return scores
+
+def get_perplexity(logprob, num_tokens):
+  try:
+    return 10.0 ** (-logprob / num_tokens)
+  except OverflowError:
+    return inf
+
+# Sample num_sentences lines of the text file with reservoir sampling,
+# keeping their order in the file
+def sample_text(text_name, num_sentences, rand):
+  sample = []
+  file = open_arpa(text_name)
+  for i, line in enumerate(file):
+    words = line.decode("utf-8").split()
+    if len(words) == 0:
+      continue
+    if len(sample) < num_sentences:
+      sample.append((i, words))
+    else:
+      j = rand.randint(0, i)
+      if j < num_sentences:
+        sample[j] = (i, words)
+  file.close()
+  sample.sort()
+  return [ words for i, words in sample ]
+
+def main():
+  parser = ArgumentParser(description='Check a language model reversed by ' \
+      + 'utils/reverse_arpa.py by comparing the sentence log-probabilities ' \
+      + 'of a sample of sentences under the forward model and of the ' \
+      + 'reversed sentences under the reversed model.')
+  parser.add_argument('--text', type=str, \
+      dest='text', default=None, \
+      help='Text file with one sentence per line to sample the sentences ' \
+      + 'from. If not given, the sentences are made of random words of ' \
+      + 'the vocabulary (default: %(default)s)')
+  parser.add_argument('--num-sentences', type=int, \
+      dest='num_sentences', default=1000, \
+      help='Number of sentences to score (default: %(default)s)')
+  parser.add_argument('--max-length', type=int, \
+      dest='max_length', default=20, \
+      help='Maximum number of words of the random sentences ' \
+      + '(default: %(default)s)')
+  parser.add_argument('--seed', type=int, \
+      dest='seed', default=0, \
+      help='Seed of the random sampling (default: %(default)s)')
+  parser.add_argument('--tolerance', type=float, \
+      dest='tolerance', default=1e-4, \
+      help='Largest allowed difference of the log10 probabilities of a ' \
+      + 'sentence (default: %(default)s)')
+  parser.add_argument('--num-worst', type=int, \
+      dest='num_worst', default=10, \
+      help='Number of sentences with the largest differences above the ' \
+      + 'tolerance to report (default: %(default)s)')
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help='Number of processes that score the sentences (default: %(default)s)')
+  parser.add_argument('--batch-size', type=int, \
+      dest='batch_size', default=100, \
+      help='Number of sentences scored by a process at a time ' \
+      + '(default: %(default)s)')
+  parser.add_argument('--cache', action='store_true', \
+      help='Load the models from their binary caches, or write the ' \
+      + 'caches if they are not up to date (see utils/reverse_arpa.py) ' \
+      + '(default: %(default)s)')
+  parser.add_argument('arpa', \
+      help='Forward language model in ARPA format')
+  parser.add_argument('reversed_arpa', \
+      help='Reversed language model in ARPA format')
+  options = parser.parse_args()
+
+  if not use_numpy:
+    sys.stderr.write("%s: Error: numpy is required\n" % sys.argv[0])
+    sys.exit(1)
+  if options.num_jobs <= 0 or options.batch_size <= 0:
+    sys.stderr.write("%s: Error: --num-jobs and --batch-size must be positive\n" % sys.argv[0])
+    sys.exit(1)
+
+  global forward_ngrams, reversed_ngrams
+  forward_ngrams = load_model(options.arpa, options.cache)
+  reversed_ngrams = load_model(options.reversed_arpa, options.cache)
+
+  rand = random.Random(options.seed)
+  if options.text != None:
+    sentences = sample_text(options.text, options.num_sentences, rand)
+  else:
+    vocab = [ w for w in forward_ngrams.vocab if w != "<s>" and w != "</s>" ]
+    if len(vocab) == 0:
+      sys.stderr.write("%s: Error: no words in %s\n" % (sys.argv[0], options.arpa))
+      sys.exit(1)
+    sentences = [ [ rand.choice(vocab) for i in range(0, rand.randint(1, options.max_length)) ] \
+        for s in range(0, options.num_sentences) ]
+
+  batches = [ sentences[i:i+options.batch_size] \
+      for i in range(0, len(sentences), options.batch_size) ]
+  if options.num_jobs > 1:
+    pool = multiprocessing.Pool(options.num_jobs)
+    scores = pool.map(score_batch, batches)
+    pool.close()
+    pool.join()
+  else:
+    scores = [ score_batch(batch) for batch in batches ]
+  scores = [ score for batch_scores in scores for score in batch_scores ]
+
+  num_skipped = 0
+  num_tokens = 0
+  forward_total = 0.0
+  reversed_total = 0.0
+  diffs = []
+  for words, score in zip(sentences, scores):
+    if score == None:
+      num_skipped += 1
+      continue
+    forward_total += score[0]
+    reversed_total += score[1]
+    num_tokens += len(words) + 1 # with </s>
+    diffs.append((abs(score[0] - score[1]), score[0], score[1], words))
+  # End for loop over sentences
+
+  print "Scored %d sentences, skipped %d with words that are not in the models" \
+      % (len(diffs), num_skipped)
+  if len(diffs) == 0:
+    sys.exit(1)
+  print "Forward model: logprob %g, perplexity %g" \
+      % (forward_total, get_perplexity(forward_total, num_tokens))
+  print "Reversed model: logprob %g, perplexity %g" \
+      % (reversed_total, get_perplexity(reversed_total, num_tokens))
+  errors = [ d for d in diffs if d[0] > options.tolerance ]
+  print "Sentence logprob differences: mean %g, max %g, %d larger than %g" \
+      % (sum([ d[0] for d in diffs ]) / len(diffs), max([ d[0] for d in diffs ]), \
+      len(errors), options.tolerance)
+  errors.sort(key = lambda d: -d[0])
+  if len(errors) > 0 and options.num_worst > 0:
+    print "Largest differences above the tolerance (difference, forward logprob, reversed logprob, sentence):"
+  for diff, forward_logprob, reversed_logprob, words in errors[:options.num_worst]:
+    print "%g %g %g %s" % (diff, forward_logprob, reversed_logprob, " ".join(words).encode("utf-8"))
+
+  if len(errors) > 0:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -2,13 +2,154 @@
 
 # Apache 2.0
 
-import sys
+# Maps the words of a text that are not in a vocabulary (one word per line)
+# to <UNK>, e.g.
+#   utils/filt.py data/lang/words.txt corpus.txt > corpus.filt.txt
+#
+# The text is read in large blocks of lines, and each block is mapped and
+# written at once. With --num-jobs, a text file is split into byte ranges at
+# line boundaries, which are mapped in parallel and written out in order.
 
-vocab=set()
-with open(sys.argv[1]) as vocabfile:
-    for line in vocabfile:
-        vocab.add(line.strip())
+import sys, os
+import tempfile, shutil
+import multiprocessing
+from argparse import ArgumentParser
 
-with open(sys.argv[2]) as textfile:
-    for line in textfile:
-        print " ".join(map(lambda word: word if word in vocab else '<UNK>', line.strip().split()))
+unk = b'<UNK>'
+# The vocabulary, which is read before the worker processes of --num-jobs
+# are forked, so that they share it
+vocab = set()
+
+# Yields lists of the lines of the file from byte position start to end,
+# without the newlines. start and end must be at line boundaries.
+def read_line_blocks(textfile, start, end, block_size):
+    if start > 0:
+        textfile.seek(start)
+    remaining = end - start if end != None else None
+    tail = b''
+    while remaining == None or remaining > 0:
+        size = block_size if remaining == None else min(block_size, remaining)
+        block = textfile.read(size)
+        if not block:
+            break
+        if remaining != None:
+            remaining -= len(block)
+        lines = (tail + block).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        yield [tail]
+
+# Map the lines of the text from byte position start to end and write them
+# to out_file. If oov_counts is not None, the words that are not in the
+# vocabulary are counted in it.
+# Returns the number of words.
+def filter_text(text_name, start, end, out_file, block_size, oov_counts):
+    num_words = 0
+    with open(text_name, 'rb') as textfile:
+        for lines in read_line_blocks(textfile, start, end, block_size):
+            out_lines = []
+            for line in lines:
+                words = line.split()
+                num_words += len(words)
+                out_lines.append(b' '.join([ word if word in vocab else unk for word in words ]))
+                if oov_counts != None:
+                    for word in words:
+                        if word not in vocab:
+                            oov_counts[word] = oov_counts.get(word, 0) + 1
+            out_lines.append(b'')
+            out_file.write(b'\n'.join(out_lines))
+    return num_words
+
+# Map a byte range of the text into a temporary file in a worker process.
+# Returns the name of the file, the number of words and the OOV counts.
+def filter_text_range(args):
+    text_name, start, end, block_size, tmp_dir, count_oovs = args
+    oov_counts = {} if count_oovs else None
+    out_file = tempfile.NamedTemporaryFile(dir = tmp_dir, delete = False)
+    num_words = filter_text(text_name, start, end, out_file, block_size, oov_counts)
+    out_file.close()
+    return (out_file.name, num_words, oov_counts)
+
+# Split the file into num_jobs byte ranges of about the same size, which
+# start at line boundaries
+def get_line_ranges(text_name, num_jobs):
+    size = os.path.getsize(text_name)
+    starts = [ 0 ]
+    with open(text_name, 'rb') as textfile:
+        for i in range(1, num_jobs):
+            # the first line that starts at or after the position
+            textfile.seek(max(size * i // num_jobs - 1, 0))
+            textfile.readline()
+            starts.append(max(textfile.tell(), starts[-1]))
+    starts.append(size)
+    return [ (starts[i], starts[i+1]) for i in range(0, num_jobs) if starts[i] < starts[i+1] ]
+
+def main():
+    parser = ArgumentParser(description='Map the words of a text that are not in ' \
+        + 'the vocabulary to <UNK> and write the text to stdout')
+    parser.add_argument('--num-jobs', type=int, \
+        dest='num_jobs', default=1, \
+        help='Number of processes that map parts of the text in parallel. ' \
+        + 'This needs the text to be a regular file (default: %(default)s)')
+    parser.add_argument('--block-size', type=int, \
+        dest='block_size', default=16 * 1024 * 1024, \
+        help='Number of bytes of the text that are read and mapped at a time ' \
+        + '(default: %(default)s)')
+    parser.add_argument('--oov-counts', type=str, \
+        dest='oov_counts', default=None, \
+        help='Write the counts of the words that are not in the vocabulary ' \
+        + 'to this file, as "word count" lines sorted by decreasing count, ' \
+        + 'and a summary to stderr (default: %(default)s)')
+    parser.add_argument('--tmp-dir', type=str, \
+        dest='tmp_dir', default=None, \
+        help='With --num-jobs, directory for the outputs of the processes ' \
+        + '(default: the system temporary directory)')
+    parser.add_argument('vocab', \
+        help='Vocabulary with one word per line')
+    parser.add_argument('text', \
+        help='Text to map')
+    options = parser.parse_args()
+
+    if options.num_jobs <= 0 or options.block_size <= 0:
+        sys.stderr.write("%s: Error: --num-jobs and --block-size must be positive\n" % sys.argv[0])
+        sys.exit(1)
+
+    with open(options.vocab, 'rb') as vocabfile:
+        for line in vocabfile:
+            vocab.add(line.strip())
+
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    oov_counts = {} if options.oov_counts != None else None
+    num_words = 0
+    # A pipe, e.g. from a process substitution, can only be read in order
+    if options.num_jobs == 1 or not os.path.isfile(options.text):
+        num_words = filter_text(options.text, 0, None, out, options.block_size, oov_counts)
+    else:
+        ranges = get_line_ranges(options.text, options.num_jobs)
+        pool = multiprocessing.Pool(options.num_jobs)
+        results = pool.map(filter_text_range, [ (options.text, start, end, \
+            options.block_size, options.tmp_dir, oov_counts != None) for start, end in ranges ])
+        pool.close()
+        pool.join()
+        for out_name, range_num_words, range_oov_counts in results:
+            with open(out_name, 'rb') as out_file:
+                shutil.copyfileobj(out_file, out, options.block_size)
+            os.remove(out_name)
+            num_words += range_num_words
+            if oov_counts != None:
+                for word, count in range_oov_counts.items():
+                    oov_counts[word] = oov_counts.get(word, 0) + count
+    out.flush()
+
+    if oov_counts != None:
+        with open(options.oov_counts, 'wb') as oov_file:
+            for word, count in sorted(oov_counts.items(), key = lambda x: (-x[1], x[0])):
+                oov_file.write(word + b' ' + str(count).encode() + b'\n')
+        num_oovs = sum(oov_counts.values())
+        sys.stderr.write("%s: %d of %d words (%.2f%%) were mapped to <UNK>, %d distinct\n" \
+            % (sys.argv[0], num_oovs, num_words, \
+            100.0 * num_oovs / num_words if num_words > 0 else 0.0, len(oov_counts)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Apache 2.0
+
+# Storage of the n-grams of an ARPA language model for utils/reverse_arpa.py.
+#
+# Both stores take the n-grams order by order through add(), in the order
+# of the ARPA file, and then finalize(). Like in the original
+# implementation of reverse_arpa.py, the probability of the <s> unigram is
+# kept in sentprob and replaced by 0.0, and the lower-order n-grams that are
+# needed for the backoff corrections of the reversed model (the prefixes,
+# the suffixes with offset one and the histories of each n-gram) are
+# created with probability 0.0 and an infinite backoff weight if they are
+# not in the model. add_backoff_ngrams() only creates these n-grams, for
+# the n-grams that are not kept in memory.
+#
+# DictNgramStore keeps a dict per order keyed by the space-joined words.
+# ArrayNgramStore interns the words to integer ids and keeps each order as
+# sorted numpy arrays of word-id tuples with separate probability and
+# backoff columns, which takes an order of magnitude less memory. These
+# arrays can be kept in the binary cache of the ARPA file (see arpa_io.py)
+# with write_cache() and loaded with read_array_store_cache().
+
+import array
+
+from arpa_io import write_arpa_cache, read_arpa_cache
+
+inf = float("inf")
+
+use_numpy = True
+try:
+  import numpy as np
+except ImportError:
+  use_numpy = False
+
+class DictNgramStore:
+  def __init__(self, num_orders):
+    self.num_orders = num_orders
+    self.ngrams = [ {} for n in range(0, num_orders) ]
+    self.sentprob = 0.0 # sentence begin unigram
+
+  def add(self, n, words, prob, back):
+    if (n==1) and words[0]=="<s>":
+      self.sentprob = prob
+      prob = 0.0
+    self.ngrams[n-1][" ".join(words)] = (prob,back)
+    self.add_backoff_ngrams(n, words)
+
+  # Create the missing lower-order n-grams needed for the n-gram with the
+  # list of words. This is called on its own for the n-grams that are not
+  # stored, i.e. the highest order in the streaming mode of reverse_arpa.py.
+  def add_backoff_ngrams(self, n, words):
+    for x in range(n-1,0,-1):
+      # add all missing backoff ngrams for reversed lm
+      l_ngram = " ".join(words[:x]) # shortened ngram
+      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
+      if l_ngram not in self.ngrams[x-1]: # create missing ngram
+        self.ngrams[x-1][l_ngram] = (0.0,inf)
+      if r_ngram not in self.ngrams[x-1]: # create missing ngram
+        self.ngrams[x-1][r_ngram] = (0.0,inf)
+
+      # add all missing backoff ngrams for forward lm
+      h_ngram = " ".join(words[n-x:]) # shortened history
+      if h_ngram not in self.ngrams[x-1]: # create missing ngram
+        self.ngrams[x-1][h_ngram] = (0.0,inf)
+
+  def finalize(self):
+    self.sorted_keys = [ sorted(ngrams.keys()) for ngrams in self.ngrams ]
+
+  # Number of n-grams of order n
+  def count(self, n):
+    return len(self.ngrams[n-1])
+
+  # Iterate over the n-grams of order n sorted by their words, optionally
+  # only over the ones from position start to end in that order.
+  # Yields (words, prob, back).
+  def entries(self, n, start = 0, end = None):
+    for ngram in self.sorted_keys[n-1][start:end]:
+      prob, back = self.ngrams[n-1][ngram]
+      yield (ngram.split(), prob, back)
+
+  # Returns (prob, back) of the n-gram with the list of words,
+  # or None if it is not in the model
+  def get(self, words):
+    return self.ngrams[len(words)-1].get(" ".join(words))
+
+# Return a 1-d array of the rows of a 2-d array of word ids as opaque
+# byte strings of the big-endian ids. These compare like the tuples of word
+# ids, so they can be sorted and searched with numpy.
+def as_row_keys(ids):
+  ids = np.ascontiguousarray(ids, dtype='>u4')
+  return ids.view(np.dtype((np.void, 4 * ids.shape[1]))).ravel()
+
+class ArrayNgramStore:
+  def __init__(self, num_orders, float_type = "float64"):
+    self.num_orders = num_orders
+    self.float_type = float_type
+    self.sentprob = 0.0 # sentence begin unigram
+
+    # While reading, the words get ids in the order they are seen and the
+    # n-grams are appended to flat arrays
+    self.word_index = {}
+    self.vocab = []
+    self.read_ids = [ array.array('i') for n in range(0, num_orders) ]
+    self.read_probs = [ array.array('d') for n in range(0, num_orders) ]
+    self.read_backs = [ array.array('d') for n in range(0, num_orders) ]
+
+    # Lower-order n-grams of the n-grams given to add_backoff_ngrams, which
+    # are not stored themselves. They are kept in a buffer that is
+    # deduplicated into a (count, x) array of ids when it gets large.
+    self.created_buffer_size = 1 << 24
+    self.created_buffers = [ array.array('i') for n in range(0, num_orders) ]
+    self.created = [ np.zeros((0, n+1), dtype=np.int32) for n in range(0, num_orders) ]
+
+    # After finalize(), the words of each order are a (count, n) array of
+    # ids of the words in sorted order, sorted by rows
+    self.ids = None
+    self.keys = None
+    self.probs = None
+    self.backs = None
+
+  def get_word_id(self, w):
+    i = self.word_index.get(w)
+    if i == None:
+      i = len(self.vocab)
+      self.word_index[w] = i
+      self.vocab.append(w)
+    return i
+
+  def add(self, n, words, prob, back):
+    if (n==1) and words[0]=="<s>":
+      self.sentprob = prob
+      prob = 0.0
+    self.read_ids[n-1].extend([ self.get_word_id(w) for w in words ])
+    self.read_probs[n-1].append(prob)
+    self.read_backs[n-1].append(back)
+
+  # Create the missing lower-order n-grams needed for the n-gram with the
+  # list of words, without storing the n-gram itself. The n-grams are
+  # created in finalize().
+  def add_backoff_ngrams(self, n, words):
+    ids = [ self.get_word_id(w) for w in words ]
+    for x in range(1, n):
+      for start in set([0, 1, n-x]):
+        self.created_buffers[x-1].extend(ids[start:start+x])
+      if len(self.created_buffers[x-1]) > self.created_buffer_size:
+        self.compact_created(x)
+
+  def compact_created(self, x):
+    if len(self.created_buffers[x-1]) > 0:
+      buffered = np.frombuffer(self.created_buffers[x-1], dtype=np.int32).reshape(-1, x)
+      created = np.concatenate((self.created[x-1], buffered))
+      self.created[x-1] = np.unique(as_row_keys(created)).view('>u4').astype(np.int32).reshape(-1, x)
+      self.created_buffers[x-1] = array.array('i')
+
+  def finalize(self):
+    # Renumber the words in sorted order, so that the order of the
+    # word-id tuples is the order of the words
+    order = sorted(range(0, len(self.vocab)), key = lambda i: self.vocab[i])
+    rank = np.empty(len(self.vocab), dtype=np.uint32)
+    rank[order] = np.arange(len(self.vocab))
+    self.vocab = [ self.vocab[i] for i in order ]
+    self.word_index = dict([ (w, i) for i, w in enumerate(self.vocab) ])
+
+    ids = []
+    probs = []
+    backs = []
+    for n in range(1, self.num_orders+1):
+      this_ids = np.frombuffer(self.read_ids[n-1], dtype=np.int32) if len(self.read_ids[n-1]) > 0 \
+          else np.zeros(0, dtype=np.int32)
+      this_ids = rank[this_ids].reshape(-1, n)
+      this_probs = np.array(self.read_probs[n-1], dtype=np.float64)
+      this_backs = np.array(self.read_backs[n-1], dtype=np.float64)
+      self.read_ids[n-1] = self.read_probs[n-1] = self.read_backs[n-1] = None
+
+      # If an n-gram is repeated, the last one is kept
+      keys = as_row_keys(this_ids)
+      index = np.argsort(keys, kind='mergesort')
+      keys = keys[index]
+      is_last = np.ones(len(keys), dtype=bool)
+      is_last[:-1] = keys[1:] != keys[:-1]
+      index = index[is_last]
+      ids.append(this_ids[index])
+      probs.append(this_probs[index])
+      backs.append(this_backs[index])
+    # End for loop over orders
+
+    # Create the missing prefixes, suffixes with offset one and histories
+    # of the n-grams of the higher orders
+    for x in range(1, self.num_orders):
+      self.compact_created(x)
+      created = [ as_row_keys(rank[self.created[x-1]]) ]
+      self.created[x-1] = None
+      for n in range(x+1, self.num_orders+1):
+        for start in set([0, 1, n-x]):
+          created.append(as_row_keys(ids[n-1][:,start:start+x]))
+      created = np.unique(np.concatenate(created))
+      keys = as_row_keys(ids[x-1])
+      found = np.zeros(len(created), dtype=bool)
+      if len(keys) > 0:
+        i = np.minimum(np.searchsorted(keys, created), len(keys) - 1)
+        found = keys[i] == created
+      created = created[~found]
+      if len(created) == 0:
+        continue
+      created_ids = np.frombuffer(created.tobytes(), dtype='>u4').astype(np.uint32).reshape(-1, x)
+      this_ids = np.concatenate((ids[x-1], created_ids))
+      index = np.argsort(as_row_keys(this_ids), kind='mergesort')
+      ids[x-1] = this_ids[index]
+      probs[x-1] = np.concatenate((probs[x-1], np.zeros(len(created))))[index]
+      backs[x-1] = np.concatenate((backs[x-1], np.repeat(inf, len(created))))[index]
+    # End for loop over orders
+
+    # The keys are views of the big-endian ids
+    self.ids = [ np.ascontiguousarray(this_ids, dtype='>u4') for this_ids in ids ]
+    self.keys = [ as_row_keys(this_ids) for this_ids in self.ids ]
+    self.probs = [ p.astype(self.float_type) for p in probs ]
+    self.backs = [ b.astype(self.float_type) for b in backs ]
+
+  # Write the n-grams to the binary cache of the ARPA file arpa_name
+  # after finalize()
+  def write_cache(self, arpa_name):
+    info = { "sentprob": self.sentprob, "float_type": self.float_type }
+    write_arpa_cache(arpa_name, self.vocab, list(zip(self.ids, self.probs, self.backs)), info)
+
+  # Number of n-grams of order n
+  def count(self, n):
+    return len(self.keys[n-1])
+
+  # Iterate over the n-grams of order n sorted by their words, optionally
+  # only over the ones from position start to end in that order.
+  # Yields (words, prob, back).
+  def entries(self, n, start = 0, end = None, chunk_size = 65536):
+    vocab = self.vocab
+    if end == None or end > self.count(n):
+      end = self.count(n)
+    for chunk_start in range(start, end, chunk_size):
+      chunk_end = min(chunk_start + chunk_size, end)
+      for ids, prob, back in zip(self.ids[n-1][chunk_start:chunk_end].tolist(),
+          self.probs[n-1][chunk_start:chunk_end].tolist(),
+          self.backs[n-1][chunk_start:chunk_end].tolist()):
+        yield ([ vocab[i] for i in ids ], prob, back)
+
+  # Returns the positions of the n-grams with the rows of the (count, x)
+  # array of word ids in their order, and -1 for the ones that are not in
+  # the model
+  def find(self, ids):
+    keys = self.keys[ids.shape[1]-1]
+    query = as_row_keys(ids)
+    if len(keys) == 0:
+      return np.repeat(-1, len(query))
+    i = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[i] == query, i, -1)
+
+  # Returns (prob, back) of the n-gram with the list of words,
+  # or None if it is not in the model
+  def get(self, words):
+    n = len(words)
+    ids = []
+    for w in words:
+      i = self.word_index.get(w)
+      if i == None:
+        return None
+      ids.append(i)
+    keys = self.keys[n-1]
+    key = as_row_keys(np.array([ids]))[0]
+    i = np.searchsorted(keys, key)
+    if i == len(keys) or keys[i] != key:
+      return None
+    return (float(self.probs[n-1][i]), float(self.backs[n-1][i]))
+
+# Load an ArrayNgramStore from the binary cache of the ARPA file arpa_name,
+# which takes the place of add() and finalize(). The arrays are
+# memory-mapped from the cache. Returns None if there is no up-to-date
+# cache with the float_type.
+def read_array_store_cache(arpa_name, float_type = "float64"):
+  cache = read_arpa_cache(arpa_name)
+  if cache == None:
+    return None
+  vocab, orders, info = cache
+  if info["float_type"] != float_type:
+    return None
+  ngrams = ArrayNgramStore(len(orders), float_type)
+  ngrams.sentprob = info["sentprob"]
+  ngrams.vocab = vocab
+  ngrams.word_index = dict([ (w, i) for i, w in enumerate(vocab) ])
+  ngrams.ids = [ ids for ids, probs, backs in orders ]
+  ngrams.keys = [ as_row_keys(ids) for ids in ngrams.ids ]
+  ngrams.probs = [ probs for ids, probs, backs in orders ]
+  ngrams.backs = [ backs for ids, probs, backs in orders ]
+  return ngrams
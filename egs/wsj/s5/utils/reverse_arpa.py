@@ -3,12 +3,16 @@
 # Copyright 2012 Mirko Hannemann BUT, mirko.hannemann@gmail.com
 
 import sys
-import codecs # for UTF-8/unicode
+import os
+import heapq
+import tempfile
+import multiprocessing
+from argparse import ArgumentParser
 
-if len(sys.argv) != 2:
-    print 'usage: reverse_arpa arpa.in'
-    sys.exit()
-arpaname = sys.argv[1]
+from arpa_io import open_arpa, read_arpa
+from ngram_store import DictNgramStore, ArrayNgramStore, read_array_store_cache, use_numpy, inf
+if use_numpy:
+  import numpy as np
 
 #\data\
 #ngram 1=4
@@ -30,96 +34,6 @@ arpaname = sys.argv[1]
 #-0.23940	a b </s>
 #\end\
 
-# read language model in ARPA format
-try:
-  file = codecs.open(arpaname, "r", "utf-8")
-except IOError:
-  print 'file not found: ' + arpaname
-  sys.exit()
-
-text=file.readline()
-while (text and text[:6] != "\\data\\"): text=file.readline()
-if not text:
-  print "invalid ARPA file"
-  sys.exit()
-#print text,
-while (text and text[:5] != "ngram"): text=file.readline()
-
-# get ngram counts
-cngrams=[]
-n=0
-while (text and text[:5] == "ngram"):
-  ind = text.split("=")
-  counts = int(ind[1].strip())
-  r = ind[0].split()
-  read_n = int(r[1].strip())
-  if read_n != n+1:
-    print "invalid ARPA file:", text
-    sys.exit()
-  n = read_n
-  cngrams.append(counts)
-  #print text,
-  text=file.readline()
-
-# read all n-grams order by order
-sentprob = 0.0 # sentence begin unigram
-ngrams=[]
-inf=float("inf")
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  while (text and "-grams:" not in text): text=file.readline()
-  if n != int(text[1]):
-    print "invalid ARPA file:", text
-    sys.exit()
-  #print text,cngrams[n-1]
-  this_ngrams={} # stores all read ngrams
-  for ng in range(cngrams[n-1]):
-    while (text and len(text.split())<2):
-      text=file.readline()
-      if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))):
-      break # to deal with incorrect ARPA files
-    entry = text.split()
-    prob = float(entry[0])
-    if len(entry)>n+1:
-      back = float(entry[-1])
-      words = entry[1:n+1]
-    else:
-      back = 0.0
-      words = entry[1:]
-    ngram = " ".join(words)
-    if (n==1) and words[0]=="<s>":
-      sentprob = prob
-      prob = 0.0
-    this_ngrams[ngram] = (prob,back)
-    #print prob,ngram.encode("utf-8"),back
-
-    for x in range(n-1,0,-1):
-      # add all missing backoff ngrams for reversed lm
-      l_ngram = " ".join(words[:x]) # shortened ngram
-      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
-      if l_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][l_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", l_ngram, "inf"
-      if r_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][r_ngram] = (0.0,inf)
-        #print ngram, "create 0.0", r_ngram, "inf",x,n,h_ngram
-
-      # add all missing backoff ngrams for forward lm
-      h_ngram = " ".join(words[n-x:]) # shortened history
-      if h_ngram not in ngrams[x-1]: # create missing ngram
-        ngrams[x-1][h_ngram] = (0.0,inf)
-        #print "create inf", h_ngram, "0.0"
-    text=file.readline()
-    if (not text) or ((len(text.split())==1) and (("-grams:" in text) or (text[:5] == "\\end\\"))): break
-  ngrams.append(this_ngrams)
-
-while (text and text[:5] != "\\end\\"): text=file.readline()
-if not text:
-  print "invalid ARPA file"
-  sys.exit()
-file.close()
-#print text,
-
 #fourgram "maxent" model (b(ABCD)=0):
 #p(A)+b(A) A 0
 #p(AB)+b(AB)-b(A)-p(B) AB 0
@@ -132,57 +46,427 @@ file.close()
 #p(ABC)+b(ABC)-p(BC)+p(AB)-p(B)+p(A) CBA 0
 #p(ABCD)+b(ABCD)-p(BCD)+p(ABC)-p(BC)+p(AB)-p(B)+p(A) DCBA 0
 
+# Look up the probability of a shortened n-gram needed for the
+# reversed probability of rev_ngram
+def get_prob(ngrams, words, rev_ngram):
+  entry = ngrams.get(words)
+  if entry == None:
+    sys.stderr.write((rev_ngram+": not found "+" ".join(words)+"\n").encode("utf-8"))
+    sys.exit(1)
+  return entry[0]
+
+# Compute the line of the n-gram with the list of words in the reversed
+# ARPA model. offset is the reversed weight of <s>, which is set by the
+# unigram <s> and added to the bigrams starting with <s>.
+# Returns the line and the new offset.
+def reverse_ngram(ngrams, n, words, prob, back, offset):
+  # reverse word order
+  rstr = " ".join(reversed(words))
+  # swap <s> and </s>
+  rev_ngram = rstr.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>")
+
+  revprob = prob
+  if (back != inf): # only backoff weights from not newly created ngrams
+    revprob = revprob + back
+  # sum all missing terms in decreasing ngram order
+  for x in range(n-1,0,-1):
+    p_l = get_prob(ngrams, words[:x], rev_ngram) # shortened ngram
+    revprob = revprob + p_l
+
+    p_r = get_prob(ngrams, words[1:1+x], rev_ngram) # shortened ngram with offset one
+    revprob = revprob - p_r
+
+  if n != ngrams.num_orders: #not highest order
+    rev_back = 0.0
+    if rev_ngram[:3] == "<s>": # special handling since arpa2fst ignores <s> weight
+      if n == 1:
+        offset = revprob # remember <s> weight
+        revprob = ngrams.sentprob # apply <s> weight from forward model
+        rev_back = offset
+      elif n == 2:
+        revprob = revprob + offset # add <s> weight to bigrams starting with <s>
+    if (back != inf): # only backoff weights from not newly created ngrams
+      line = "%s %s %s" % (revprob, rev_ngram.encode("utf-8"), rev_back)
+    else:
+      line = "%s %s -100000.0" % (revprob, rev_ngram.encode("utf-8"))
+  else: # highest order - no backoff weights
+    if (n==2) and (rev_ngram[:3] == "<s>"): revprob = revprob + offset
+    line = "%s %s" % (revprob, rev_ngram.encode("utf-8"))
+  return (line, offset)
+
+# The reversed words of the vocabulary of an ArrayNgramStore, with <s> and
+# </s> swapped, and whether they start with <s>
+reversed_vocab = None
+
+# Vectorized version of reverse_ngram for the n-grams of order n of an
+# ArrayNgramStore, which are given as a (count, n) array of word ids and
+# arrays of their probabilities and backoff weights. The shortened n-grams
+# are looked up for all the n-grams at once and their probabilities are
+# summed in the same order as in reverse_ngram, so the results are the
+# same. Returns the lines and the new offset, or None if an n-gram needed
+# for the reversal is not found.
+def reverse_ngram_array(ngrams, n, ids, probs, backs, offset):
+  global reversed_vocab
+  if reversed_vocab == None or reversed_vocab[0] is not ngrams:
+    words = [ w.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>") \
+        for w in ngrams.vocab ]
+    reversed_vocab = (ngrams, [ w.encode("utf-8") for w in words ], \
+        np.array([ w[:3] == "<s>" for w in words ], dtype=bool))
+  rev_words = reversed_vocab[1]
+  # Only the first word of a reversed n-gram can start it with <s>
+  starts_with_s = reversed_vocab[2][ids[:,-1]]
+
+  revprob = np.array(probs, dtype=np.float64)
+  backs = np.asarray(backs, dtype=np.float64)
+  has_back = backs != inf # only backoff weights from not newly created ngrams
+  revprob[has_back] += backs[has_back]
+  # sum all missing terms in decreasing ngram order
+  for x in range(n-1,0,-1):
+    l_index = ngrams.find(ids[:,:x]) # shortened ngram
+    r_index = ngrams.find(ids[:,1:1+x]) # shortened ngram with offset one
+    if (l_index < 0).any() or (r_index < 0).any():
+      return None
+    revprob += ngrams.probs[x-1][l_index]
+    revprob -= ngrams.probs[x-1][r_index]
+
+  rev_ngrams = [ " ".join([ rev_words[i] for i in reversed(row) ]) for row in ids.tolist() ]
+  if n != ngrams.num_orders: #not highest order
+    rev_back = np.zeros(len(ids))
+    if n == 1 and starts_with_s.any():
+      offset = float(revprob[starts_with_s][-1]) # remember <s> weight
+      rev_back[starts_with_s] = revprob[starts_with_s]
+      revprob[starts_with_s] = ngrams.sentprob # apply <s> weight from forward model
+    elif n == 2:
+      revprob[starts_with_s] += offset # add <s> weight to bigrams starting with <s>
+    lines = [ "%s %s %s" % (p, r, b) if h else "%s %s -100000.0" % (p, r) \
+        for p, r, b, h in zip(revprob.tolist(), rev_ngrams, rev_back.tolist(), has_back.tolist()) ]
+  else: # highest order - no backoff weights
+    if n == 2:
+      revprob[starts_with_s] += offset
+    lines = [ "%s %s" % (p, r) for p, r in zip(revprob.tolist(), rev_ngrams) ]
+  return (lines, offset)
+
+# The n-gram store used by the worker processes of --num-jobs. It is set
+# before the workers are forked, so they share it with the main process.
+worker_ngrams = None
+
+# Maximum number of n-grams reversed by a worker process at a time
+shard_size = 100000
+
+# Reverse the n-grams of order n from position start to end in the
+# worker process. Returns the text of the reversed lines, or None if an
+# n-gram needed for the reversal is not found.
+def reverse_ngram_range(args):
+  n, start, end, offset = args
+  if hasattr(worker_ngrams, "find"):
+    result = reverse_ngram_array(worker_ngrams, n, worker_ngrams.ids[n-1][start:end], \
+        worker_ngrams.probs[n-1][start:end], worker_ngrams.backs[n-1][start:end], offset)
+    if result != None:
+      return "".join([ line + "\n" for line in result[0] ])
+  # Without the vectorized version, or to report the missing n-gram
+  lines = []
+  try:
+    for words, prob, back in worker_ngrams.entries(n, start, end):
+      line, offset = reverse_ngram(worker_ngrams, n, words, prob, back, offset)
+      lines.append(line + "\n")
+  except SystemExit:
+    return None
+  return "".join(lines)
+
+# Reverse a list of (words, prob, back) of the highest order, the first
+# of which is at position pos in the ARPA file. Returns the lines for the
+# sorted chunks of reverse_highest_order, or None if an n-gram needed for
+# the reversal is not found.
+def reverse_ngram_batch(args):
+  n, batch, offset, pos = args
+  if hasattr(worker_ngrams, "find"):
+    word_index = worker_ngrams.word_index
+    ids = np.array([ [ word_index[w] for w in words ] for words, prob, back in batch ], \
+        dtype=np.uint32).reshape(-1, n)
+    result = reverse_ngram_array(worker_ngrams, n, ids, [ prob for words, prob, back in batch ], \
+        [ back for words, prob, back in batch ], offset)
+    if result != None:
+      return [ "%s\t%012d\t%s\n" % (" ".join(words).encode("utf-8"), pos + i, line) \
+          for i, ((words, prob, back), line) in enumerate(zip(batch, result[0])) ]
+  lines = []
+  try:
+    for words, prob, back in batch:
+      line, offset = reverse_ngram(worker_ngrams, n, words, prob, back, offset)
+      lines.append("%s\t%012d\t%s\n" % (" ".join(words).encode("utf-8"), pos, line))
+      pos += 1
+  except SystemExit:
+    return None
+  return lines
+
 # compute new reversed ARPA model
-print "\\data\\"
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print "ngram "+str(n)+"="+str(len(ngrams[n-1].keys()))
-offset = 0.0
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print "\\"+str(n)+"-grams:"
-  keys = ngrams[n-1].keys()
-  keys.sort()
-  for ngram in keys:
-    prob = ngrams[n-1][ngram]
-    # reverse word order
-    words = ngram.split()
-    rstr = " ".join(reversed(words))
-    # swap <s> and </s>
-    rev_ngram = rstr.replace("<s>","<temp>").replace("</s>","<s>").replace("<temp>","</s>")
-
-    revprob = prob[0]
-    if (prob[1] != inf): # only backoff weights from not newly created ngrams
-      revprob = revprob + prob[1]
-    #print prob[0],prob[1]
-    # sum all missing terms in decreasing ngram order
-    for x in range(n-1,0,-1): 
-      l_ngram = " ".join(words[:x]) # shortened ngram
-      if l_ngram not in ngrams[x-1]:
-        sys.stderr.write(rev_ngram+": not found "+l_ngram+"\n")
-      p_l = ngrams[x-1][l_ngram][0]
-      #print p_l,l_ngram
-      revprob = revprob + p_l
-
-      r_ngram = " ".join(words[1:1+x]) # shortened ngram with offset one
-      if r_ngram not in ngrams[x-1]:
-        sys.stderr.write(rev_ngram+": not found "+r_ngram+"\n")
-      p_r = ngrams[x-1][r_ngram][0]
-      #print -p_r,r_ngram
-      revprob = revprob - p_r
-
-    if n != len(cngrams): #not highest order
-      back = 0.0
-      if rev_ngram[:3] == "<s>": # special handling since arpa2fst ignores <s> weight
-        if n == 1:
-          offset = revprob # remember <s> weight
-          revprob = sentprob # apply <s> weight from forward model
-          back = offset
-        elif n == 2:
-          revprob = revprob + offset # add <s> weight to bigrams starting with <s>
-      if (prob[1] != inf): # only backoff weights from not newly created ngrams
-        print revprob,rev_ngram.encode("utf-8"),back
+# If highest_order is given, the highest order is not taken from ngrams,
+# but is a tuple of the count and an iterator over the lines of the
+# already reversed n-grams (see reverse_highest_order)
+# If pool is given, the n-grams of each order are reversed in shards by the
+# worker processes of the pool, which must have been created after setting
+# worker_ngrams to ngrams. The n-grams of an ArrayNgramStore are also
+# reversed in shards without a pool, with the vectorized reverse_ngram_array.
+def write_reversed_arpa(ngrams, out, highest_order = None, pool = None):
+  global worker_ngrams
+  worker_ngrams = ngrams
+  num_orders = ngrams.num_orders
+  out.write("\\data\\\n")
+  for n in range(1,num_orders+1): # unigrams, bigrams, trigrams
+    if highest_order != None and n == num_orders:
+      out.write("ngram "+str(n)+"="+str(highest_order[0])+"\n")
+    else:
+      out.write("ngram "+str(n)+"="+str(ngrams.count(n))+"\n")
+  offset = 0.0
+  for n in range(1,num_orders+1): # unigrams, bigrams, trigrams
+    out.write("\\"+str(n)+"-grams:\n")
+    if highest_order != None and n == num_orders:
+      for line in highest_order[1]:
+        out.write(line)
+      continue
+    if pool != None or hasattr(ngrams, "find"):
+      # The offset only changes on the unigram <s>, and only its value
+      # after the unigrams is used by the other orders
+      if n == 2:
+        offset = get_sentence_begin_offset(ngrams)
+      shards = [ (n, start, start + shard_size, offset) \
+          for start in range(0, ngrams.count(n), shard_size) ]
+      if pool != None:
+        texts = pool.imap(reverse_ngram_range, shards)
+      else:
+        texts = ( reverse_ngram_range(shard) for shard in shards )
+      for text in texts:
+        if text == None:
+          sys.exit(1)
+        out.write(text)
+      continue
+    for words, prob, back in ngrams.entries(n):
+      line, offset = reverse_ngram(ngrams, n, words, prob, back, offset)
+      out.write(line+"\n")
+  out.write("\\end\\\n")
+
+# The reversed weight of <s>, as computed from the unigrams in
+# write_reversed_arpa
+def get_sentence_begin_offset(ngrams):
+  offset = 0.0
+  for words, prob, back in ngrams.entries(1):
+    line, offset = reverse_ngram(ngrams, 1, words, prob, back, offset)
+  return offset
+
+# Reverse the n-grams of the highest order, which are not kept in memory,
+# with an external sort: the reversed lines are written in sorted chunks
+# of chunk_size n-grams to tmp_dir, which are then merged in the order of
+# the forward n-grams into one file. Like in the in-memory mode, the last
+# one of repeated n-grams is kept.
+# If pool is given, the n-grams are reversed in batches by its num_jobs
+# worker processes like in write_reversed_arpa.
+# Returns the number of n-grams and the merged file, which has one line of
+# the reversed model per n-gram.
+def reverse_highest_order(ngrams, entries, chunk_size, tmp_dir, pool = None, num_jobs = 1):
+  n = ngrams.num_orders
+  offset = 0.0
+  if n == 2:
+    offset = get_sentence_begin_offset(ngrams)
+
+  # Each line of the chunks is the forward n-gram, the position of the
+  # n-gram in the ARPA file and the reversed line, separated by tabs, so
+  # that the lines sort by the n-gram and then the position
+  def write_chunk(lines):
+    lines.sort()
+    chunk = tempfile.TemporaryFile(dir = tmp_dir)
+    chunk.writelines(lines)
+    chunk.seek(0)
+    return chunk
+
+  # The batches are given to the pool a few at a time, so that the
+  # n-grams that are waiting to be reversed stay in memory only briefly
+  def reverse_batches(batches):
+    if pool != None:
+      results = pool.map(reverse_ngram_batch, batches)
+    else:
+      results = [ reverse_ngram_batch(batch) for batch in batches ]
+    for result in results:
+      if result == None:
+        sys.exit(1)
+      lines.extend(result)
+
+  chunks = []
+  lines = []
+  batches = []
+  batch = []
+  pos = 0
+  for this_n, words, prob, back in entries:
+    if this_n != n:
+      continue
+    batch.append((words, prob, back))
+    if len(batch) >= shard_size:
+      batches.append((n, batch, offset, pos))
+      pos += len(batch)
+      batch = []
+      if len(batches) >= 2 * num_jobs:
+        reverse_batches(batches)
+        batches = []
+        if len(lines) >= chunk_size:
+          chunks.append(write_chunk(lines))
+          lines = []
+  # End for loop over n-grams
+  batches.append((n, batch, offset, pos))
+  reverse_batches(batches)
+  batches = batch = None
+  chunks.append(write_chunk(lines))
+  lines = None
+
+  count = 0
+  merged = tempfile.TemporaryFile(dir = tmp_dir)
+  prev_ngram = None
+  prev_line = None
+  for line in heapq.merge(*chunks):
+    ngram, pos, line = line.split("\t", 2)
+    if ngram != prev_ngram and prev_ngram != None:
+      merged.write(prev_line)
+      count += 1
+    prev_ngram = ngram
+    prev_line = line
+  if prev_ngram != None:
+    merged.write(prev_line)
+    count += 1
+  for chunk in chunks:
+    chunk.close()
+  merged.seek(0)
+  return (count, merged)
+
+def main():
+  parser = ArgumentParser(description='Reverse a language model in ARPA format. ' \
+      + 'Files ending in .gz are read and written with gzip compression.')
+  parser.add_argument('--storage', type=str, \
+      dest='storage', default='dict', choices=('dict', 'array'), \
+      help='How the n-grams are stored in memory. "array" keeps each ' \
+      + 'order as sorted numpy arrays of word ids, which takes an ' \
+      + 'order of magnitude less memory than "dict" for large models, ' \
+      + 'and computes the reversed probabilities with vectorized lookups ' \
+      + '(default: %(default)s)')
+  parser.add_argument('--float32', action='store_true', \
+      help='With --storage array, store the probabilities and backoff ' \
+      + 'weights as 32-bit floats. This saves memory, but the reversed ' \
+      + 'probabilities are computed from the rounded values ' \
+      + '(default: %(default)s)')
+  parser.add_argument('--streaming', action='store_true', \
+      help='Read the ARPA file twice and keep only the lower orders in ' \
+      + 'memory. The highest order, which is usually the largest, is ' \
+      + 'reversed on the second pass and sorted on disk in chunks. ' \
+      + 'The ARPA file must be a regular file, not stdin or a pipe ' \
+      + '(default: %(default)s)')
+  parser.add_argument('--chunk-size', type=int, \
+      dest='chunk_size', default=1000000, \
+      help='With --streaming, number of n-grams of the highest order ' \
+      + 'that are sorted in memory at a time (default: %(default)s)')
+  parser.add_argument('--tmp-dir', type=str, \
+      dest='tmp_dir', default=None, \
+      help='With --streaming, directory for the temporary files of the ' \
+      + 'sort (default: the system temporary directory)')
+  parser.add_argument('--num-jobs', type=int, \
+      dest='num_jobs', default=1, \
+      help='Number of processes that reverse the n-grams of each order ' \
+      + 'in parallel (default: %(default)s)')
+  parser.add_argument('--cache', action='store_true', \
+      help='With --storage array, load the n-grams from the binary cache ' \
+      + '<arpa>.cache next to the ARPA file if it is up to date, and ' \
+      + 'otherwise write it after reading the ARPA file. Later runs on ' \
+      + 'the same model then skip reading the ARPA file and memory-map ' \
+      + 'the n-grams (default: %(default)s)')
+  parser.add_argument('arpa', \
+      help='Language model in ARPA format')
+  parser.add_argument('reversed_arpa', nargs='?', default='-', \
+      help='Output file for the reversed model (default: stdout)')
+  options = parser.parse_args()
+
+  if options.storage == 'array' and not use_numpy:
+    sys.stderr.write("%s: Error: --storage array requires the numpy module\n" % sys.argv[0])
+    sys.exit(1)
+  if options.cache and options.storage != 'array':
+    sys.stderr.write("%s: Error: --cache requires --storage array\n" % sys.argv[0])
+    sys.exit(1)
+  if options.cache and options.streaming:
+    sys.stderr.write("%s: Error: --cache and --streaming cannot be used together\n" % sys.argv[0])
+    sys.exit(1)
+  # --streaming reads the ARPA file twice
+  if options.streaming and (options.arpa == "-" \
+      or (os.path.exists(options.arpa) and not os.path.isfile(options.arpa))):
+    sys.stderr.write("%s: Error: --streaming needs the ARPA file to be a regular file, " \
+        "not stdin or a pipe\n" % sys.argv[0])
+    sys.exit(1)
+  if options.chunk_size <= 0:
+    sys.stderr.write("%s: Error: --chunk-size must be positive\n" % sys.argv[0])
+    sys.exit(1)
+  if options.num_jobs <= 0:
+    sys.stderr.write("%s: Error: --num-jobs must be positive\n" % sys.argv[0])
+    sys.exit(1)
+
+  arpaname = options.arpa
+  float_type = 'float32' if options.float32 else 'float64'
+  ngrams = None
+  streaming = False
+  if options.cache:
+    ngrams = read_array_store_cache(arpaname, float_type)
+
+  if ngrams == None:
+    # read language model in ARPA format
+    try:
+      file = open_arpa(arpaname)
+    except IOError:
+      sys.stderr.write("%s: Error: file not found: %s\n" % (sys.argv[0], arpaname))
+      sys.exit(1)
+
+    cngrams, entries = read_arpa(file)
+    if options.storage == 'array':
+      ngrams = ArrayNgramStore(len(cngrams), float_type)
+    else:
+      ngrams = DictNgramStore(len(cngrams))
+    # With --streaming, the highest order is only used for creating the
+    # missing lower-order n-grams on the first pass
+    streaming = options.streaming and len(cngrams) > 1
+    for n, words, prob, back in entries:
+      if streaming and n == len(cngrams):
+        ngrams.add_backoff_ngrams(n, words)
       else:
-        print revprob,rev_ngram.encode("utf-8"),"-100000.0"
-    else: # highest order - no backoff weights
-      if (n==2) and (rev_ngram[:3] == "<s>"): revprob = revprob + offset
-      print revprob,rev_ngram.encode("utf-8")
-print "\\end\\"
+        ngrams.add(n, words, prob, back)
+    if arpaname != "-":
+      file.close()
+    ngrams.finalize()
+
+    if options.cache:
+      try:
+        ngrams.write_cache(arpaname)
+      except (IOError, OSError) as e:
+        sys.stderr.write("%s: Warning: could not write the cache of %s: %s\n" \
+            % (sys.argv[0], arpaname, e))
+
+  # The workers are forked after the model is loaded, so that they share
+  # the n-grams with the main process
+  global worker_ngrams
+  worker_ngrams = ngrams
+  pool = None
+  if options.num_jobs > 1:
+    pool = multiprocessing.Pool(options.num_jobs)
+
+  out = open_arpa(options.reversed_arpa, "w")
+  if not streaming:
+    write_reversed_arpa(ngrams, out, pool = pool)
+  else:
+    file = open_arpa(arpaname)
+    cngrams, entries = read_arpa(file)
+    highest_order = reverse_highest_order(ngrams, entries, options.chunk_size, options.tmp_dir, pool, options.num_jobs)
+    file.close()
+    write_reversed_arpa(ngrams, out, highest_order, pool)
+    highest_order[1].close()
+  # stdout (or its binary buffer) is only flushed, not closed
+  if options.reversed_arpa == "-":
+    out.flush()
+  else:
+    out.close()
+
+  if pool != None:
+    pool.close()
+    pool.join()
+
+if __name__ == '__main__':
+  main()